@@ -0,0 +1,401 @@
+"""
+Controle de admissão das consultas
+Limita quantos navegadores Chromium rodam ao mesmo tempo (slots configurados e
+memória livre) e enfileira o excesso em faixas de prioridade (interativa e
+bulk), cada uma com fila justa entre clientes: FIFO dentro de cada cliente_id,
+fila ponderada (start-time fair queuing) entre clientes
+"""
+import asyncio
+import bisect
+import collections
+import itertools
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+PRIORIDADE_INTERATIVA = "interativa"
+PRIORIDADE_BULK = "bulk"
+PRIORIDADES = (PRIORIDADE_INTERATIVA, PRIORIDADE_BULK)
+
+
+class ConsultaPreemptada(Exception):
+    """Consulta bulk cedeu o navegador a uma consulta interativa num limite de etapa"""
+
+    def __init__(self, etapa: str):
+        self.etapa = etapa
+        super().__init__(f"Consulta bulk preemptada na etapa '{etapa}' para atender consulta interativa")
+
+
+def _ler_inteiro(caminho: str) -> Optional[int]:
+    try:
+        with open(caminho) as f:
+            valor = f.read().strip()
+    except OSError:
+        return None
+    if not valor.isdigit():
+        return None  # "max" (sem limite) ou conteúdo inesperado
+    return int(valor)
+
+
+def ler_memoria_disponivel_mb() -> Optional[float]:
+    """
+    Memória disponível para o processo em MB
+
+    Considera o limite do cgroup (container Docker) quando houver, e o
+    MemAvailable do /proc/meminfo; retorna o menor dos dois.
+
+    Returns:
+        MB disponíveis, ou None se não for possível medir
+    """
+    candidatos = []
+
+    # cgroup v2
+    limite = _ler_inteiro("/sys/fs/cgroup/memory.max")
+    uso = _ler_inteiro("/sys/fs/cgroup/memory.current")
+    if limite is None or uso is None:
+        # cgroup v1
+        limite = _ler_inteiro("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+        uso = _ler_inteiro("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    if limite is not None and uso is not None and limite < 1 << 60:
+        candidatos.append((limite - uso) / (1024 * 1024))
+
+    try:
+        with open("/proc/meminfo") as f:
+            for linha in f:
+                if linha.startswith("MemAvailable:"):
+                    candidatos.append(int(linha.split()[1]) / 1024)
+                    break
+    except OSError:
+        pass
+
+    return min(candidatos) if candidatos else None
+
+
+def parse_pesos_clientes(valor: str) -> Dict[str, float]:
+    """
+    Converte "cliente_a:2,cliente_b:0.5" em {"cliente_a": 2.0, "cliente_b": 0.5}
+
+    Entradas inválidas são ignoradas (peso padrão 1).
+    """
+    pesos = {}
+    for item in (valor or "").split(","):
+        if ":" not in item:
+            continue
+        cliente_id, peso = item.rsplit(":", 1)
+        try:
+            if float(peso) > 0:
+                pesos[cliente_id.strip()] = float(peso)
+        except ValueError:
+            logger.warning(f"Peso inválido para cliente {cliente_id.strip()}: {peso}")
+    return pesos
+
+
+class _Pedido:
+    """Consulta aguardando slot na fila"""
+
+    _sequencia = itertools.count()
+
+    def __init__(self, ao_enfileirar, cliente_id: Optional[str], prioridade: str, inicio_virtual: float):
+        self.futuro: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.ao_enfileirar = ao_enfileirar
+        self.cliente_id = cliente_id
+        self.prioridade = prioridade
+        self.inicio_virtual = inicio_virtual
+        self.seq = next(self._sequencia)
+        self.enfileirado_em = time.monotonic()
+        self.ultima_posicao: Optional[int] = None
+
+    def __lt__(self, outro: "_Pedido") -> bool:
+        return (self.inicio_virtual, self.seq) < (outro.inicio_virtual, outro.seq)
+
+
+class Reserva:
+    """Slot de navegador concedido a uma consulta"""
+
+    def __init__(self, controle: "ControleAdmissao", prioridade: str, espera: float):
+        self._controle = controle
+        self.prioridade = prioridade
+        self.espera = espera
+        self.cedendo = False
+
+    async def checkpoint(self, etapa: str):
+        """
+        Ponto de preempção, chamado nos limites de etapa da consulta
+
+        Raises:
+            ConsultaPreemptada: Se esta consulta é bulk e há consulta
+                interativa aguardando sem slot livre
+        """
+        if self._controle._deve_ceder(self):
+            self.cedendo = True
+            self._controle._cedendo += 1
+            self._controle._preempcoes += 1
+            logger.info(f"Consulta bulk cedendo navegador na etapa '{etapa}'")
+            raise ConsultaPreemptada(etapa)
+
+
+class ControleAdmissao:
+    """
+    Admissão de consultas por slots de navegador e folga de memória
+
+    Uso:
+        async with controle.slot(ao_enfileirar=callback, cliente_id=cliente_id) as reserva:
+            ...  # navegador pode ser aberto aqui
+            await reserva.checkpoint("etapa")  # ponto de preempção
+
+    Enquanto não houver slot, `ao_enfileirar(posicao, espera_estimada_segundos)`
+    é chamado sempre que a posição na fila muda.
+
+    Faixas de prioridade: a fila interativa é sempre atendida antes da bulk, e
+    `slots_reservados_interativos` navegadores nunca são ocupados por consultas
+    bulk. Uma consulta bulk em andamento cede o navegador no próximo
+    `checkpoint` se houver consulta interativa esperando sem slot livre.
+
+    Dentro de cada faixa, cada pedido recebe uma etiqueta de início virtual
+    `max(V, ultimo_fim[cliente])`, e o cliente avança `1 / peso` a cada
+    pedido. A fila é ordenada pela etiqueta, então um cliente com importação
+    em massa não atrasa quem chega depois com poucos pedidos.
+    """
+
+    def __init__(
+        self,
+        max_navegadores: int = 3,
+        memoria_minima_livre_mb: float = 256,
+        memoria_por_navegador_mb: float = 400,
+        ler_memoria: Callable[[], Optional[float]] = ler_memoria_disponivel_mb,
+        duracao_estimada_inicial: float = 180.0,
+        intervalo_reavaliacao: float = 5.0,
+        pesos_clientes: Optional[Dict[str, float]] = None,
+        slots_reservados_interativos: int = 0
+    ):
+        self.max_navegadores = max(1, max_navegadores)
+        self.memoria_minima_livre_mb = memoria_minima_livre_mb
+        self.memoria_por_navegador_mb = memoria_por_navegador_mb
+        self.ler_memoria = ler_memoria
+        self.intervalo_reavaliacao = intervalo_reavaliacao
+        self.pesos_clientes = pesos_clientes or {}
+        # Pelo menos um navegador sempre disponível para bulk
+        self.slots_reservados_interativos = min(max(0, slots_reservados_interativos), self.max_navegadores - 1)
+
+        self._ativos = 0
+        self._ativos_bulk = 0
+        self._filas: Dict[str, List[_Pedido]] = {prioridade: [] for prioridade in PRIORIDADES}
+        self._duracao_media = duracao_estimada_inicial
+        self._reavaliacao: Optional[asyncio.Task] = None
+        self._bloqueado_por_memoria = False
+
+        # Preempção de consultas bulk
+        self._cedendo = 0
+        self._preempcoes = 0
+
+        # Estado da fila justa (por faixa)
+        self._tempo_virtual: Dict[str, float] = {prioridade: 0.0 for prioridade in PRIORIDADES}
+        self._ultimo_fim: Dict[str, Dict[str, float]] = {prioridade: {} for prioridade in PRIORIDADES}
+
+        # Tempo de espera na fila por faixa (amostras recentes)
+        self._esperas: Dict[str, Deque[float]] = {
+            prioridade: collections.deque(maxlen=500) for prioridade in PRIORIDADES
+        }
+
+    @property
+    def ativos(self) -> int:
+        return self._ativos
+
+    @property
+    def tamanho_fila(self) -> int:
+        return sum(len(fila) for fila in self._filas.values())
+
+    def _memoria_suficiente(self) -> bool:
+        # Sem nenhum navegador ativo sempre admite, para nunca travar a fila
+        if self._ativos == 0:
+            return True
+
+        disponivel = self.ler_memoria()
+        if disponivel is None:
+            return True
+
+        return disponivel - self.memoria_por_navegador_mb >= self.memoria_minima_livre_mb
+
+    def _slots_bulk(self) -> int:
+        return self.max_navegadores - self.slots_reservados_interativos
+
+    def espera_estimada(self, posicao: int, prioridade: str = PRIORIDADE_INTERATIVA) -> float:
+        """Segundos estimados até a consulta na posição `posicao` (1 = próxima) iniciar"""
+        slots = self.max_navegadores if prioridade == PRIORIDADE_INTERATIVA else self._slots_bulk()
+        ondas = math.ceil(posicao / max(1, slots))
+        return ondas * self._duracao_media
+
+    def _proximo_pedido(self) -> Optional[_Pedido]:
+        """Retira o próximo pedido que pode ocupar um slot livre agora"""
+        interativa = self._filas[PRIORIDADE_INTERATIVA]
+        if interativa:
+            return interativa.pop(0)
+
+        bulk = self._filas[PRIORIDADE_BULK]
+        if bulk and self._ativos_bulk < self._slots_bulk():
+            return bulk.pop(0)
+
+        return None
+
+    def _despachar(self):
+        """Libera slots para o início das filas enquanto houver capacidade"""
+        self._bloqueado_por_memoria = False
+
+        while self.tamanho_fila and self._ativos < self.max_navegadores:
+            if not self._memoria_suficiente():
+                self._bloqueado_por_memoria = True
+                logger.warning("Admissão pausada: memória livre insuficiente para outro navegador")
+                break
+
+            pedido = self._proximo_pedido()
+            if pedido is None:
+                break  # Só há bulk na fila e os slots livres são reservados
+            if pedido.futuro.done():
+                continue  # Cancelado enquanto aguardava
+
+            self._ativos += 1
+            if pedido.prioridade == PRIORIDADE_BULK:
+                self._ativos_bulk += 1
+            self._tempo_virtual[pedido.prioridade] = max(
+                self._tempo_virtual[pedido.prioridade], pedido.inicio_virtual
+            )
+            pedido.futuro.set_result(time.monotonic() - pedido.enfileirado_em)
+
+        if self._bloqueado_por_memoria and (self._reavaliacao is None or self._reavaliacao.done()):
+            self._reavaliacao = asyncio.create_task(self._reavaliar_memoria())
+
+        self._notificar_posicoes()
+
+    async def _reavaliar_memoria(self):
+        while self._bloqueado_por_memoria and self.tamanho_fila:
+            await asyncio.sleep(self.intervalo_reavaliacao)
+            self._despachar()
+
+    def _notificar_posicoes(self):
+        # Consultas bulk ficam atrás de toda a fila interativa
+        fila = self._filas[PRIORIDADE_INTERATIVA] + self._filas[PRIORIDADE_BULK]
+        for indice, pedido in enumerate(fila):
+            posicao = indice + 1
+            if pedido.ao_enfileirar and pedido.ultima_posicao != posicao:
+                pedido.ultima_posicao = posicao
+                asyncio.create_task(self._chamar_callback(
+                    pedido.ao_enfileirar, posicao, self.espera_estimada(posicao, pedido.prioridade)
+                ))
+
+    @staticmethod
+    async def _chamar_callback(callback, posicao: int, espera: float):
+        try:
+            await callback(posicao, espera)
+        except Exception as e:
+            logger.warning(f"Erro ao notificar posição na fila: {e}")
+
+    def _deve_ceder(self, reserva: Reserva) -> bool:
+        if reserva.prioridade != PRIORIDADE_BULK or reserva.cedendo:
+            return False
+        if self._ativos < self.max_navegadores:
+            return False  # Há slot livre, a interativa não depende desta consulta
+        # Cada consulta interativa na fila precisa de uma consulta bulk cedendo
+        return len(self._filas[PRIORIDADE_INTERATIVA]) > self._cedendo
+
+    def _liberar(self, reserva: Reserva, duracao: float):
+        self._ativos -= 1
+        if reserva.prioridade == PRIORIDADE_BULK:
+            self._ativos_bulk -= 1
+        if reserva.cedendo:
+            self._cedendo -= 1
+        else:
+            # Média móvel exponencial da duração das consultas (estimativa de espera)
+            self._duracao_media = 0.8 * self._duracao_media + 0.2 * duracao
+        self._despachar()
+
+    def _enfileirar(self, ao_enfileirar, cliente_id: Optional[str], prioridade: str) -> _Pedido:
+        chave = cliente_id or ""
+        peso = self.pesos_clientes.get(chave, 1.0)
+        ultimo_fim = self._ultimo_fim[prioridade]
+
+        inicio = max(self._tempo_virtual[prioridade], ultimo_fim.get(chave, 0.0))
+        ultimo_fim[chave] = inicio + 1.0 / peso
+
+        pedido = _Pedido(ao_enfileirar, cliente_id, prioridade, inicio)
+        bisect.insort(self._filas[prioridade], pedido)
+        return pedido
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        ao_enfileirar: Optional[Callable[[int, float], Awaitable[None]]] = None,
+        cliente_id: Optional[str] = None,
+        prioridade: str = PRIORIDADE_INTERATIVA
+    ):
+        """Aguarda um slot de navegador (faixa de prioridade + fila justa) e o libera ao sair do bloco"""
+        if prioridade not in PRIORIDADES:
+            raise ValueError(f"prioridade inválida: {prioridade}")
+
+        pedido = self._enfileirar(ao_enfileirar, cliente_id, prioridade)
+        self._despachar()
+
+        try:
+            espera = await pedido.futuro
+        except asyncio.CancelledError:
+            if pedido.futuro.done() and not pedido.futuro.cancelled():
+                # Slot concedido no mesmo instante do cancelamento
+                self._liberar(Reserva(self, prioridade, 0.0), self._duracao_media)
+            elif pedido in self._filas[prioridade]:
+                self._filas[prioridade].remove(pedido)
+                self._notificar_posicoes()
+            raise
+
+        self._esperas[prioridade].append(espera)
+        if espera > 1:
+            logger.info(f"Slot de navegador ({prioridade}) concedido após {espera:.1f}s na fila")
+
+        reserva = Reserva(self, prioridade, espera)
+        inicio = time.monotonic()
+        try:
+            yield reserva
+        finally:
+            self._liberar(reserva, time.monotonic() - inicio)
+
+    @staticmethod
+    def _percentil(amostras, p: float) -> Optional[float]:
+        if not amostras:
+            return None
+        ordenadas = sorted(amostras)
+        indice = min(len(ordenadas) - 1, math.ceil(p * len(ordenadas)) - 1)
+        return round(ordenadas[max(0, indice)], 2)
+
+    def metricas(self) -> dict:
+        fila_por_cliente: Dict[str, int] = {}
+        for fila in self._filas.values():
+            for pedido in fila:
+                chave = pedido.cliente_id or "-"
+                fila_por_cliente[chave] = fila_por_cliente.get(chave, 0) + 1
+
+        faixas = {}
+        for prioridade in PRIORIDADES:
+            esperas = self._esperas[prioridade]
+            faixas[prioridade] = {
+                "fila": len(self._filas[prioridade]),
+                "espera_p50_segundos": self._percentil(esperas, 0.50),
+                "espera_p95_segundos": self._percentil(esperas, 0.95),
+                "amostras": len(esperas)
+            }
+
+        return {
+            "navegadores_ativos": self._ativos,
+            "navegadores_bulk": self._ativos_bulk,
+            "max_navegadores": self.max_navegadores,
+            "slots_reservados_interativos": self.slots_reservados_interativos,
+            "fila": self.tamanho_fila,
+            "fila_por_cliente": fila_por_cliente,
+            "faixas": faixas,
+            "preempcoes": self._preempcoes,
+            "bloqueado_por_memoria": self._bloqueado_por_memoria,
+            "memoria_disponivel_mb": self.ler_memoria(),
+            "duracao_media_segundos": round(self._duracao_media, 1)
+        }
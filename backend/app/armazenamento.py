@@ -0,0 +1,388 @@
+"""
+Armazenamento de shapefiles endereçado por conteúdo
+O ZIP é gravado no Storage em `sha256/<2 primeiros>/<hash>.zip` e registrado
+em `duploa_shapefiles`. Consultas guardam só a referência (hash): o mesmo
+arquivo baixado por outro cliente ou num refresh não é enviado de novo.
+O envio lê o arquivo do disco em partes (memória limitada a uma parte) e,
+acima de uma parte, usa upload retomável (TUS): uma falha de rede retoma do
+último byte confirmado em vez de reenviar tudo
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import shutil
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Dict, Set, Tuple
+
+from .camadas import compactar_camadas, variantes_camada
+from .repositorio import ErroRepositorio
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_BLOCO = 1024 * 1024
+TUS_VERSAO = "1.0.0"
+
+
+def hash_arquivo(caminho: str) -> str:
+    """SHA-256 (hex) do arquivo, lido em blocos"""
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def caminho_conteudo(sha256: str) -> str:
+    """Caminho no bucket para o conteúdo (prefixo evita diretórios enormes)"""
+    return f"sha256/{sha256[:2]}/{sha256}.zip"
+
+
+def _ja_existe(erro: ErroRepositorio) -> bool:
+    """O Storage recusou por já existir objeto no caminho (409 ou "Duplicate")"""
+    return erro.status == 409 or "duplicate" in str(erro).lower()
+
+
+class StorageSupabase:
+    """
+    Envio ao Supabase Storage sem sobrescrever objetos
+
+    Arquivos de até `tamanho_parte` vão numa única requisição; maiores usam o
+    protocolo TUS (`/storage/v1/upload/resumable`), parte a parte. Se uma
+    parte falha, o offset confirmado é consultado (HEAD) e o envio continua
+    dali, até `max_retomadas` vezes. O Supabase exige partes de 6 MB.
+    """
+
+    def __init__(self, repositorio, tamanho_parte: int = 6 * 1024 * 1024, max_retomadas: int = 5):
+        self.repositorio = repositorio
+        self.tamanho_parte = tamanho_parte
+        self.max_retomadas = max_retomadas
+
+        self.partes_enviadas = 0
+        self.retomadas = 0
+
+    def url_publica(self, bucket: str, caminho: str) -> str:
+        return self.repositorio.url_publica(bucket, caminho)
+
+    async def enviar(self, bucket: str, caminho: str, arquivo: str, content_type: str) -> bool:
+        """
+        Envia o arquivo do disco para `bucket/caminho`
+
+        Returns:
+            True se enviado, False se o objeto já existia
+
+        Raises:
+            ErroRepositorio: Falha no envio (após as retomadas)
+        """
+        tamanho = Path(arquivo).stat().st_size
+        if tamanho <= self.tamanho_parte:
+            conteudo = await asyncio.to_thread(Path(arquivo).read_bytes)
+            return await self.enviar_conteudo(bucket, caminho, conteudo, content_type)
+        try:
+            return await self._enviar_retomavel(bucket, caminho, arquivo, tamanho, content_type)
+        except ErroRepositorio as e:
+            if _ja_existe(e):
+                return False
+            raise
+
+    async def enviar_conteudo(self, bucket: str, caminho: str, conteudo: bytes, content_type: str) -> bool:
+        """Envia bytes já em memória numa única requisição (True se enviado, False se já existia)"""
+        try:
+            await self.repositorio.enviar_arquivo(bucket, caminho, conteudo, content_type=content_type, upsert=False)
+        except ErroRepositorio as e:
+            if _ja_existe(e):
+                return False
+            raise
+        self.partes_enviadas += 1
+        return True
+
+    async def ler(self, bucket: str, caminho: str) -> bytes:
+        return await self.repositorio.baixar_arquivo(bucket, caminho)
+
+    async def verificar(self, bucket: str) -> Dict[str, Any]:
+        """Sonda de saúde: o bucket existe e a chave tem acesso (levanta ErroRepositorio)"""
+        resposta = await self.repositorio.requisicao("GET", f"/storage/v1/bucket/{bucket}")
+        return {"bucket": bucket, "publico": resposta.json().get("public")}
+
+    async def _enviar_retomavel(self, bucket: str, caminho: str, arquivo: str, tamanho: int, content_type: str) -> bool:
+        metadados = ",".join(
+            f"{chave} {base64.b64encode(valor.encode()).decode()}"
+            for chave, valor in (("bucketName", bucket), ("objectName", caminho), ("contentType", content_type))
+        )
+        criacao = await self.repositorio.requisicao(
+            "POST",
+            "/storage/v1/upload/resumable",
+            cabecalhos={
+                "Tus-Resumable": TUS_VERSAO,
+                "Upload-Length": str(tamanho),
+                "Upload-Metadata": metadados,
+                "x-upsert": "false"
+            },
+            idempotente=False
+        )
+        url_upload = criacao.headers.get("location")
+        if not url_upload:
+            raise ErroRepositorio("TUS: resposta sem Location", status=criacao.status_code)
+
+        offset = 0
+        falhas = 0
+        with open(arquivo, "rb") as f:
+            while offset < tamanho:
+                f.seek(offset)
+                parte = await asyncio.to_thread(f.read, self.tamanho_parte)
+                try:
+                    # Não repetir às cegas: parte do corpo pode ter chegado ao servidor
+                    resposta = await self.repositorio.requisicao(
+                        "PATCH",
+                        url_upload,
+                        conteudo=parte,
+                        cabecalhos={
+                            "Tus-Resumable": TUS_VERSAO,
+                            "Upload-Offset": str(offset),
+                            "Content-Type": "application/offset+octet-stream"
+                        },
+                        idempotente=False
+                    )
+                    offset = int(resposta.headers.get("upload-offset", offset + len(parte)))
+                    self.partes_enviadas += 1
+                except ErroRepositorio as e:
+                    falhas += 1
+                    if falhas > self.max_retomadas:
+                        raise
+                    self.retomadas += 1
+                    logger.warning(f"[ARMAZEM] Parte em {offset}/{tamanho} de {caminho} falhou ({e}), retomando")
+                    await asyncio.sleep(self.repositorio.backoff_inicial * 2 ** (falhas - 1))
+                    estado = await self.repositorio.requisicao(
+                        "HEAD", url_upload, cabecalhos={"Tus-Resumable": TUS_VERSAO}
+                    )
+                    offset = int(estado.headers.get("upload-offset", offset))
+
+        return True
+
+
+class StorageLocal:
+    """
+    Stand-in do Storage em disco (desenvolvimento e testes), mesma interface
+
+    Copia em partes para `<caminho>.parcial` e renomeia no fim; um envio
+    interrompido continua do tamanho já gravado do arquivo parcial. Envios
+    para o mesmo destino são serializados: dois não leem o mesmo offset e
+    anexam o conteúdo duas vezes.
+    """
+
+    def __init__(self, diretorio: str, tamanho_parte: int = 6 * 1024 * 1024):
+        self.diretorio = Path(diretorio).resolve()
+        self.tamanho_parte = tamanho_parte
+
+        # Destino -> (trava, envios usando a trava); removida quando ninguém mais usa
+        self._travas: Dict[Path, Tuple[asyncio.Lock, int]] = {}
+
+        self.partes_enviadas = 0
+        self.retomadas = 0
+
+    def url_publica(self, bucket: str, caminho: str) -> str:
+        return (self.diretorio / bucket / caminho).as_uri()
+
+    async def enviar(self, bucket: str, caminho: str, arquivo: str, content_type: str) -> bool:
+        destino = self.diretorio / bucket / caminho
+        async with self._exclusivo(destino):
+            if destino.exists():
+                return False
+            await asyncio.to_thread(self._copiar_em_partes, arquivo, destino)
+        return True
+
+    async def enviar_conteudo(self, bucket: str, caminho: str, conteudo: bytes, content_type: str) -> bool:
+        destino = self.diretorio / bucket / caminho
+        async with self._exclusivo(destino):
+            if destino.exists():
+                return False
+            await asyncio.to_thread(self._gravar, destino, conteudo)
+        self.partes_enviadas += 1
+        return True
+
+    async def ler(self, bucket: str, caminho: str) -> bytes:
+        return await asyncio.to_thread((self.diretorio / bucket / caminho).read_bytes)
+
+    async def verificar(self, bucket: str) -> Dict[str, Any]:
+        """Sonda de saúde: o diretório aceita escrita (levanta OSError)"""
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        if not os.access(self.diretorio, os.W_OK):
+            raise OSError(f"Sem permissão de escrita em {self.diretorio}")
+        livre = shutil.disk_usage(self.diretorio).free
+        return {"bucket": bucket, "livre_mb": livre // (1024 * 1024)}
+
+    @asynccontextmanager
+    async def _exclusivo(self, destino: Path):
+        """Um envio por vez para o destino (verificação + escrita do .parcial)"""
+        trava, usos = self._travas.get(destino, (None, 0))
+        trava = trava or asyncio.Lock()
+        self._travas[destino] = (trava, usos + 1)
+        try:
+            async with trava:
+                yield
+        finally:
+            trava, usos = self._travas[destino]
+            if usos == 1:
+                del self._travas[destino]
+            else:
+                self._travas[destino] = (trava, usos - 1)
+
+    @staticmethod
+    def _gravar(destino: Path, conteudo: bytes):
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        temporario = destino.with_name(destino.name + ".parcial")
+        temporario.write_bytes(conteudo)
+        os.replace(temporario, destino)
+
+    def _copiar_em_partes(self, arquivo: str, destino: Path):
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        parcial = destino.with_name(destino.name + ".parcial")
+        offset = parcial.stat().st_size if parcial.exists() else 0
+        if offset:
+            self.retomadas += 1
+
+        with open(arquivo, "rb") as origem, open(parcial, "ab") as saida:
+            origem.seek(offset)
+            for parte in iter(lambda: origem.read(self.tamanho_parte), b""):
+                saida.write(parte)
+                self.partes_enviadas += 1
+
+        os.replace(parcial, destino)
+
+
+class ArmazemShapefiles:
+    """
+    Upload de shapefiles com deduplicação por SHA-256
+
+    Antes de enviar, consulta `duploa_shapefiles` (e um cache em memória dos
+    hashes já confirmados). Se o conteúdo já existe, só devolve a referência.
+    O objeto nunca é sobrescrito: em corrida entre réplicas, o objeto já
+    existente no Storage também conta como armazenado. `storage` é
+    StorageSupabase (padrão) ou StorageLocal.
+    """
+
+    def __init__(
+        self,
+        repositorio,
+        storage=None,
+        bucket: str = "car-shapefiles",
+        tabela: str = "duploa_shapefiles"
+    ):
+        self.repositorio = repositorio
+        self.storage = storage or StorageSupabase(repositorio)
+        self.bucket = bucket
+        self.tabela = tabela
+
+        self._conhecidos: Set[str] = set()
+
+        self.enviados = 0
+        self.deduplicados = 0
+        self.bytes_economizados = 0
+
+    async def armazenar(self, caminho_arquivo: str) -> Dict[str, Any]:
+        """
+        Armazena o ZIP (se o conteúdo ainda não existir)
+
+        Args:
+            caminho_arquivo: ZIP baixado do CAR
+
+        Returns:
+            Dict com sha256, url, tamanho e enviado (False se deduplicado)
+
+        Raises:
+            ErroRepositorio: Falha no Storage ou no registro do conteúdo
+        """
+        sha256 = await asyncio.to_thread(hash_arquivo, caminho_arquivo)
+        tamanho = Path(caminho_arquivo).stat().st_size
+        caminho = caminho_conteudo(sha256)
+        referencia = {
+            "sha256": sha256,
+            "url": self.storage.url_publica(self.bucket, caminho),
+            "tamanho": tamanho,
+            "enviado": False
+        }
+
+        if await self._existe(sha256):
+            self.deduplicados += 1
+            self.bytes_economizados += tamanho
+            logger.info(f"[ARMAZEM] Shapefile {sha256[:12]} já armazenado, upload ignorado")
+            return referencia
+
+        if await self.storage.enviar(self.bucket, caminho, caminho_arquivo, "application/zip"):
+            referencia["enviado"] = True
+            self.enviados += 1
+        else:
+            # Outra réplica enviou o mesmo conteúdo primeiro
+            self.deduplicados += 1
+            logger.info(f"[ARMAZEM] Shapefile {sha256[:12]} enviado em paralelo por outra réplica")
+
+        await self.repositorio.table(self.tabela).upsert({
+            "sha256": sha256,
+            "storage_path": caminho,
+            "tamanho": tamanho
+        }, on_conflict="sha256").execute()
+        self._conhecidos.add(sha256)
+
+        logger.info(f"[ARMAZEM] Shapefile {sha256[:12]} armazenado ({tamanho} bytes)")
+        return referencia
+
+    async def _existe(self, sha256: str) -> bool:
+        if sha256 in self._conhecidos:
+            return True
+        existente = await self.repositorio.table(self.tabela).select("sha256").eq("sha256", sha256).limit(1).execute()
+        if existente.data:
+            self._conhecidos.add(sha256)
+            return True
+        return False
+
+    def metricas(self) -> Dict[str, int]:
+        return {
+            "enviados": self.enviados,
+            "deduplicados": self.deduplicados,
+            "bytes_economizados": self.bytes_economizados,
+            "partes_enviadas": self.storage.partes_enviadas,
+            "retomadas": self.storage.retomadas
+        }
+
+
+class ArmazemCamadas:
+    """
+    Camadas GeoJSON como objetos pré-comprimidos endereçados por conteúdo
+
+    Cada camada vira `sha256/<xx>/<hash>.geojson.gz` e `.geojson.br` no
+    bucket; a linha da consulta guarda só o manifesto (URL, ETag, feições,
+    bbox, variantes). Camadas idênticas (refresh do mesmo CAR) apontam para
+    os mesmos objetos.
+    """
+
+    def __init__(self, storage, bucket: str = "car-camadas", nivel_gzip: int = 9, nivel_brotli: int = 9):
+        self.storage = storage
+        self.bucket = bucket
+        self.nivel_gzip = nivel_gzip
+        self.nivel_brotli = nivel_brotli
+
+    async def armazenar(self, consulta_id: str, geojson_layers: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        Compacta e envia as camadas (em paralelo)
+
+        Returns:
+            Manifesto nome -> {url, etag, feicoes, bytes, bbox, variantes}
+
+        Raises:
+            ErroRepositorio: Falha ao enviar alguma camada
+        """
+        manifesto, artefatos = await asyncio.to_thread(
+            compactar_camadas, consulta_id, geojson_layers,
+            nivel_gzip=self.nivel_gzip, nivel_brotli=self.nivel_brotli
+        )
+        await asyncio.gather(*(
+            self.storage.enviar_conteudo(self.bucket, objeto, conteudo, "application/octet-stream")
+            for objeto, conteudo in artefatos.items()
+        ))
+        return manifesto
+
+    async def ler(self, entrada: Dict[str, Any], codificacao: str = "gzip") -> bytes:
+        """GeoJSON da camada na codificação pedida ("gzip" ou "br"), já comprimido"""
+        return await self.storage.ler(self.bucket, variantes_camada(entrada)[codificacao]["objeto"])
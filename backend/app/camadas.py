@@ -0,0 +1,222 @@
+"""
+Resumo das camadas GeoJSON de uma consulta
+A mensagem de conclusão leva só identificadores, estatísticas e, por camada,
+URL, ETag, quantidade de feições e bbox; o GeoJSON é buscado sob demanda via
+HTTP em vez de trafegar inteiro no WebSocket. O mesmo manifesto fica na linha
+da consulta (coluna `camadas`), e o GeoJSON em objetos pré-comprimidos (gzip
+e brotli) no Storage, servidos conforme o Accept-Encoding
+"""
+import gzip
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Campos do demonstrativo repetidos no resumo da conclusão
+CAMPOS_RESUMO = ("situacao_cadastro", "registro_inscricao_car", "condicao_externa")
+CAMPOS_RESUMO_IMOVEL = ("area_imovel_rural", "modulos_fiscais", "municipio_uf", "data_ultima_retificacao")
+
+# Variantes gravadas na ingestão, em ordem de preferência na negociação
+CODIFICACOES = ("br", "gzip")
+EXTENSOES = {"br": "br", "gzip": "gz"}
+
+
+def _brotli():
+    """Módulo brotli, ou None se não instalado (camadas ficam só com gzip)"""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def serializar_geojson(geojson: Dict[str, Any]) -> bytes:
+    """JSON canônico (chaves ordenadas, sem espaços) usado para ETag e resposta"""
+    return json.dumps(geojson, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def etag_conteudo(conteudo: bytes) -> str:
+    """ETag forte (entre aspas) derivado do SHA-256 do conteúdo"""
+    return '"' + hashlib.sha256(conteudo).hexdigest()[:32] + '"'
+
+
+def calcular_bbox(geojson: Dict[str, Any]) -> Optional[List[float]]:
+    """
+    Retângulo envolvente [oeste, sul, leste, norte] de todas as coordenadas
+
+    Percorre as coordenadas em qualquer profundidade, o que cobre todos os
+    tipos de geometria (e anéis sem o aninhamento esperado).
+    """
+    minx = miny = float("inf")
+    maxx = maxy = float("-inf")
+
+    pilha = [
+        (feicao.get("geometry") or {}).get("coordinates")
+        for feicao in geojson.get("features") or []
+    ]
+    while pilha:
+        coordenadas = pilha.pop()
+        if not isinstance(coordenadas, list) or not coordenadas:
+            continue
+        if isinstance(coordenadas[0], (int, float)):
+            x, y = coordenadas[0], coordenadas[1]
+            minx, maxx = min(minx, x), max(maxx, x)
+            miny, maxy = min(miny, y), max(maxy, y)
+        else:
+            pilha.extend(coordenadas)
+
+    if minx == float("inf"):
+        return None
+    return [minx, miny, maxx, maxy]
+
+
+def resumo_parcial_camada(geojson: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Resultado parcial de uma camada recém-convertida: só contagem e bbox
+
+    A geometria não passa pelo WebSocket (nem fica no buffer de retomada da
+    sessão); o cliente a lê pela URL do manifesto quando a camada é armazenada.
+    """
+    return {"feicoes": len(geojson.get("features") or []), "bbox": calcular_bbox(geojson)}
+
+
+def caminho_camada(sha256: str, codificacao: str = "gzip") -> str:
+    """Caminho no bucket de camadas para o conteúdo numa codificação"""
+    return f"sha256/{sha256[:2]}/{sha256}.geojson.{EXTENSOES[codificacao]}"
+
+
+def etag_variante(etag: str, codificacao: Optional[str]) -> str:
+    """ETag forte de uma representação (cada codificação tem bytes diferentes)"""
+    return etag if not codificacao else f'{etag[:-1]}-{codificacao}"'
+
+
+def variantes_camada(entrada: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Variantes de uma entrada do manifesto (manifestos só com gzip usavam `objeto`)"""
+    if entrada.get("variantes"):
+        return entrada["variantes"]
+    return {"gzip": {"objeto": entrada["objeto"], "bytes": entrada.get("bytes_gzip")}}
+
+
+def escolher_codificacao(accept_encoding: Optional[str], disponiveis: Iterable[str]) -> Optional[str]:
+    """
+    Codificação a servir conforme o Accept-Encoding (valores q)
+
+    Returns:
+        "br", "gzip" ou None (sem compressão)
+    """
+    aceitas = {}
+    for item in (accept_encoding or "").split(","):
+        partes = [p.strip() for p in item.split(";")]
+        if not partes[0]:
+            continue
+        q = 1.0
+        for parametro in partes[1:]:
+            if parametro.startswith("q="):
+                try:
+                    q = float(parametro[2:])
+                except ValueError:
+                    q = 0.0
+        aceitas[partes[0].lower()] = q
+
+    escolhida = None
+    melhor_q = 0.0
+    for codificacao in CODIFICACOES:
+        if codificacao not in disponiveis:
+            continue
+        q = aceitas.get(codificacao, aceitas.get("*", 0.0))
+        if q > melhor_q:
+            escolhida, melhor_q = codificacao, q
+    return escolhida
+
+
+def _resumo_camada(url: str, geojson: Dict[str, Any], conteudo: bytes) -> Dict[str, Any]:
+    return {
+        "url": url,
+        "etag": etag_conteudo(conteudo),
+        "feicoes": len(geojson.get("features") or []),
+        "bytes": len(conteudo),
+        "bbox": calcular_bbox(geojson)
+    }
+
+
+def resumir_camadas(
+    consulta_id: str,
+    geojson_layers: Dict[str, Any],
+    url_base: str = "/api/consultas"
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Manifesto das camadas de uma consulta
+
+    Args:
+        consulta_id: ID da consulta em duploa_consultas_car
+        geojson_layers: Camadas GeoJSON (nome -> FeatureCollection)
+        url_base: Prefixo da rota de leitura das camadas
+
+    Returns:
+        Dict nome -> {url, etag, feicoes, bytes, bbox}
+    """
+    return {
+        nome: _resumo_camada(f"{url_base}/{consulta_id}/camadas/{nome}", geojson, serializar_geojson(geojson))
+        for nome, geojson in (geojson_layers or {}).items()
+    }
+
+
+def compactar_camadas(
+    consulta_id: str,
+    geojson_layers: Dict[str, Any],
+    url_base: str = "/api/consultas",
+    nivel_gzip: int = 9,
+    nivel_brotli: int = 9
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, bytes]]:
+    """
+    Manifesto das camadas e o GeoJSON de cada uma comprimido (gzip e brotli)
+
+    A compressão roda uma única vez, na ingestão; a leitura só escolhe a
+    variante. Ela é determinística (gzip com mtime=0): o mesmo GeoJSON gera
+    sempre os mesmos objetos, endereçados pelo SHA-256 do JSON canônico.
+
+    Returns:
+        (manifesto nome -> {url, etag, feicoes, bytes, bbox, variantes},
+         objetos caminho -> bytes comprimidos)
+    """
+    brotli = _brotli()
+    manifesto = {}
+    artefatos = {}
+    for nome, geojson in (geojson_layers or {}).items():
+        conteudo = serializar_geojson(geojson)
+        sha256 = hashlib.sha256(conteudo).hexdigest()
+
+        comprimidos = {"gzip": gzip.compress(conteudo, compresslevel=nivel_gzip, mtime=0)}
+        if brotli:
+            comprimidos["br"] = brotli.compress(conteudo, mode=brotli.MODE_TEXT, quality=nivel_brotli)
+
+        manifesto[nome] = _resumo_camada(f"{url_base}/{consulta_id}/camadas/{nome}", geojson, conteudo)
+        manifesto[nome]["variantes"] = {}
+        for codificacao, comprimido in comprimidos.items():
+            objeto = caminho_camada(sha256, codificacao)
+            artefatos[objeto] = comprimido
+            manifesto[nome]["variantes"][codificacao] = {"objeto": objeto, "bytes": len(comprimido)}
+    return manifesto, artefatos
+
+
+def manifesto_para_consulta(
+    manifesto: Dict[str, Dict[str, Any]],
+    consulta_id: str,
+    url_base: str = "/api/consultas"
+) -> Dict[str, Dict[str, Any]]:
+    """Manifesto de outra consulta reaproveitado (mesmos objetos, URLs desta consulta)"""
+    return {
+        nome: {**entrada, "url": f"{url_base}/{consulta_id}/camadas/{nome}"}
+        for nome, entrada in (manifesto or {}).items()
+    }
+
+
+def resumir_resultados(resultados: Dict[str, Any]) -> Dict[str, Any]:
+    """Estatísticas do imóvel para a mensagem de conclusão (sem o GeoJSON)"""
+    demonstrativo = resultados.get("dados_demonstrativo") or {}
+    imovel = demonstrativo.get("dados_imovel_rural") or {}
+
+    resumo = {campo: demonstrativo.get(campo) for campo in CAMPOS_RESUMO}
+    resumo.update({campo: imovel.get(campo) for campo in CAMPOS_RESUMO_IMOVEL})
+    resumo["camadas"] = len(resultados.get("camadas") or resultados.get("geojson_layers") or {})
+    resumo["shapefile_size"] = resultados.get("shapefile_size")
+    return resumo
@@ -0,0 +1,256 @@
+"""
+Fila compartilhada de CAPTCHAs
+Desacopla a resolução do CAPTCHA do cliente que pediu a consulta: cada CAPTCHA
+vira um item que qualquer operador autorizado (ou o próprio cliente) pode
+resolver, com expiração, reemissão de itens parados e estatísticas por operador
+"""
+import asyncio
+import collections
+import logging
+import math
+import time
+import uuid
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CaptchaAbortado(Exception):
+    """O CAPTCHA não vai ser resolvido: o download deve parar, não tentar de novo"""
+    pass
+
+
+class CaptchaExpirado(CaptchaAbortado, TimeoutError):
+    """Ninguém resolveu o CAPTCHA dentro da validade"""
+    pass
+
+
+def parse_tokens_operadores(valor: str) -> Dict[str, str]:
+    """Converte "ana:tok1,bruno:tok2" em {"tok1": "ana", "tok2": "bruno"}"""
+    tokens = {}
+    for item in (valor or "").split(","):
+        if ":" not in item:
+            continue
+        operador_id, token = item.split(":", 1)
+        if operador_id.strip() and token.strip():
+            tokens[token.strip()] = operador_id.strip()
+    return tokens
+
+
+class ItemCaptcha:
+    """CAPTCHA aguardando solução"""
+
+    def __init__(self, imagem: bytes, numero_car: str, cliente_id: Optional[str], validade: float):
+        self.id = str(uuid.uuid4())
+        self.imagem = imagem
+        self.numero_car = numero_car
+        self.cliente_id = cliente_id
+        self.criado_em = time.monotonic()
+        self.expira_em = self.criado_em + validade
+        self.futuro: asyncio.Future = asyncio.get_running_loop().create_future()
+
+        # Empréstimo atual a um operador
+        self.operador: Optional[str] = None
+        self.entregue_em: Optional[float] = None
+        self.prazo_operador: Optional[float] = None
+        self.emissoes = 0
+
+        self.respondido_por: Optional[str] = None
+
+
+class _EstatisticasOperador:
+    def __init__(self):
+        self.latencias: Deque[float] = collections.deque(maxlen=500)
+        self.respondidos = 0
+        self.acertos = 0
+        self.erros = 0
+        self.reemitidos = 0
+
+    def resumo(self) -> dict:
+        latencias = sorted(self.latencias)
+        avaliados = self.acertos + self.erros
+        return {
+            "respondidos": self.respondidos,
+            "latencia_media_segundos": round(sum(latencias) / len(latencias), 2) if latencias else None,
+            "latencia_p95_segundos": round(latencias[max(0, math.ceil(0.95 * len(latencias)) - 1)], 2) if latencias else None,
+            "acertos": self.acertos,
+            "erros": self.erros,
+            "precisao": round(self.acertos / avaliados, 3) if avaliados else None,
+            "reemitidos": self.reemitidos
+        }
+
+
+class FilaCaptcha:
+    """
+    Fila de CAPTCHAs compartilhada entre operadores
+
+    - `publicar` cria o item; `aguardar` espera a primeira resposta válida
+      (de qualquer operador) até a validade do item.
+    - `puxar` entrega um lote de itens a um operador; itens não respondidos
+      dentro de `prazo_operador` voltam para a fila (reemissão).
+    - `registrar_resultado` informa se o portal aceitou a resposta, para a
+      precisão por operador.
+    """
+
+    def __init__(self, validade: float = 240.0, prazo_operador: float = 60.0):
+        self.validade = validade
+        self.prazo_operador = prazo_operador
+
+        self._itens: Dict[str, ItemCaptcha] = {}
+        self._novo_item = asyncio.Event()
+        self._stats: Dict[str, _EstatisticasOperador] = collections.defaultdict(_EstatisticasOperador)
+        self._aguardando_resultado: "collections.OrderedDict[str, str]" = collections.OrderedDict()  # item_id -> operador
+        self._operadores_online: Dict[str, int] = collections.defaultdict(int)
+        self._expirados = 0
+
+    @property
+    def pendentes(self) -> int:
+        return len(self._itens)
+
+    @property
+    def operadores_online(self) -> int:
+        return sum(1 for conexoes in self._operadores_online.values() if conexoes > 0)
+
+    def conectar_operador(self, operador_id: str):
+        self._operadores_online[operador_id] += 1
+        self._novo_item.set()
+
+    def desconectar_operador(self, operador_id: str):
+        self._operadores_online[operador_id] -= 1
+        # Devolve imediatamente o que estava com o operador
+        for item in self._itens.values():
+            if item.operador == operador_id:
+                self._devolver(item)
+        self._novo_item.set()
+
+    def publicar(self, imagem: bytes, numero_car: str, cliente_id: Optional[str] = None) -> ItemCaptcha:
+        item = ItemCaptcha(imagem, numero_car, cliente_id, self.validade)
+        self._itens[item.id] = item
+        self._novo_item.set()
+        logger.info(f"CAPTCHA {item.id} publicado na fila ({self.pendentes} pendentes)")
+        return item
+
+    async def aguardar(self, item: ItemCaptcha, timeout: Optional[float] = None) -> str:
+        """
+        Aguarda a solução do item
+
+        Raises:
+            CaptchaExpirado: Se ninguém resolveu dentro da validade/timeout
+        """
+        limite = max(0.0, item.expira_em - time.monotonic())
+        if timeout is not None:
+            limite = min(limite, timeout)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(item.futuro), timeout=limite)
+        except asyncio.TimeoutError:
+            self._expirados += 1
+            logger.warning(f"CAPTCHA {item.id} expirou sem solução")
+            raise CaptchaExpirado("Timeout aguardando solução do CAPTCHA")
+        finally:
+            self._itens.pop(item.id, None)
+            if not item.futuro.done():
+                item.futuro.cancel()
+
+    async def resolver(
+        self,
+        imagem: bytes,
+        numero_car: str,
+        cliente_id: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> str:
+        """Publica o CAPTCHA e aguarda o operador mais rápido"""
+        item = self.publicar(imagem, numero_car, cliente_id)
+        return await self.aguardar(item, timeout)
+
+    def _devolver(self, item: ItemCaptcha):
+        if item.operador:
+            self._stats[item.operador].reemitidos += 1
+        item.operador = None
+        item.entregue_em = None
+        item.prazo_operador = None
+
+    def _disponiveis(self, agora: float) -> List[ItemCaptcha]:
+        disponiveis = []
+        for item in self._itens.values():
+            if item.futuro.done() or item.expira_em <= agora:
+                continue
+            if item.operador and item.prazo_operador <= agora:
+                logger.info(f"CAPTCHA {item.id} não respondido por {item.operador}, reemitindo")
+                self._devolver(item)
+            if not item.operador:
+                disponiveis.append(item)
+        return sorted(disponiveis, key=lambda i: i.criado_em)
+
+    async def puxar(self, operador_id: str, limite: int = 5, espera: float = 25.0) -> List[ItemCaptcha]:
+        """
+        Entrega até `limite` CAPTCHAs ao operador (mais antigos primeiro)
+
+        Aguarda até `espera` segundos se a fila estiver vazia.
+        """
+        fim = time.monotonic() + espera
+        while True:
+            agora = time.monotonic()
+            itens = self._disponiveis(agora)[:limite]
+            if itens:
+                for item in itens:
+                    item.operador = operador_id
+                    item.entregue_em = agora
+                    item.prazo_operador = agora + self.prazo_operador
+                    item.emissoes += 1
+                return itens
+
+            restante = fim - agora
+            if restante <= 0:
+                return []
+
+            self._novo_item.clear()
+            try:
+                # Acorda também para reemitir itens cujo prazo de operador venceu
+                await asyncio.wait_for(self._novo_item.wait(), timeout=min(restante, self.prazo_operador))
+            except asyncio.TimeoutError:
+                pass
+
+    def responder(self, item_id: str, operador_id: str, texto: str) -> bool:
+        """
+        Registra a resposta de um operador
+
+        Returns:
+            False se o item não existe mais (já resolvido por outro ou expirado)
+        """
+        item = self._itens.get(item_id)
+        if not item or item.futuro.done() or not texto:
+            return False
+
+        inicio = item.entregue_em if item.operador == operador_id and item.entregue_em else item.criado_em
+        stats = self._stats[operador_id]
+        stats.respondidos += 1
+        stats.latencias.append(time.monotonic() - inicio)
+
+        item.respondido_por = operador_id
+        item.futuro.set_result(texto)
+        self._itens.pop(item_id, None)
+        self._aguardando_resultado[item_id] = operador_id
+        while len(self._aguardando_resultado) > 1000:
+            self._aguardando_resultado.popitem(last=False)
+
+        logger.info(f"CAPTCHA {item_id} resolvido por {operador_id}")
+        return True
+
+    def registrar_resultado(self, item_id: str, aceito: bool):
+        """Informa se o portal aceitou a resposta do item (precisão por operador)"""
+        operador_id = self._aguardando_resultado.pop(item_id, None)
+        if not operador_id:
+            return
+        if aceito:
+            self._stats[operador_id].acertos += 1
+        else:
+            self._stats[operador_id].erros += 1
+
+    def estatisticas(self) -> dict:
+        return {
+            "pendentes": self.pendentes,
+            "operadores_online": self.operadores_online,
+            "expirados": self._expirados,
+            "operadores": {operador: stats.resumo() for operador, stats in self._stats.items()}
+        }
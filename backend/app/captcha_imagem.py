@@ -0,0 +1,123 @@
+"""
+Pipeline de imagem do CAPTCHA para resolução humana
+Recorta, remove ruído, amplia e recomprime o screenshot antes de mostrá-lo,
+empacota em frame binário de WebSocket (cabeçalho JSON curto + bytes) e mede a
+taxa de retentativa por variante (original x pré-processada)
+"""
+import io
+import json
+import logging
+import random
+import struct
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+VARIANTE_ORIGINAL = "original"
+VARIANTE_PREPROCESSADA = "preprocessada"
+
+
+def preprocessar_captcha(image_bytes: bytes, escala: int = 2, margem: int = 4, cores: int = 16) -> bytes:
+    """
+    Recorta o conteúdo, remove ruído, amplia e recomprime o CAPTCHA
+
+    Args:
+        image_bytes: Screenshot PNG do elemento do CAPTCHA
+        escala: Fator de ampliação (texto maior = menos erros de leitura)
+        margem: Pixels de fundo mantidos ao redor do texto
+        cores: Tons de cinza da paleta final (PNG indexado, bem menor)
+
+    Returns:
+        PNG processado, ou a imagem original se o processamento falhar
+    """
+    from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+    try:
+        imagem = Image.open(io.BytesIO(image_bytes)).convert("L")
+
+        # Recortar bordas/fundo: caixa dos pixels que diferem do fundo
+        fundo = Image.new("L", imagem.size, imagem.getpixel((0, 0)))
+        diferenca = ImageOps.autocontrast(ImageChops.difference(imagem, fundo)).point(
+            lambda v: 255 if v > 64 else 0
+        )
+        caixa = diferenca.getbbox()
+        if caixa:
+            esquerda, topo, direita, base = caixa
+            imagem = imagem.crop((
+                max(0, esquerda - margem), max(0, topo - margem),
+                min(imagem.width, direita + margem), min(imagem.height, base + margem)
+            ))
+
+        # Ruído de pontos/linhas finas
+        imagem = imagem.filter(ImageFilter.MedianFilter(3))
+        imagem = ImageOps.autocontrast(imagem, cutoff=1)
+
+        if escala > 1:
+            imagem = imagem.resize((imagem.width * escala, imagem.height * escala), Image.Resampling.LANCZOS)
+
+        saida = io.BytesIO()
+        imagem.quantize(colors=cores).save(saida, format="PNG", optimize=True)
+        processada = saida.getvalue()
+
+        logger.info(f"CAPTCHA pré-processado: {len(image_bytes)} -> {len(processada)} bytes")
+        return processada
+
+    except Exception as e:
+        logger.warning(f"Erro ao pré-processar CAPTCHA, usando original: {e}")
+        return image_bytes
+
+
+def empacotar_frame(cabecalho: dict, payload: bytes) -> bytes:
+    """
+    Monta frame binário: 2 bytes (big-endian) com o tamanho do cabeçalho,
+    cabeçalho JSON (UTF-8) e o payload
+    """
+    cabecalho_bytes = json.dumps(cabecalho, separators=(",", ":")).encode("utf-8")
+    return struct.pack(">H", len(cabecalho_bytes)) + cabecalho_bytes + payload
+
+
+def desempacotar_frame(frame: bytes) -> Tuple[dict, bytes]:
+    """Inverso de `empacotar_frame`"""
+    (tamanho,) = struct.unpack(">H", frame[:2])
+    cabecalho = json.loads(frame[2:2 + tamanho].decode("utf-8"))
+    return cabecalho, frame[2 + tamanho:]
+
+
+class MetricasCaptcha:
+    """
+    Taxa de retentativa de CAPTCHA por variante da imagem
+
+    Com `fracao_preprocessada` < 1, uma parte dos CAPTCHAs continua indo
+    original, o que permite comparar as duas variantes no mesmo período.
+    """
+
+    def __init__(self, fracao_preprocessada: float = 1.0, aleatorio: random.Random = None):
+        self.fracao_preprocessada = fracao_preprocessada
+        self._aleatorio = aleatorio or random.Random()
+        self._contagens: Dict[str, Dict[str, int]] = {
+            variante: {"enviados": 0, "aceitos": 0, "recusados": 0, "bytes": 0}
+            for variante in (VARIANTE_ORIGINAL, VARIANTE_PREPROCESSADA)
+        }
+
+    def sortear_variante(self) -> str:
+        if self._aleatorio.random() < self.fracao_preprocessada:
+            return VARIANTE_PREPROCESSADA
+        return VARIANTE_ORIGINAL
+
+    def registrar_envio(self, variante: str, tamanho: int):
+        self._contagens[variante]["enviados"] += 1
+        self._contagens[variante]["bytes"] += tamanho
+
+    def registrar_resultado(self, variante: str, aceito: bool):
+        self._contagens[variante]["aceitos" if aceito else "recusados"] += 1
+
+    def estatisticas(self) -> dict:
+        resumo = {}
+        for variante, contagem in self._contagens.items():
+            avaliados = contagem["aceitos"] + contagem["recusados"]
+            resumo[variante] = {
+                **contagem,
+                "bytes_medio": round(contagem["bytes"] / contagem["enviados"]) if contagem["enviados"] else None,
+                "taxa_retentativa": round(contagem["recusados"] / avaliados, 3) if avaliados else None
+            }
+        return {"fracao_preprocessada": self.fracao_preprocessada, "variantes": resumo}
@@ -0,0 +1,375 @@
+"""
+Resolução automática de CAPTCHA (CPU)
+Modelo pequeno de reconhecimento por caractere (k-vizinhos sobre glifos
+binarizados), treinado offline com CAPTCHAs rotulados do nosso histórico
+(ver treinar_captcha.py). Só responde quando a confiança passa do limiar;
+abaixo disso a consulta cai no resolvedor humano
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Pixels = List[List[int]]  # Tons de cinza 0-255, linha a linha
+
+LARGURA_GLIFO = 10
+ALTURA_GLIFO = 14
+
+
+def carregar_pixels(image_bytes: bytes) -> Pixels:
+    """Decodifica a imagem (PNG/JPEG) em tons de cinza"""
+    from PIL import Image
+
+    imagem = Image.open(io.BytesIO(image_bytes)).convert("L")
+    largura, altura = imagem.size
+    dados = list(imagem.getdata())
+    return [dados[y * largura:(y + 1) * largura] for y in range(altura)]
+
+
+def _limiar_otsu(pixels: Pixels) -> int:
+    histograma = [0] * 256
+    for linha in pixels:
+        for valor in linha:
+            histograma[valor] += 1
+
+    total = sum(histograma)
+    soma_total = sum(i * h for i, h in enumerate(histograma))
+    soma_fundo = peso_fundo = 0
+    melhor_limiar, melhor_variancia = 127, -1.0
+
+    for limiar in range(256):
+        peso_fundo += histograma[limiar]
+        if peso_fundo == 0:
+            continue
+        peso_frente = total - peso_fundo
+        if peso_frente == 0:
+            break
+        soma_fundo += limiar * histograma[limiar]
+        media_fundo = soma_fundo / peso_fundo
+        media_frente = (soma_total - soma_fundo) / peso_frente
+        variancia = peso_fundo * peso_frente * (media_fundo - media_frente) ** 2
+        if variancia > melhor_variancia:
+            melhor_limiar, melhor_variancia = limiar, variancia
+
+    return melhor_limiar
+
+
+def binarizar(pixels: Pixels) -> List[List[int]]:
+    """
+    Separa texto (1) do fundo (0) e remove pixels isolados (ruído)
+
+    Assume texto mais escuro que o fundo, como no portal do CAR.
+    """
+    limiar = _limiar_otsu(pixels)
+    binaria = [[1 if valor <= limiar else 0 for valor in linha] for linha in pixels]
+
+    altura = len(binaria)
+    largura = len(binaria[0]) if altura else 0
+    limpa = [linha[:] for linha in binaria]
+    for y in range(altura):
+        for x in range(largura):
+            if not binaria[y][x]:
+                continue
+            vizinhos = sum(
+                binaria[yy][xx]
+                for yy in range(max(0, y - 1), min(altura, y + 2))
+                for xx in range(max(0, x - 1), min(largura, x + 2))
+            ) - 1
+            if vizinhos < 2:
+                limpa[y][x] = 0
+    return limpa
+
+
+def segmentar(binaria: List[List[int]], quantidade: Optional[int] = None) -> List[List[List[int]]]:
+    """
+    Divide a imagem binarizada em glifos pela projeção vertical
+
+    Args:
+        binaria: Imagem binarizada (1 = texto)
+        quantidade: Número esperado de caracteres; blocos largos (caracteres
+            encostados) são divididos até atingi-lo
+
+    Returns:
+        Lista de glifos (recortados), da esquerda para a direita
+    """
+    if not binaria:
+        return []
+
+    largura = len(binaria[0])
+    colunas = [sum(linha[x] for linha in binaria) for x in range(largura)]
+
+    blocos: List[Tuple[int, int]] = []
+    inicio = None
+    for x, tinta in enumerate(colunas + [0]):
+        if tinta and inicio is None:
+            inicio = x
+        elif not tinta and inicio is not None:
+            if x - inicio >= 2:
+                blocos.append((inicio, x))
+            inicio = None
+
+    if quantidade:
+        # Divide o bloco mais largo ao meio até ter a quantidade esperada
+        while blocos and len(blocos) < quantidade:
+            indice = max(range(len(blocos)), key=lambda i: blocos[i][1] - blocos[i][0])
+            a, b = blocos[indice]
+            if b - a < 4:
+                break
+            meio = (a + b) // 2
+            blocos[indice:indice + 1] = [(a, meio), (meio, b)]
+
+    glifos = []
+    for a, b in blocos:
+        recorte = [linha[a:b] for linha in binaria]
+        linhas_tinta = [y for y, linha in enumerate(recorte) if any(linha)]
+        if not linhas_tinta:
+            continue
+        glifos.append(recorte[linhas_tinta[0]:linhas_tinta[-1] + 1])
+    return glifos
+
+
+def vetorizar_glifo(glifo: List[List[int]]) -> Tuple[int, ...]:
+    """Redimensiona o glifo para LARGURA_GLIFO x ALTURA_GLIFO (vizinho mais próximo)"""
+    altura = len(glifo)
+    largura = len(glifo[0])
+    return tuple(
+        glifo[y * altura // ALTURA_GLIFO][x * largura // LARGURA_GLIFO]
+        for y in range(ALTURA_GLIFO)
+        for x in range(LARGURA_GLIFO)
+    )
+
+
+class ModeloCaptcha:
+    """
+    Classificador de caracteres por vizinho mais próximo
+
+    A confiança de cada caractere é a margem entre a distância ao melhor
+    rótulo e ao segundo melhor; a do CAPTCHA é a menor entre os caracteres.
+    """
+
+    def __init__(self, exemplos: Optional[Dict[str, List[Tuple[int, ...]]]] = None, tamanho_texto: int = 0):
+        self.exemplos: Dict[str, List[Tuple[int, ...]]] = exemplos or {}
+        self.tamanho_texto = tamanho_texto
+
+    @classmethod
+    def treinar(cls, amostras: Iterable[Tuple[Pixels, str]], max_por_caractere: int = 80) -> "ModeloCaptcha":
+        """
+        Treina a partir de pares (imagem em tons de cinza, texto correto)
+
+        Amostras cuja segmentação não bate com o tamanho do texto são ignoradas.
+        """
+        exemplos: Dict[str, List[Tuple[int, ...]]] = {}
+        tamanhos: Dict[int, int] = {}
+
+        for pixels, texto in amostras:
+            glifos = segmentar(binarizar(pixels), len(texto))
+            if len(glifos) != len(texto):
+                continue
+            tamanhos[len(texto)] = tamanhos.get(len(texto), 0) + 1
+            for caractere, glifo in zip(texto, glifos):
+                lista = exemplos.setdefault(caractere, [])
+                if len(lista) < max_por_caractere:
+                    lista.append(vetorizar_glifo(glifo))
+
+        tamanho_texto = max(tamanhos, key=tamanhos.get) if tamanhos else 0
+        return cls(exemplos, tamanho_texto)
+
+    def classificar_glifo(self, vetor: Tuple[int, ...]) -> Tuple[str, float]:
+        distancias = {
+            caractere: min(sum(a != b for a, b in zip(vetor, exemplo)) for exemplo in lista)
+            for caractere, lista in self.exemplos.items()
+        }
+        if len(distancias) < 2:
+            return (next(iter(distancias), ""), 0.0)
+
+        ordenados = sorted(distancias.items(), key=lambda item: item[1])
+        (melhor, d1), (_, d2) = ordenados[0], ordenados[1]
+        return melhor, (d2 - d1) / d2 if d2 else 0.0
+
+    def prever(self, pixels: Pixels) -> Tuple[str, float]:
+        """
+        Returns:
+            (texto, confiança entre 0 e 1)
+        """
+        if not self.exemplos:
+            return "", 0.0
+
+        glifos = segmentar(binarizar(pixels), self.tamanho_texto or None)
+        if not glifos or (self.tamanho_texto and len(glifos) != self.tamanho_texto):
+            return "", 0.0
+
+        resultados = [self.classificar_glifo(vetorizar_glifo(glifo)) for glifo in glifos]
+        texto = "".join(caractere for caractere, _ in resultados)
+        return texto, min(confianca for _, confianca in resultados)
+
+    def salvar(self, caminho: str):
+        dados = {
+            "tamanho_texto": self.tamanho_texto,
+            "largura_glifo": LARGURA_GLIFO,
+            "altura_glifo": ALTURA_GLIFO,
+            "exemplos": {
+                caractere: ["".join(map(str, vetor)) for vetor in lista]
+                for caractere, lista in self.exemplos.items()
+            }
+        }
+        Path(caminho).parent.mkdir(parents=True, exist_ok=True)
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(dados, f)
+
+    @classmethod
+    def carregar(cls, caminho: str) -> "ModeloCaptcha":
+        with open(caminho, encoding="utf-8") as f:
+            dados = json.load(f)
+        exemplos = {
+            caractere: [tuple(int(c) for c in vetor) for vetor in lista]
+            for caractere, lista in dados["exemplos"].items()
+        }
+        return cls(exemplos, dados.get("tamanho_texto", 0))
+
+
+class SolucionadorCaptcha:
+    """
+    Solucionador automático compartilhado pelas consultas
+
+    Mantém o modelo carregado e as métricas de precisão. Cada consulta usa
+    uma `EtapaSolucionador` própria (via `etapa()`), plugada no loop de CAPTCHA
+    do downloader.
+    """
+
+    def __init__(
+        self,
+        modelo: Optional[ModeloCaptcha] = None,
+        limiar_confianca: float = 0.5,
+        pasta_amostras: Optional[str] = None
+    ):
+        self.modelo = modelo
+        self.limiar_confianca = limiar_confianca
+        self.pasta_amostras = pasta_amostras
+
+        self._automaticos = 0
+        self._acertos_automaticos = 0
+        self._encaminhados = 0
+        self._sombra_avaliados = 0
+        self._sombra_acertos = 0
+        self._amostras_gravadas = 0
+
+    @classmethod
+    def a_partir_de_arquivo(
+        cls,
+        caminho_modelo: str,
+        limiar_confianca: float = 0.5,
+        pasta_amostras: Optional[str] = None
+    ) -> "SolucionadorCaptcha":
+        """Carrega o modelo se o arquivo existir; sem modelo, tudo vai para humanos"""
+        modelo = None
+        if caminho_modelo and os.path.exists(caminho_modelo):
+            try:
+                modelo = ModeloCaptcha.carregar(caminho_modelo)
+                logger.info(f"Modelo de CAPTCHA carregado de {caminho_modelo}")
+            except Exception as e:
+                logger.warning(f"Erro ao carregar modelo de CAPTCHA ({caminho_modelo}): {e}")
+        return cls(modelo, limiar_confianca, pasta_amostras)
+
+    def etapa(self) -> "EtapaSolucionador":
+        return EtapaSolucionador(self)
+
+    def _gravar_amostra(self, image_bytes: bytes, texto: str):
+        """Guarda CAPTCHA aceito pelo portal como amostra rotulada para o treino offline"""
+        if not self.pasta_amostras or not texto.isalnum():
+            return
+        try:
+            pasta = Path(self.pasta_amostras)
+            pasta.mkdir(parents=True, exist_ok=True)
+            (pasta / f"{texto}_{uuid.uuid4().hex[:12]}.png").write_bytes(image_bytes)
+            self._amostras_gravadas += 1
+        except Exception as e:
+            logger.warning(f"Erro ao gravar amostra de CAPTCHA: {e}")
+
+    def estatisticas(self) -> dict:
+        return {
+            "modelo_carregado": self.modelo is not None,
+            "limiar_confianca": self.limiar_confianca,
+            "automaticos": self._automaticos,
+            "acertos_automaticos": self._acertos_automaticos,
+            "precisao_automatica": round(self._acertos_automaticos / self._automaticos, 3) if self._automaticos else None,
+            "encaminhados_humano": self._encaminhados,
+            # Precisão do modelo nos CAPTCHAs resolvidos por humanos (inclui abaixo do limiar)
+            "precisao_sombra": round(self._sombra_acertos / self._sombra_avaliados, 3) if self._sombra_avaliados else None,
+            "amostras_gravadas": self._amostras_gravadas
+        }
+
+
+class EtapaSolucionador:
+    """
+    Estágio de resolução automática de uma consulta
+
+    Protocolo usado pelo downloader:
+    - `await tentar(image_bytes)` retorna o texto quando o modelo está
+      confiante, ou None para encaminhar ao resolvedor humano;
+    - `confirmar(texto, aceito)` recebe o veredito do portal para a última
+      resposta enviada (automática ou humana).
+
+    Após uma resposta automática recusada, as próximas tentativas da mesma
+    consulta vão direto para o humano.
+    """
+
+    def __init__(self, solucionador: SolucionadorCaptcha):
+        self.solucionador = solucionador
+        self.ativo = solucionador.modelo is not None
+
+        self._imagem: Optional[bytes] = None
+        self._previsao: Optional[str] = None
+        self._automatico = False
+
+    async def tentar(self, image_bytes: bytes) -> Optional[str]:
+        self._imagem = image_bytes
+        self._previsao = None
+        self._automatico = False
+
+        modelo = self.solucionador.modelo
+        if modelo is None:
+            return None
+
+        try:
+            pixels = await asyncio.to_thread(carregar_pixels, image_bytes)
+            texto, confianca = await asyncio.to_thread(modelo.prever, pixels)
+        except Exception as e:
+            logger.warning(f"Erro no solucionador automático de CAPTCHA: {e}")
+            return None
+
+        self._previsao = texto or None
+        if self.ativo and texto and confianca >= self.solucionador.limiar_confianca:
+            logger.info(f"CAPTCHA resolvido automaticamente: {texto} (confiança {confianca:.2f})")
+            self._automatico = True
+            self.solucionador._automaticos += 1
+            return texto
+
+        logger.info(f"CAPTCHA encaminhado ao humano (confiança {confianca:.2f})")
+        self.solucionador._encaminhados += 1
+        return None
+
+    def confirmar(self, texto: Optional[str], aceito: bool):
+        solucionador = self.solucionador
+
+        if self._automatico:
+            if aceito:
+                solucionador._acertos_automaticos += 1
+            else:
+                self.ativo = False
+        elif aceito and texto and self._previsao is not None:
+            solucionador._sombra_avaliados += 1
+            if self._previsao.lower() == texto.lower():
+                solucionador._sombra_acertos += 1
+
+        if aceito and texto and self._imagem:
+            solucionador._gravar_amostra(self._imagem, texto)
+
+        self._imagem = None
+        self._previsao = None
+        self._automatico = False
@@ -8,12 +8,16 @@ import os
 import re
 from pathlib import Path
 from playwright.async_api import async_playwright
-from typing import Callable, Optional, Dict, Any
+from typing import Awaitable, Callable, Optional, Dict, Any
 import logging
+from .camadas import resumo_parcial_camada
+from .captcha_fila import CaptchaAbortado
 from .shapefile_processor import processar_shapefile_car
 
 logger = logging.getLogger(__name__)
 
+URL_CONSULTA_PUBLICA = "https://consultapublica.car.gov.br/publico/imoveis/index"
+
 
 async def tentar_abrir_popup_com_retry(
     page,
@@ -291,6 +295,12 @@ async def download_car_websocket(
     resolver_captcha: Callable[[bytes], str],
     enviar_progresso: Optional[Callable[[str, str], None]] = None,
     callback_dados_extraidos: Optional[Callable[[Dict[str, Any]], None]] = None,
+    verificar_alteracao: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    checkpoint: Optional[Callable[[str], Awaitable[None]]] = None,
+    resultado_captcha: Optional[Callable[[bool], Awaitable[None]]] = None,
+    solucionador_captcha=None,
+    enviar_parcial: Optional[Callable[[str, Dict[str, Any], Optional[str]], Awaitable[None]]] = None,
+    ao_salvar_shapefile: Optional[Callable[[str], None]] = None,
     headless: bool = True,
     slow_mo: int = 100
 ) -> Dict[str, Any]:
@@ -302,6 +312,20 @@ async def download_car_websocket(
         pasta_destino: Pasta para salvar arquivos
         resolver_captcha: Função assíncrona que recebe bytes da imagem e retorna texto do CAPTCHA
         enviar_progresso: Função opcional para enviar atualizações de progresso
+        callback_dados_extraidos: Função opcional chamada com popup + demonstrativo antes do shapefile
+        verificar_alteracao: Função assíncrona opcional (modo refresh) que recebe popup + demonstrativo
+            e retorna False quando o cadastro não mudou; nesse caso CAPTCHA e shapefile são pulados
+        checkpoint: Função assíncrona opcional chamada ao fim de cada etapa (1 a 3) com o nome
+            da etapa concluída; pode lançar exceção para interromper a consulta (preempção)
+        resultado_captcha: Função assíncrona opcional chamada após cada resposta de CAPTCHA
+            enviada ao portal pelo resolvedor humano, com True se foi aceita e False se foi recusada
+        solucionador_captcha: Estágio opcional de resolução automática (ver
+            captcha_solver.EtapaSolucionador), consultado antes de `resolver_captcha`
+        enviar_parcial: Função assíncrona opcional chamada com (parte, dados, camada) assim que
+            cada resultado parcial fica pronto: "info_popup" (etapa 2), "dados_demonstrativo"
+            (etapa 3) e "camada" (feições e bbox de cada GeoJSON, com o nome da camada)
+        ao_salvar_shapefile: Função opcional chamada (no event loop) com o caminho do ZIP
+            assim que ele é salvo, antes da conversão para GeoJSON (ex.: iniciar o upload)
         headless: Executar navegador em modo headless
         slow_mo: Delay entre ações (ms)
 
@@ -321,11 +345,24 @@ async def download_car_websocket(
         'dados_demonstrativo': {},
         'arquivo_shapefile': None,
         'geojson_layers': {},
+        'cadastro_alterado': None,
         'sucesso': False
     }
 
     shapefile_response = None
 
+    captcha_enviado = {"texto": None, "automatico": False}
+
+    async def reportar_captcha(aceito: bool):
+        """Informa se a última resposta de CAPTCHA foi aceita pelo portal"""
+        if solucionador_captcha:
+            solucionador_captcha.confirmar(captcha_enviado["texto"], aceito)
+        if resultado_captcha and not captcha_enviado["automatico"]:
+            try:
+                await resultado_captcha(aceito)
+            except Exception as e:
+                logger.warning(f"Erro ao reportar resultado do CAPTCHA: {e}")
+
     async with async_playwright() as p:
         browser = await p.chromium.launch(
             headless=headless,
@@ -357,8 +394,8 @@ async def download_car_websocket(
             if enviar_progresso:
                 await enviar_progresso("busca", "Acessando site do CAR e buscando número...")
 
-            await page.goto("https://consultapublica.car.gov.br/publico/imoveis/index",
-                           wait_until='domcontentloaded', timeout=120000)
+            await page.goto(URL_CONSULTA_PUBLICA,
+                            wait_until='domcontentloaded', timeout=120000)
             await asyncio.sleep(15)
 
             search_control = page.locator('.leaflet-control-search').first
@@ -381,6 +418,9 @@ async def download_car_websocket(
             await asyncio.sleep(5)
             logger.info("Busca concluída")
 
+            if checkpoint:
+                await checkpoint("busca")
+
             # ETAPA 2: POPUP (com retry automático)
             logger.info("Etapa 2/4: Extraindo dados do popup...")
             if enviar_progresso:
@@ -399,6 +439,12 @@ async def download_car_websocket(
                 # Popup é crítico - se não abrir, não adianta continuar
                 raise
 
+            if enviar_parcial:
+                await enviar_parcial("info_popup", resultados['info_popup'], None)
+
+            if checkpoint:
+                await checkpoint("extracao")
+
             # ETAPA 3: DEMONSTRATIVO (com retry automático)
             logger.info("Etapa 3/4: Extraindo dados do demonstrativo...")
             if enviar_progresso:
@@ -417,6 +463,9 @@ async def download_car_websocket(
                 # Demonstrativo não é crítico - continuar mesmo se falhar
                 resultados['dados_demonstrativo'] = {}
 
+            if enviar_parcial and resultados['dados_demonstrativo']:
+                await enviar_parcial("dados_demonstrativo", resultados['dados_demonstrativo'], None)
+
             # CALLBACK: Dados extraídos (popup + demonstrativo) ANTES do shapefile
             if callback_dados_extraidos:
                 logger.info("Chamando callback com dados extraídos (antes do shapefile)...")
@@ -426,6 +475,31 @@ async def download_car_websocket(
                     'dados_demonstrativo': resultados['dados_demonstrativo']
                 })
 
+            # REFRESH INCREMENTAL: só resolve CAPTCHA e baixa shapefile se o cadastro mudou
+            if verificar_alteracao:
+                logger.info("Modo refresh: comparando cadastro com o registro armazenado...")
+                resultados['cadastro_alterado'] = await verificar_alteracao({
+                    'numero_car': numero_car,
+                    'info_popup': resultados['info_popup'],
+                    'dados_demonstrativo': resultados['dados_demonstrativo']
+                })
+
+                if not resultados['cadastro_alterado']:
+                    logger.info("Cadastro sem alterações desde a última consulta, pulando etapa do shapefile")
+                    if enviar_progresso:
+                        await enviar_progresso("refresh", "Cadastro sem alterações, reaproveitando shapefile existente")
+
+                    resultados['sucesso'] = True
+                    return resultados
+
+                logger.info("Cadastro alterado, seguindo para download do shapefile")
+                if enviar_progresso:
+                    await enviar_progresso("refresh", "Cadastro alterado, baixando shapefile atualizado...")
+
+            # Último ponto de preempção antes do CAPTCHA (etapa mais longa)
+            if checkpoint:
+                await checkpoint("demonstrativo")
+
             await page.bring_to_front()
             await asyncio.sleep(2)
 
@@ -523,13 +597,25 @@ async def download_car_websocket(
                                     image_bytes = await captcha_element.screenshot()
                                     logger.info(f"Screenshot capturado: {len(image_bytes)} bytes")
 
-                                    # Chamar callback para resolver remotamente
-                                    logger.info("Chamando callback resolver_captcha...")
-                                    captcha_texto = await resolver_captcha(image_bytes)
-                                    logger.info(f"Callback retornou: {captcha_texto}")
+                                    # Solucionador automático (só responde se estiver confiante)
+                                    captcha_enviado["automatico"] = False
+                                    if solucionador_captcha:
+                                        captcha_texto = await solucionador_captcha.tentar(image_bytes)
+                                        if captcha_texto:
+                                            captcha_enviado["automatico"] = True
+                                            if enviar_progresso:
+                                                await enviar_progresso("captcha", "CAPTCHA resolvido automaticamente")
+
+                                    # Senão, chamar callback para resolver remotamente
+                                    if not captcha_texto:
+                                        logger.info("Chamando callback resolver_captcha...")
+                                        captcha_texto = await resolver_captcha(image_bytes)
+                                        logger.info(f"Callback retornou: {captcha_texto}")
 
                                     if captcha_texto:
                                         break
+                            except CaptchaAbortado:
+                                raise
                             except Exception as e:
                                 logger.warning(f"Erro ao tentar seletor {selector}: {e}")
                                 continue
@@ -538,6 +624,7 @@ async def download_car_websocket(
                             raise Exception("CAPTCHA não resolvido")
 
                         logger.info(f"CAPTCHA resolvido: {captcha_texto}")
+                        captcha_enviado["texto"] = captcha_texto
 
                         # Preencher campo
                         await asyncio.sleep(1)
@@ -594,6 +681,7 @@ async def download_car_websocket(
 
                         if erro_captcha_count > 0:
                             logger.warning(f"CAPTCHA incorreto detectado na tentativa {tentativa_captcha}")
+                            await reportar_captcha(False)
 
                             if tentativa_captcha < max_tentativas_captcha:
                                 logger.info("Gerando novo CAPTCHA...")
@@ -661,6 +749,8 @@ async def download_car_websocket(
                                     break
 
                                 # Se não capturou resposta E modal ainda aberto = ERRO DE CAPTCHA
+                                await reportar_captcha(False)
+
                                 if tentativa_captcha < max_tentativas_captcha:
                                     logger.error(f"❌ CAPTCHA INCORRETO detectado! (tentativa {tentativa_captcha}/{max_tentativas_captcha})")
                                     logger.error(f"   → Modal ainda aberto após {max_wait_for_response}s")
@@ -692,6 +782,9 @@ async def download_car_websocket(
                                 captcha_aceito = True
                                 break
 
+                    except CaptchaAbortado:
+                        # Resolvedor desistiu (cliente saiu, CAPTCHA expirou): novo CAPTCHA não ajuda
+                        raise
                     except Exception as e:
                         if tentativa_captcha >= max_tentativas_captcha:
                             logger.error(f"Erro no CAPTCHA após {max_tentativas_captcha} tentativas: {e}")
@@ -715,6 +808,7 @@ async def download_car_websocket(
 
                 # Se chegou aqui, sucesso confirmado!
                 if shapefile_response:
+                    await reportar_captcha(True)
                     logger.info("Resposta capturada! Salvando arquivo...")
 
                     # Ler conteúdo binário
@@ -731,6 +825,9 @@ async def download_car_websocket(
 
                     logger.info(f"Shapefile salvo: {shapefile_path} ({file_size:.2f} KB)")
 
+                    if ao_salvar_shapefile:
+                        ao_salvar_shapefile(shapefile_path)
+
                     # PROCESSAR SHAPEFILE -> GEOJSON
                     try:
                         if enviar_progresso:
@@ -738,10 +835,25 @@ async def download_car_websocket(
 
                         logger.info("Iniciando processamento de shapefiles...")
 
+                        # Resumo de cada camada assim que converte (a conversão roda em outra
+                        # thread); o GeoJSON em si é lido pela URL depois de armazenado
+                        loop = asyncio.get_running_loop()
+                        envios_camadas = []
+
+                        def camada_convertida(nome: str, geojson: dict):
+                            envios_camadas.append(asyncio.run_coroutine_threadsafe(
+                                enviar_parcial("camada", resumo_parcial_camada(geojson), nome), loop
+                            ))
+
                         # Executar em thread separada para não bloquear o event loop
                         geojson_layers = await asyncio.to_thread(
                             processar_shapefile_car,
-                            shapefile_path
+                            shapefile_path,
+                            camada_convertida if enviar_parcial else None
+                        )
+                        await asyncio.gather(
+                            *(asyncio.wrap_future(envio) for envio in envios_camadas),
+                            return_exceptions=True
                         )
 
                         resultados['geojson_layers'] = geojson_layers
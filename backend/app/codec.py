@@ -0,0 +1,106 @@
+"""
+Codec das mensagens WebSocket, negociado na configuração inicial
+JSON (orjson quando instalado), msgpack (imagens como bytes, sem base64) e,
+opcionalmente, compressão zlib de cada frame
+"""
+import json
+import zlib
+from typing import Any, Dict, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - fallback para a biblioteca padrão
+    orjson = None
+
+FORMATOS = ("json", "msgpack")
+
+
+def json_bytes(mensagem: Any) -> bytes:
+    """Serializa em JSON UTF-8 (orjson se disponível; datetime vira ISO 8601)"""
+    if orjson is not None:
+        return orjson.dumps(mensagem, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(mensagem, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ValueError("codec msgpack indisponível no servidor")
+    return msgpack
+
+
+class CodecMensagens:
+    """
+    Codificação das mensagens de uma conexão
+
+    - json sem compressão: frames de texto (compatível com clientes antigos)
+    - msgpack: frames binários; a imagem do CAPTCHA vai como bytes em "image"
+    - compressao: o frame (JSON ou msgpack) é comprimido com zlib e enviado
+      como binário
+
+    O transporte já negocia permessage-deflate com o navegador; a compressão
+    aqui serve a clientes que não suportam a extensão (ex.: proxies que a
+    removem) e é aplicada só acima de `minimo_compressao` bytes — frames
+    menores vão sem compressão, marcados pelo primeiro byte (0 = cru, 1 = zlib).
+    """
+
+    def __init__(self, formato: str = "json", compressao: bool = False, nivel: int = 6, minimo_compressao: int = 512):
+        if formato not in FORMATOS:
+            raise ValueError(f"codec inválido: {formato}. Use {' ou '.join(FORMATOS)}")
+        if formato == "msgpack":
+            _msgpack()
+        self.formato = formato
+        self.compressao = compressao
+        self.nivel = nivel
+        self.minimo_compressao = minimo_compressao
+
+    @classmethod
+    def negociar(cls, config: Dict[str, Any]) -> "CodecMensagens":
+        """Codec pedido na configuração inicial ({"codec": "msgpack", "compressao": true})"""
+        return cls(config.get("codec") or "json", bool(config.get("compressao", False)))
+
+    @property
+    def binario(self) -> bool:
+        """Frames binários (msgpack ou comprimidos)"""
+        return self.formato == "msgpack" or self.compressao
+
+    @property
+    def bytes_nativos(self) -> bool:
+        """O formato carrega bytes sem base64"""
+        return self.formato == "msgpack"
+
+    def codificar(self, mensagem: Dict[str, Any]) -> Union[str, bytes]:
+        if self.formato == "msgpack":
+            dados = _msgpack().packb(mensagem, default=str, use_bin_type=True)
+        else:
+            dados = json_bytes(mensagem)
+            if not self.compressao:
+                return dados.decode("utf-8")
+
+        if not self.compressao:
+            return dados
+        if len(dados) < self.minimo_compressao:
+            return b"\x00" + dados
+        return b"\x01" + zlib.compress(dados, self.nivel)
+
+    def decodificar(self, dados: Union[str, bytes]) -> Dict[str, Any]:
+        """Mensagem do cliente: texto é sempre JSON; binário segue o codec"""
+        if isinstance(dados, str):
+            return json.loads(dados)
+
+        if self.compressao:
+            marcador, dados = dados[:1], dados[1:]
+            if marcador == b"\x01":
+                dados = zlib.decompress(dados)
+        if self.formato == "msgpack":
+            return _msgpack().unpackb(dados, raw=False)
+        return json.loads(dados)
+
+    async def enviar(self, websocket, mensagem: Dict[str, Any]):
+        """Envia a mensagem no frame adequado (texto ou binário)"""
+        dados = self.codificar(mensagem)
+        if isinstance(dados, bytes):
+            await websocket.send_bytes(dados)
+        else:
+            await websocket.send_text(dados)
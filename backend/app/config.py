@@ -11,6 +11,14 @@ class Settings(BaseSettings):
     # Supabase
     supabase_url: str
     supabase_service_key: str
+    supabase_timeout_segundos: float = 10.0  # Por tentativa
+    supabase_max_tentativas: int = 3
+    supabase_max_conexoes: int = 20  # Pool HTTP compartilhado
+    escrita_intervalo_segundos: float = 1.0  # Lote periódico de gravações (consultas bulk, watchlist)
+    escrita_max_lote: int = 200  # Linhas por upsert
+    storage_tamanho_parte_mb: int = 6  # Partes do upload retomável (TUS do Supabase exige 6 MB)
+    storage_local_dir: str = ""  # Se definido, shapefiles vão para este diretório em vez do Storage
+    enable_postgis: bool = False  # Geometrias em duploa_feicoes_car (migrations/add_postgis_feicoes.sql)
 
     # CORS
     allowed_origins: str = "http://localhost:3000"
@@ -21,6 +29,10 @@ class Settings(BaseSettings):
     # Rate Limiting
     enable_rate_limit: bool = False
     max_consultas_por_dia: int = 100
+    pesos_clientes: str = ""  # Pesos da fila justa: "cliente_a:2,cliente_b:0.5" (padrão 1)
+
+    # Fuso horário local (janelas do agendador e virada da cota diária)
+    fuso_horario: str = "America/Sao_Paulo"
 
     # Logging
     log_level: str = "INFO"
@@ -29,6 +41,56 @@ class Settings(BaseSettings):
     headless: bool = True
     slow_mo: int = 100
 
+    # Controle de admissão (navegadores simultâneos)
+    max_navegadores: int = 3
+    memoria_minima_livre_mb: int = 256  # Folga mínima após abrir mais um navegador
+    memoria_por_navegador_mb: int = 400  # Consumo estimado de um Chromium
+    slots_reservados_interativos: int = 1  # Navegadores que consultas bulk nunca ocupam
+
+    # Solucionador automático de CAPTCHA (modelo treinado com treinar_captcha.py)
+    enable_captcha_solver: bool = True
+    captcha_modelo_path: str = "/app/modelos/captcha_modelo.json"
+    captcha_limiar_confianca: float = 0.5
+    captcha_amostras_dir: str = ""  # CAPTCHAs aceitos pelo portal, rotulados, para treino
+
+    # Sessões retomáveis (reconexão do WebSocket)
+    sessao_carencia_segundos: int = 120  # Tempo para reconectar antes de desistir do CAPTCHA do cliente
+    sessao_max_eventos: int = 200  # Eventos guardados por sessão para reenvio
+    ws_max_fila_saida: int = 64  # Eventos pendentes por conexão antes de descartar progresso
+
+    # WebSocket multiplexado (/ws/consultas)
+    max_consultas_por_conexao: int = 100
+
+    # Webhooks de consultas em segundo plano (POST /api/consultas)
+    webhook_segredo: str = ""  # Chave HMAC das assinaturas; vazio desativa o modo webhook
+    webhook_intervalo_lote: float = 2.0
+    webhook_max_tentativas: int = 6
+    webhook_permitir_rede_interna: bool = False  # Só desenvolvimento: callback em localhost/rede privada
+
+    # Pré-processamento da imagem do CAPTCHA (recorte, ruído, ampliação)
+    captcha_preprocessamento: bool = True
+    captcha_fracao_preprocessada: float = 1.0  # < 1 mantém parte original para comparar retentativas
+
+    # Fila compartilhada de CAPTCHAs (operadores)
+    captcha_operador_tokens: str = ""  # "operador:token,operador2:token2"
+    captcha_validade_segundos: int = 240  # Após isso o CAPTCHA é descartado e um novo é capturado
+    captcha_prazo_operador_segundos: int = 60  # Sem resposta nesse prazo, o item volta para a fila
+    captcha_lote_maximo: int = 5
+
+    # Monitor de saúde (/health e /ready leem resultados em cache)
+    saude_intervalo_segundos: float = 15.0  # Entre verificações de Supabase, Storage e capacidade
+    saude_timeout_segundos: float = 5.0
+    saude_intervalo_portal_segundos: float = 120.0  # Portal externo: sondar com parcimônia
+    readiness_max_fila: int = 20  # Consultas aguardando navegador acima disso: réplica não pronta
+
+    # Watchlist (re-verificação agendada fora de pico)
+    enable_scheduler: bool = False
+    scheduler_janela_inicio: int = 0  # Hora local de início da janela fora de pico
+    scheduler_janela_fim: int = 6  # Hora local de término (exclusiva)
+    scheduler_max_simultaneas: int = 1
+    scheduler_intervalo_tick: int = 60  # segundos
+    portal_orcamento_por_hora: int = 30  # Máximo de consultas agendadas ao portal por hora
+
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -0,0 +1,470 @@
+"""
+Executor de consultas CAR
+Orquestra uma consulta completa (registro no Supabase, download, upload do
+shapefile e GeoJSON) independente de quem a disparou: WebSocket ou agendador
+"""
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .admissao import (
+    ControleAdmissao,
+    ConsultaPreemptada,
+    PRIORIDADE_INTERATIVA,
+    parse_pesos_clientes
+)
+from .armazenamento import ArmazemCamadas, ArmazemShapefiles, StorageLocal, StorageSupabase
+from .camadas import manifesto_para_consulta, resumir_resultados
+from .captcha_fila import CaptchaAbortado
+from .captcha_solver import SolucionadorCaptcha
+from .config import settings
+from .car_downloader import download_car_websocket
+from .escrita import EscritorAgrupado
+from .geoespacial import IndiceEspacial
+from .normalizacao import normalizar_dados
+from .supabase_client import repositorio
+from .utils import cadastro_foi_alterado
+
+logger = logging.getLogger(__name__)
+
+
+MODOS_CONSULTA = ("completo", "refresh")
+
+# Singleton: limita navegadores simultâneos para todas as origens (WebSocket e agendador)
+controle_admissao = ControleAdmissao(
+    max_navegadores=settings.max_navegadores,
+    memoria_minima_livre_mb=settings.memoria_minima_livre_mb,
+    memoria_por_navegador_mb=settings.memoria_por_navegador_mb,
+    pesos_clientes=parse_pesos_clientes(settings.pesos_clientes),
+    slots_reservados_interativos=settings.slots_reservados_interativos
+)
+
+# Singleton: modelo de CAPTCHA carregado uma vez e métricas de precisão
+solucionador_captcha = SolucionadorCaptcha.a_partir_de_arquivo(
+    settings.captcha_modelo_path,
+    limiar_confianca=settings.captcha_limiar_confianca,
+    pasta_amostras=settings.captcha_amostras_dir or None
+)
+
+
+# Singleton: alterações das linhas de duploa_consultas_car acumuladas e gravadas
+# nos limites de etapa (interativas) ou em lotes periódicos (bulk)
+escritor_consultas = EscritorAgrupado(
+    repositorio,
+    "duploa_consultas_car",
+    intervalo=settings.escrita_intervalo_segundos,
+    max_lote=settings.escrita_max_lote
+)
+
+
+# Singletons: artefatos no Storage endereçados por SHA-256 (upload deduplicado,
+# em partes e retomável; diretório local no lugar do Storage em desenvolvimento)
+_tamanho_parte = settings.storage_tamanho_parte_mb * 1024 * 1024
+storage_artefatos = (
+    StorageLocal(settings.storage_local_dir, tamanho_parte=_tamanho_parte)
+    if settings.storage_local_dir
+    else StorageSupabase(repositorio, tamanho_parte=_tamanho_parte)
+)
+armazem_shapefiles = ArmazemShapefiles(repositorio, storage=storage_artefatos, bucket="car-shapefiles")
+armazem_camadas = ArmazemCamadas(storage_artefatos, bucket="car-camadas")
+
+# Singleton: geometrias das camadas no PostGIS (se ENABLE_POSTGIS=true)
+indice_espacial = IndiceEspacial(repositorio)
+
+
+class ConsultaInterrompida(CaptchaAbortado):
+    """O solicitante da consulta deixou de estar disponível (ex.: WebSocket caiu)"""
+    pass
+
+
+async def buscar_consulta_anterior(numero_car: str, cliente_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Busca a última consulta concluída (com shapefile) de um CAR feita pelo cliente
+
+    Resultados não são compartilhados entre clientes: o refresh de um cliente
+    nunca copia demonstrativo, shapefile ou camadas da consulta de outro.
+
+    Returns:
+        Registro com dados_demonstrativo, shapefile e manifesto das camadas, ou None
+    """
+    anteriores = await repositorio.table("duploa_consultas_car").select(
+        "id, dados_demonstrativo, shapefile_url, shapefile_size, shapefile_sha256, camadas"
+    ).eq("cliente_id", cliente_id).eq("numero_car", numero_car).eq("status", "concluido").order(
+        "consulta_concluida_em", desc=True
+    ).limit(1).execute()
+
+    if anteriores.data and anteriores.data[0].get("shapefile_url"):
+        return anteriores.data[0]
+
+    return None
+
+
+def mensagem_erro_consulta(e: Exception) -> str:
+    """Mensagem de erro gravada em duploa_consultas_car.erro_mensagem"""
+    erro_msg = str(e).lower()
+
+    if isinstance(e, ConsultaInterrompida):
+        return str(e)
+
+    # Se for erro de CAPTCHA/shapefile, mensagem específica
+    if "captcha" in erro_msg:
+        return "❌ ERRO: CAPTCHA incorreto ou shapefile não foi baixado. Por favor, tente novamente e digite o CAPTCHA com atenção."
+    if "shapefile" in erro_msg:
+        return f"❌ ERRO: Shapefile obrigatório não foi baixado. {str(e)}"
+
+    return str(e)
+
+
+async def executar_consulta(
+    numero_car: str,
+    cliente_id: str,
+    resolver_captcha: Callable[[bytes], Awaitable[str]],
+    enviar_progresso: Optional[Callable[[str, str], Awaitable[None]]] = None,
+    modo: str = "completo",
+    ao_enfileirar: Optional[Callable[[int, float], Awaitable[None]]] = None,
+    prioridade: str = PRIORIDADE_INTERATIVA,
+    resultado_captcha: Optional[Callable[[bool], Awaitable[None]]] = None,
+    enviar_parcial: Optional[Callable[[str, Dict[str, Any], Optional[str]], Awaitable[None]]] = None
+) -> Dict[str, Any]:
+    """
+    Executa uma consulta CAR de ponta a ponta e persiste o resultado
+
+    A consulta só começa quando o controle de admissão libera um slot de
+    navegador; até lá fica na fila da sua faixa de prioridade (justa entre
+    clientes). Consultas bulk preemptadas num limite de etapa voltam para a
+    fila e recomeçam reaproveitando o mesmo registro de consulta.
+
+    Args:
+        numero_car: Número do CAR já normalizado
+        cliente_id: ID do cliente no Supabase
+        resolver_captcha: Função assíncrona que recebe bytes da imagem e retorna texto do CAPTCHA
+        enviar_progresso: Função assíncrona opcional para atualizações de progresso
+        modo: "completo" ou "refresh" (pula shapefile se o cadastro não mudou)
+        ao_enfileirar: Função assíncrona opcional chamada com (posição, espera estimada em s)
+            enquanto a consulta aguarda na fila
+        prioridade: "interativa" (usuário aguardando) ou "bulk" (lotes e agendador)
+        resultado_captcha: Função assíncrona opcional informada se cada resposta de CAPTCHA foi aceita
+        enviar_parcial: Função assíncrona opcional chamada com (parte, dados, camada) para
+            cada resultado parcial (popup, demonstrativo e o resumo de cada camada: feições
+            e bbox ao converter, URL/ETag ao armazenar; nunca a geometria)
+
+    Returns:
+        Dict com consulta_id, shapefile_url, shapefile_reaproveitado, resultados,
+        resumo (estatísticas do imóvel) e camadas (manifesto com URL/ETag por camada)
+
+    Raises:
+        Exception: Qualquer falha; a consulta já fica marcada como 'erro' no Supabase
+    """
+    if modo not in MODOS_CONSULTA:
+        raise ValueError(f"modo inválido: {modo}")
+
+    estado = {"consulta_id": None}
+
+    while True:
+        async with controle_admissao.slot(
+            ao_enfileirar=ao_enfileirar,
+            cliente_id=cliente_id,
+            prioridade=prioridade
+        ) as reserva:
+            try:
+                return await _executar_consulta(
+                    numero_car, cliente_id, resolver_captcha, enviar_progresso, modo,
+                    reserva.checkpoint, estado, resultado_captcha, enviar_parcial, prioridade
+                )
+            except ConsultaPreemptada as e:
+                logger.info(f"Consulta {estado['consulta_id']} preemptada na etapa '{e.etapa}', voltando para a fila")
+
+        if enviar_progresso:
+            await enviar_progresso("fila", "Navegador cedido a uma consulta interativa, aguardando novo slot...")
+
+
+async def _executar_consulta(
+    numero_car: str,
+    cliente_id: str,
+    resolver_captcha: Callable[[bytes], Awaitable[str]],
+    enviar_progresso: Optional[Callable[[str, str], Awaitable[None]]],
+    modo: str,
+    checkpoint: Callable[[str], Awaitable[None]],
+    estado: Dict[str, Any],
+    resultado_captcha: Optional[Callable[[bool], Awaitable[None]]],
+    enviar_parcial: Optional[Callable[[str, Dict[str, Any], Optional[str]], Awaitable[None]]],
+    prioridade: str
+) -> Dict[str, Any]:
+    """Corpo da consulta, executado com um slot de navegador reservado"""
+    consulta_id = estado.get("consulta_id")
+    temp_dir = None
+    envio_shapefile: Optional[asyncio.Task] = None
+
+    # Colunas obrigatórias: toda gravação é um upsert que também pode criar a linha
+    identidade = {"cliente_id": cliente_id, "numero_car": numero_car}
+
+    async def progresso(etapa: str, mensagem: str):
+        if enviar_progresso:
+            await enviar_progresso(etapa, mensagem)
+
+    async def gravar(campos: Dict[str, Any], imediato: bool = False):
+        """
+        Registra alterações da consulta. Interativas gravam em cada limite de
+        etapa (o cliente pode ler a linha); bulk acumulam para o lote periódico.
+        `imediato` grava já (erros); no fim, bulk aguarda o lote.
+        """
+        escritor_consultas.alterar(consulta_id, {**identidade, **campos})
+        if imediato or prioridade == PRIORIDADE_INTERATIVA:
+            await escritor_consultas.descarregar(consulta_id)
+
+    try:
+        # Modo refresh: buscar última consulta concluída deste CAR para comparação
+        consulta_anterior = None
+        if modo == "refresh":
+            consulta_anterior = await buscar_consulta_anterior(numero_car, cliente_id)
+            if consulta_anterior:
+                logger.info(f"Modo refresh: comparando com consulta {consulta_anterior['id']}")
+            else:
+                logger.info("Modo refresh sem consulta anterior concluída, executando consulta completa")
+
+        # Criar registro no Supabase (retomada após preempção reaproveita o registro)
+        if not consulta_id:
+            consulta_id = str(uuid.uuid4())
+            estado["consulta_id"] = consulta_id
+            await gravar({
+                "status": "processando",
+                "consulta_iniciada_em": datetime.utcnow().isoformat()
+            })
+            logger.info(f"Consulta criada: {consulta_id}")
+
+        # Criar diretório temporário
+        temp_dir = tempfile.mkdtemp(prefix=f"car_{consulta_id}_")
+        logger.info(f"Diretório temporário: {temp_dir}")
+
+        # Callback para salvar dados assim que demonstrativo for extraído
+        async def salvar_dados_demonstrativo(dados: dict):
+            """Salva dados do popup + demonstrativo ANTES de tentar o shapefile"""
+            logger.info("📊 SALVANDO dados do demonstrativo no Supabase (ANTES do shapefile)...")
+
+            try:
+                await gravar({
+                    "status_cadastro": dados["info_popup"].get("Status do Cadastro"),
+                    "tipo_imovel": dados["info_popup"].get("Tipo de imóvel"),
+                    "municipio": dados["info_popup"].get("Município"),
+                    "area_total": dados["info_popup"].get("Área"),
+                    "dados_demonstrativo": dados.get("dados_demonstrativo"),
+                    # Mesmos valores em colunas tipadas (hectares, datas) para filtros e somas
+                    **normalizar_dados(dados["info_popup"].get("Área"), dados.get("dados_demonstrativo")),
+                    # Status ainda é 'processando' pois falta o shapefile
+                })
+
+                logger.info("✅ Dados do demonstrativo salvos com sucesso!")
+                await progresso("dados_salvos", "Dados do demonstrativo salvos no banco")
+
+            except ConsultaInterrompida:
+                raise
+            except Exception as e:
+                logger.error(f"Erro ao salvar dados do demonstrativo: {e}")
+                # Não falhar a consulta por erro ao salvar
+
+        # Upload começa assim que o ZIP é salvo, em paralelo à conversão para GeoJSON
+        def shapefile_salvo(caminho: str):
+            nonlocal envio_shapefile
+            envio_shapefile = asyncio.create_task(armazem_shapefiles.armazenar(caminho))
+
+        # Callback do modo refresh: decide se CAPTCHA + shapefile são necessários
+        async def verificar_alteracao(dados: dict) -> bool:
+            """Retorna True se o cadastro mudou desde a consulta anterior"""
+            return cadastro_foi_alterado(
+                consulta_anterior.get("dados_demonstrativo"),
+                dados.get("dados_demonstrativo")
+            )
+
+        # Executar download
+        logger.info("Iniciando download CAR...")
+        resultados = await download_car_websocket(
+            numero_car=numero_car,
+            pasta_destino=temp_dir,
+            resolver_captcha=resolver_captcha,
+            enviar_progresso=enviar_progresso,
+            callback_dados_extraidos=salvar_dados_demonstrativo,
+            verificar_alteracao=verificar_alteracao if consulta_anterior else None,
+            checkpoint=checkpoint,
+            resultado_captcha=resultado_captcha,
+            solucionador_captcha=solucionador_captcha.etapa() if settings.enable_captcha_solver else None,
+            enviar_parcial=enviar_parcial,
+            ao_salvar_shapefile=shapefile_salvo,
+            headless=settings.headless,
+            slow_mo=settings.slow_mo
+        )
+
+        logger.info("Download concluído, processando resultados...")
+
+        shapefile_reaproveitado = resultados.get("cadastro_alterado") is False
+
+        if shapefile_reaproveitado:
+            # Cadastro sem alterações: reaproveitar shapefile e GeoJSON da consulta anterior
+            logger.info(f"Reaproveitando shapefile da consulta {consulta_anterior['id']}")
+            shapefile_url = consulta_anterior["shapefile_url"]
+            resultados["shapefile_size"] = consulta_anterior.get("shapefile_size")
+
+            if consulta_anterior.get("camadas"):
+                resultados["camadas"] = manifesto_para_consulta(consulta_anterior["camadas"], consulta_id)
+            else:
+                # Consulta anterior à migração: GeoJSON ainda na linha, vira objetos agora
+                legado = await repositorio.table("duploa_consultas_car").select(
+                    "geojson_layers"
+                ).eq("id", consulta_anterior["id"]).limit(1).execute()
+                resultados["camadas"] = await armazem_camadas.armazenar(
+                    consulta_id, (legado.data[0].get("geojson_layers") if legado.data else None) or {}
+                )
+
+            await gravar({
+                "status": "concluido",
+                "shapefile_url": shapefile_url,
+                "shapefile_size": consulta_anterior.get("shapefile_size"),
+                "shapefile_sha256": consulta_anterior.get("shapefile_sha256"),
+                "shapefile_reaproveitado": True,
+                "camadas": resultados["camadas"],
+                "consulta_concluida_em": datetime.utcnow().isoformat()
+            })
+
+        else:
+            # VALIDAÇÃO CRÍTICA: Shapefile é OBRIGATÓRIO!
+            if not resultados.get("arquivo_shapefile"):
+                logger.error("❌ ERRO CRÍTICO: Shapefile não foi baixado!")
+                logger.error(f"❌ Cliente: {cliente_id} | CAR: {numero_car}")
+                raise Exception("Shapefile é obrigatório mas não foi baixado. Verifique se o CAPTCHA foi digitado corretamente.")
+
+            # Upload do shapefile para Supabase Storage (endereçado por conteúdo)
+            logger.info("Armazenando shapefile no Supabase Storage...")
+
+            try:
+                armazenado = await (envio_shapefile or armazem_shapefiles.armazenar(resultados["arquivo_shapefile"]))
+                shapefile_url = armazenado["url"]
+                shapefile_size = armazenado["tamanho"]
+                shapefile_sha256 = armazenado["sha256"]
+
+                if armazenado["enviado"]:
+                    logger.info(f"Shapefile uploaded: {shapefile_url}")
+                else:
+                    logger.info(f"Shapefile já existia no Storage: {shapefile_url}")
+
+            except Exception as e:
+                logger.error(f"Erro ao fazer upload do shapefile: {e}")
+                raise Exception(f"Erro crítico ao fazer upload do shapefile: {e}")
+
+            # VALIDAÇÃO: GeoJSON layers também são obrigatórios
+            if not resultados.get("geojson_layers") or len(resultados.get("geojson_layers", {})) == 0:
+                logger.error("❌ ERRO CRÍTICO: GeoJSON layers não foram extraídos do shapefile!")
+                logger.error(f"❌ Cliente: {cliente_id} | CAR: {numero_car}")
+                raise Exception("GeoJSON layers são obrigatórios mas não foram extraídos do shapefile")
+
+            # Camadas como objetos gzip no Storage; a linha guarda só o manifesto
+            logger.info("Armazenando camadas GeoJSON no Supabase Storage...")
+            try:
+                resultados["camadas"] = await armazem_camadas.armazenar(consulta_id, resultados["geojson_layers"])
+            except Exception as e:
+                logger.error(f"Erro ao armazenar camadas GeoJSON: {e}")
+                raise Exception(f"Erro crítico ao armazenar camadas GeoJSON: {e}")
+
+            # Camadas armazenadas: o cliente já pode ler cada uma pela URL (com ETag)
+            if enviar_parcial:
+                for nome, entrada in resultados["camadas"].items():
+                    await enviar_parcial("camada", {k: v for k, v in entrada.items() if k != "variantes"}, nome)
+
+            # Atualizar registro no Supabase (dados já foram salvos, só atualizar shapefile, camadas e status)
+            logger.info("Atualizando registro no Supabase com shapefile e manifesto das camadas...")
+            await gravar({
+                "status": "concluido",
+                "shapefile_url": shapefile_url,
+                "shapefile_size": shapefile_size,
+                "shapefile_sha256": shapefile_sha256,
+                "camadas": resultados["camadas"],
+                "consulta_concluida_em": datetime.utcnow().isoformat()
+            })
+
+        # Bulk: a conclusão entra no próximo lote; só retorna depois de gravada
+        await escritor_consultas.confirmar(consulta_id)
+        logger.info("Registro atualizado com sucesso")
+
+        # Geometrias no PostGIS só depois da linha gravada (chave estrangeira). Cadastro
+        # reaproveitado já está indexado; falha aqui não desfaz a consulta
+        if settings.enable_postgis and not shapefile_reaproveitado:
+            try:
+                await indice_espacial.gravar(consulta_id, numero_car, resultados["geojson_layers"])
+            except Exception as e:
+                logger.warning(f"Erro ao gravar geometrias no PostGIS (consulta {consulta_id}): {e}")
+
+        return {
+            "consulta_id": consulta_id,
+            "numero_car": numero_car,
+            "shapefile_url": shapefile_url,
+            "shapefile_reaproveitado": shapefile_reaproveitado,
+            "resultados": resultados,
+            "resumo": resumir_resultados(resultados),
+            # Manifesto das camadas (URL/ETag): a conclusão não carrega o GeoJSON
+            "camadas": resultados["camadas"]
+        }
+
+    except ConsultaPreemptada:
+        # Não é erro: a consulta volta para a fila e recomeça
+        raise
+
+    except asyncio.CancelledError:
+        # Cancelada pelo cliente: não deixar o registro preso em 'processando'
+        logger.info(f"Consulta {consulta_id} cancelada: {numero_car}")
+        if consulta_id:
+            try:
+                await gravar({
+                    "status": "erro",
+                    "erro_mensagem": "Consulta cancelada pelo cliente",
+                    "consulta_concluida_em": datetime.utcnow().isoformat()
+                }, imediato=True)
+            except Exception as db_error:
+                logger.error(f"Erro ao marcar consulta {consulta_id} como cancelada: {db_error}")
+        raise
+
+    except Exception as e:
+        logger.error(f"Erro no processamento do CAR {numero_car}: {e}", exc_info=True)
+        logger.error(f"🔍 INFORMAÇÕES DO ERRO - Cliente ID: {cliente_id}, CAR: {numero_car}, Consulta ID: {consulta_id}")
+
+        # SEMPRE marcar como ERRO se não tiver shapefile
+        # Shapefile é OBRIGATÓRIO para o mapa funcionar!
+        if consulta_id:
+            try:
+                await gravar({
+                    "status": "erro",
+                    "erro_mensagem": mensagem_erro_consulta(e),
+                    "consulta_concluida_em": datetime.utcnow().isoformat()
+                }, imediato=True)
+            except Exception as db_error:
+                logger.error(f"Erro ao marcar consulta {consulta_id} como erro: {db_error}")
+
+        raise
+
+    finally:
+        # Consulta falhou depois de salvar o ZIP: o upload não deve ler um diretório removido
+        if envio_shapefile:
+            envio_shapefile.cancel()
+            await asyncio.gather(envio_shapefile, return_exceptions=True)
+
+        # Copiar screenshot de debug antes de remover diretório
+        if temp_dir and os.path.exists(temp_dir):
+            try:
+                debug_screenshot = os.path.join(temp_dir, "debug_before_shapefile.png")
+                if os.path.exists(debug_screenshot):
+                    # Copiar para diretório atual
+                    debug_dest = f"debug_{consulta_id}.png"
+                    shutil.copy2(debug_screenshot, debug_dest)
+                    logger.info(f"Screenshot de debug copiado para: {debug_dest}")
+            except Exception as e:
+                logger.warning(f"Erro ao copiar screenshot de debug: {e}")
+
+        # Limpar diretório temporário
+        if temp_dir and os.path.exists(temp_dir):
+            try:
+                shutil.rmtree(temp_dir)
+                logger.info(f"Diretório temporário removido: {temp_dir}")
+            except Exception as e:
+                logger.error(f"Erro ao remover diretório temporário: {e}")
@@ -0,0 +1,136 @@
+"""
+Cota diária de consultas por cliente
+Aplica Settings.max_consultas_por_dia com contadores em memória (rejeição
+imediata, antes de qualquer navegador) respaldados por contadores diários no
+Supabase (tabela duploa_uso_diario), compartilhados entre réplicas
+"""
+import logging
+from datetime import date, datetime
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+
+class CotaExcedida(Exception):
+    """Cliente atingiu o limite diário de consultas"""
+
+    def __init__(self, cliente_id: str, limite: int):
+        self.cliente_id = cliente_id
+        self.limite = limite
+        super().__init__(f"Limite diário de {limite} consultas atingido para o cliente {cliente_id}")
+
+
+class CotaDiaria:
+    """
+    Token bucket diário por cliente_id
+
+    O bucket de cada cliente começa o dia com `limite_diario` tokens e é
+    reabastecido à meia-noite (fuso configurado). O saldo é mantido em memória;
+    na primeira consulta do dia o uso é lido do Supabase e cada reserva é
+    incrementada atomicamente lá pela função `incrementar_uso_diario`.
+
+    A reserva acontece na admissão (para rejeitar antes de abrir navegador);
+    só consultas concluídas contam: quem reservou devolve o token com
+    `devolver` se a consulta falhar, for interrompida ou cancelada.
+    """
+
+    def __init__(self, supabase, limite_diario: int, fuso_horario: str = "America/Sao_Paulo"):
+        self.supabase = supabase
+        self.limite_diario = limite_diario
+        self.fuso = ZoneInfo(fuso_horario)
+
+        self._dia: Optional[date] = None
+        self._usados: Dict[str, int] = {}
+
+    def _hoje(self) -> date:
+        return datetime.now(self.fuso).date()
+
+    @property
+    def dia(self) -> date:
+        """Dia da cota em vigor (no fuso configurado)"""
+        self._virar_dia()
+        return self._dia
+
+    def _virar_dia(self):
+        hoje = self._hoje()
+        if self._dia != hoje:
+            self._dia = hoje
+            self._usados.clear()
+
+    async def _carregar_uso(self, cliente_id: str) -> int:
+        try:
+            registro = await self.supabase.table("duploa_uso_diario").select("consultas").eq(
+                "cliente_id", cliente_id
+            ).eq("dia", self._dia.isoformat()).limit(1).execute()
+        except Exception as e:
+            logger.warning(f"Erro ao carregar uso diário do cliente {cliente_id}: {e}")
+            return 0
+
+        return registro.data[0]["consultas"] if registro.data else 0
+
+    async def _persistir_uso(self, cliente_id: str):
+        try:
+            resposta = await self.supabase.rpc("incrementar_uso_diario", {
+                "p_cliente_id": cliente_id,
+                "p_dia": self._dia.isoformat()
+            }).execute()
+        except Exception as e:
+            # Mantém o contador em memória; a cota continua valendo nesta réplica
+            logger.warning(f"Erro ao persistir uso diário do cliente {cliente_id}: {e}")
+            return
+
+        # Outras réplicas podem ter consumido do mesmo bucket
+        if isinstance(resposta.data, int):
+            self._usados[cliente_id] = max(self._usados.get(cliente_id, 0), resposta.data)
+
+    async def _persistir_devolucao(self, cliente_id: str, dia: date):
+        try:
+            await self.supabase.rpc("devolver_uso_diario", {
+                "p_cliente_id": cliente_id,
+                "p_dia": dia.isoformat()
+            }).execute()
+        except Exception as e:
+            logger.warning(f"Erro ao devolver uso diário do cliente {cliente_id}: {e}")
+
+    async def restantes(self, cliente_id: str) -> int:
+        """Consultas ainda disponíveis hoje para o cliente"""
+        self._virar_dia()
+        if cliente_id not in self._usados:
+            uso = await self._carregar_uso(cliente_id)
+            # Outra reserva do mesmo cliente pode ter carregado (e consumido) durante a espera
+            self._usados.setdefault(cliente_id, uso)
+        return max(0, self.limite_diario - self._usados[cliente_id])
+
+    async def reservar(self, cliente_id: str) -> int:
+        """
+        Consome uma consulta da cota do dia
+
+        Returns:
+            Consultas restantes após a reserva
+
+        Raises:
+            CotaExcedida: Se o cliente já atingiu o limite diário
+        """
+        if await self.restantes(cliente_id) <= 0:
+            logger.warning(f"Cota diária excedida para cliente {cliente_id} ({self.limite_diario}/dia)")
+            raise CotaExcedida(cliente_id, self.limite_diario)
+
+        self._usados[cliente_id] += 1
+        await self._persistir_uso(cliente_id)
+
+        return max(0, self.limite_diario - self._usados[cliente_id])
+
+    async def devolver(self, cliente_id: str, dia: date):
+        """
+        Devolve uma consulta reservada que não foi concluída
+
+        Args:
+            cliente_id: Cliente que fez a reserva
+            dia: Valor de `dia` no momento da reserva; se o dia já virou, só o
+                contador persistido daquele dia é corrigido
+        """
+        self._virar_dia()
+        if dia == self._dia and self._usados.get(cliente_id, 0) > 0:
+            self._usados[cliente_id] -= 1
+        await self._persistir_devolucao(cliente_id, dia)
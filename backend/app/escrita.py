@@ -0,0 +1,200 @@
+"""
+Escrita agrupada de linhas no Supabase
+As alterações de cada linha (ex.: uma consulta) são acumuladas em memória e
+gravadas de uma vez: na hora, quando quem escreve precisa que o dado já
+esteja visível (limite de etapa de consulta interativa, erro), ou num lote
+periódico que junta muitas linhas num único upsert (consultas bulk, agendador)
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class EscritorAgrupado:
+    """
+    Buffer de alterações por linha de uma tabela
+
+    - `alterar` só mescla os campos no buffer (o valor mais recente vence) e
+      agenda o lote periódico;
+    - `descarregar` grava já as alterações pendentes de uma linha;
+    - `confirmar` aguarda o próximo lote que inclua a linha (ou o que já
+      está gravando a linha) e propaga a falha dessa gravação.
+
+    Cada gravação é um upsert por `chave`, então as alterações devem trazer
+    as colunas obrigatórias da linha (ex.: cliente_id e numero_car) para que
+    a primeira gravação também possa criá-la. No lote, linhas com o mesmo
+    conjunto de colunas vão juntas numa única requisição. As gravações são
+    serializadas para que um lote antigo nunca sobrescreva um valor mais novo.
+
+    Com `somente_atualizar`, as gravações são PATCH filtrado pela `chave`
+    (linhas com os mesmos valores juntas num `in.(...)`): uma linha apagada
+    enquanto a alteração estava no buffer não é recriada.
+    """
+
+    def __init__(
+        self,
+        repositorio,
+        tabela: str,
+        chave: str = "id",
+        intervalo: float = 1.0,
+        max_lote: int = 200,
+        somente_atualizar: bool = False
+    ):
+        self.repositorio = repositorio
+        self.tabela = tabela
+        self.chave = chave
+        self.intervalo = intervalo
+        self.max_lote = max_lote
+        self.somente_atualizar = somente_atualizar
+
+        self._pendentes: Dict[str, Dict[str, Any]] = {}
+        self._esperas: Dict[str, List[asyncio.Future]] = {}
+        # Linhas da gravação em andamento -> quem aguarda o resultado dela
+        self._em_gravacao: Dict[str, List[asyncio.Future]] = {}
+        self._trava = asyncio.Lock()
+        self._tarefa = None
+
+        self.alteracoes = 0
+        self.requisicoes = 0
+        self.linhas_gravadas = 0
+
+    def alterar(self, id_linha: str, campos: Dict[str, Any]):
+        """Acumula alterações da linha (gravadas no próximo lote ou em `descarregar`)"""
+        self.alteracoes += 1
+        self._pendentes.setdefault(id_linha, {self.chave: id_linha}).update(campos)
+        self._agendar()
+
+    async def descarregar(self, id_linha: str):
+        """Grava agora as alterações pendentes da linha"""
+        async with self._trava:
+            linha = self._pendentes.pop(id_linha, None)
+            if linha is None:
+                return
+            esperas = self._esperas.pop(id_linha, [])
+            self._em_gravacao = {id_linha: esperas}
+            try:
+                await self._gravar([linha])
+            except Exception as e:
+                self._em_gravacao = {}
+                self._devolver(id_linha, linha, esperas, e)
+                raise
+            else:
+                self._em_gravacao = {}
+                self._resolver(esperas)
+            finally:
+                self._encerrar_gravacao()
+
+    async def confirmar(self, id_linha: str):
+        """Aguarda a gravação das alterações pendentes da linha no próximo lote"""
+        if id_linha in self._pendentes:
+            esperas = self._esperas.setdefault(id_linha, [])
+            self._agendar()
+        elif id_linha in self._em_gravacao:
+            esperas = self._em_gravacao[id_linha]
+        else:
+            return
+        espera = asyncio.get_running_loop().create_future()
+        esperas.append(espera)
+        await espera
+
+    async def descarregar_tudo(self):
+        """Grava todas as linhas pendentes, agrupadas por conjunto de colunas"""
+        async with self._trava:
+            pendentes, self._pendentes = self._pendentes, {}
+            esperas, self._esperas = self._esperas, {}
+            self._em_gravacao = {id_linha: esperas.setdefault(id_linha, []) for id_linha in pendentes}
+
+            grupos: Dict[frozenset, List[Dict[str, Any]]] = {}
+            for linha in pendentes.values():
+                grupos.setdefault(frozenset(linha), []).append(linha)
+
+            try:
+                for linhas in grupos.values():
+                    for inicio in range(0, len(linhas), self.max_lote):
+                        lote = linhas[inicio:inicio + self.max_lote]
+                        try:
+                            await self._gravar(lote)
+                        except Exception as e:
+                            logger.error(f"[ESCRITA {self.tabela}] Falha ao gravar lote de {len(lote)} linhas: {e}")
+                            for linha in lote:
+                                self._em_gravacao.pop(linha[self.chave], None)
+                                self._devolver(linha[self.chave], linha, esperas.pop(linha[self.chave], []), e)
+                            continue
+                        for linha in lote:
+                            self._em_gravacao.pop(linha[self.chave], None)
+                            self._resolver(esperas.pop(linha[self.chave], []))
+            finally:
+                self._encerrar_gravacao()
+
+            # Quem aguardava uma linha já gravada por `descarregar`
+            for restantes in esperas.values():
+                self._resolver(restantes)
+
+    async def _gravar(self, linhas: List[Dict[str, Any]]):
+        if self.somente_atualizar:
+            await self._atualizar(linhas)
+            return
+        self.requisicoes += 1
+        await self.repositorio.table(self.tabela).upsert(
+            linhas if len(linhas) > 1 else linhas[0], on_conflict=self.chave
+        ).execute()
+        self.linhas_gravadas += len(linhas)
+
+    async def _atualizar(self, linhas: List[Dict[str, Any]]):
+        """Um PATCH por grupo de linhas com os mesmos valores (nunca insere)"""
+        grupos: Dict[str, Tuple[Dict[str, Any], List[str]]] = {}
+        for linha in linhas:
+            valores = {coluna: valor for coluna, valor in linha.items() if coluna != self.chave}
+            grupo = grupos.setdefault(json.dumps(valores, sort_keys=True, default=str), (valores, []))
+            grupo[1].append(linha[self.chave])
+
+        for valores, ids in grupos.values():
+            self.requisicoes += 1
+            consulta = self.repositorio.table(self.tabela).update(valores)
+            consulta = consulta.eq(self.chave, ids[0]) if len(ids) == 1 else consulta.in_(self.chave, ids)
+            await consulta.execute()
+            self.linhas_gravadas += len(ids)
+
+    def _devolver(self, id_linha: str, linha: Dict[str, Any], esperas: List[asyncio.Future], erro: Exception = None):
+        """Falha na gravação: alterações voltam ao buffer (sem apagar valores mais novos)"""
+        self._pendentes[id_linha] = {**linha, **self._pendentes.get(id_linha, {})}
+        for espera in esperas:
+            if not espera.done():
+                espera.set_exception(erro or RuntimeError(f"Falha ao gravar {self.tabela} {id_linha}"))
+        self._agendar()
+
+    def _encerrar_gravacao(self):
+        """Gravação interrompida (ex.: cancelamento): ninguém fica esperando para sempre"""
+        for esperas in self._em_gravacao.values():
+            for espera in esperas:
+                espera.cancel()
+        self._em_gravacao = {}
+
+    @staticmethod
+    def _resolver(esperas: List[asyncio.Future]):
+        for espera in esperas:
+            if not espera.done():
+                espera.set_result(None)
+
+    def _agendar(self):
+        if self._tarefa is None or self._tarefa.done():
+            self._tarefa = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while self._pendentes or self._esperas:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.descarregar_tudo()
+            except Exception as e:
+                logger.error(f"[ESCRITA {self.tabela}] Erro no lote periódico: {e}")
+
+    def metricas(self) -> Dict[str, int]:
+        return {
+            "pendentes": len(self._pendentes),
+            "alteracoes": self.alteracoes,
+            "requisicoes": self.requisicoes,
+            "linhas_gravadas": self.linhas_gravadas
+        }
@@ -0,0 +1,163 @@
+"""
+Geometrias das camadas em PostGIS (tabela duploa_feicoes_car)
+Na conclusão da consulta cada camada é enviada uma vez à função
+duploa_gravar_camada, que converte o GeoJSON em geometrias indexadas (GiST).
+Área, interseção, bbox e sobreposição viram funções SQL chamadas via RPC:
+perguntas sobre milhares de imóveis usam o índice em vez de baixar GeoJSON
+e varrer em Python. Ver migrations/add_postgis_feicoes.sql
+"""
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CAMADA_IMOVEL = "area_do_imovel"
+
+TIPOS_GEOMETRIA = (
+    "Point", "MultiPoint", "LineString", "MultiLineString",
+    "Polygon", "MultiPolygon", "GeometryCollection"
+)
+
+
+def feicoes_para_gravacao(geojson: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    FeatureCollection reduzido ao que o banco grava (geometria e propriedades),
+    sem feições sem geometria
+    """
+    feicoes = [
+        {"geometry": feicao["geometry"], "properties": feicao.get("properties") or {}}
+        for feicao in (geojson or {}).get("features") or []
+        if isinstance(feicao, dict) and isinstance(feicao.get("geometry"), dict)
+    ]
+    return {"type": "FeatureCollection", "features": feicoes}
+
+
+def interpretar_bbox(texto: str) -> Tuple[float, float, float, float]:
+    """
+    Caixa `xmin,ymin,xmax,ymax` em graus (longitude, latitude)
+
+    Raises:
+        ValueError: Formato inválido, fora dos limites ou com min >= max
+    """
+    try:
+        xmin, ymin, xmax, ymax = (float(parte) for parte in texto.split(","))
+    except (AttributeError, ValueError):
+        raise ValueError("bbox deve ser xmin,ymin,xmax,ymax")
+    if not (-180 <= xmin < xmax <= 180 and -90 <= ymin < ymax <= 90):
+        raise ValueError("bbox fora dos limites de longitude/latitude ou com mínimo >= máximo")
+    return xmin, ymin, xmax, ymax
+
+
+def extrair_geometria(corpo: Any) -> Dict[str, Any]:
+    """
+    Geometria GeoJSON de um corpo que pode ser Geometry ou Feature
+
+    Raises:
+        ValueError: Não é uma geometria GeoJSON
+    """
+    if isinstance(corpo, dict) and corpo.get("type") == "Feature":
+        corpo = corpo.get("geometry")
+    if not isinstance(corpo, dict) or corpo.get("type") not in TIPOS_GEOMETRIA:
+        raise ValueError("Esperada uma geometria GeoJSON (Polygon, MultiPolygon...) ou Feature")
+    chave = "geometries" if corpo["type"] == "GeometryCollection" else "coordinates"
+    if not corpo.get(chave):
+        raise ValueError(f"Geometria {corpo['type']} sem {chave}")
+    return corpo
+
+
+class IndiceEspacial:
+    """
+    Gravação e consultas espaciais via funções SQL do PostGIS
+
+    A gravação substitui as feições de cada camada do imóvel (só a geometria
+    mais recente de cada CAR fica indexada). Falhas aqui não devem derrubar a
+    consulta: o GeoJSON continua servido pelo Storage.
+    """
+
+    def __init__(self, repositorio):
+        self.repositorio = repositorio
+
+        self.camadas_gravadas = 0
+        self.feicoes_gravadas = 0
+        self.falhas = 0
+
+    async def gravar(self, consulta_id: str, numero_car: str, geojson_layers: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Envia cada camada à função duploa_gravar_camada (uma chamada por camada)
+
+        Returns:
+            Dict nome da camada -> feições gravadas
+
+        Raises:
+            ErroRepositorio: Falha de uma camada (as anteriores já foram gravadas)
+        """
+        gravadas = {}
+        for nome, geojson in (geojson_layers or {}).items():
+            try:
+                resposta = await self.repositorio.rpc("duploa_gravar_camada", {
+                    "p_numero_car": numero_car,
+                    "p_consulta_id": consulta_id,
+                    "p_camada": nome,
+                    "p_geojson": feicoes_para_gravacao(geojson)
+                }).execute()
+            except Exception:
+                self.falhas += 1
+                raise
+            gravadas[nome] = resposta.data if isinstance(resposta.data, int) else 0
+            self.camadas_gravadas += 1
+            self.feicoes_gravadas += gravadas[nome]
+
+        logger.info(f"[POSTGIS] {numero_car}: {sum(gravadas.values())} feições em {len(gravadas)} camadas")
+        return gravadas
+
+    async def areas(self, numero_car: str) -> List[Dict[str, Any]]:
+        """Área (ha) e número de feições por camada do imóvel"""
+        resposta = await self.repositorio.rpc("duploa_areas_imovel", {"p_numero_car": numero_car}).execute()
+        return resposta.data or []
+
+    async def na_bbox(
+        self,
+        bbox: Tuple[float, float, float, float],
+        camada: str = CAMADA_IMOVEL,
+        limite: int = 100
+    ) -> List[Dict[str, Any]]:
+        """Imóveis com feições da camada dentro da caixa (numero_car, consulta_id, area_ha, bbox)"""
+        xmin, ymin, xmax, ymax = bbox
+        resposta = await self.repositorio.rpc("duploa_imoveis_na_bbox", {
+            "p_xmin": xmin,
+            "p_ymin": ymin,
+            "p_xmax": xmax,
+            "p_ymax": ymax,
+            "p_camada": camada,
+            "p_limite": limite
+        }).execute()
+        return resposta.data or []
+
+    async def intersecao(
+        self,
+        geometria: Dict[str, Any],
+        camada: Optional[str] = None,
+        limite: int = 100
+    ) -> List[Dict[str, Any]]:
+        """Imóveis/camadas que intersectam a geometria, com a área de interseção (ha)"""
+        resposta = await self.repositorio.rpc("duploa_intersecao", {
+            "p_geometria": geometria,
+            "p_camada": camada,
+            "p_limite": limite
+        }).execute()
+        return resposta.data or []
+
+    async def sobreposicoes(self, numero_car: str, limite: int = 100) -> List[Dict[str, Any]]:
+        """Outros imóveis cuja área se sobrepõe à do imóvel (área sobreposta em ha)"""
+        resposta = await self.repositorio.rpc("duploa_sobreposicoes_imovel", {
+            "p_numero_car": numero_car,
+            "p_limite": limite
+        }).execute()
+        return resposta.data or []
+
+    def metricas(self) -> Dict[str, int]:
+        return {
+            "camadas_gravadas": self.camadas_gravadas,
+            "feicoes_gravadas": self.feicoes_gravadas,
+            "falhas": self.falhas
+        }
@@ -0,0 +1,107 @@
+"""
+Leitura de consultas pela API REST
+Projeção de colunas (lista branca), paginação por cursor (keyset em
+created_at + id, sem OFFSET) e ETags de versão derivados de id + updated_at,
+que permitem responder 304 consultando só essas duas colunas
+"""
+import base64
+import hashlib
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .normalizacao import COLUNAS_TIPADAS
+
+# Colunas legíveis pela API (geojson_layers, legado e pesado, fica de fora)
+CAMPOS_CONSULTA = (
+    "id", "cliente_id", "numero_car", "status", "erro_mensagem",
+    "status_cadastro", "tipo_imovel", "municipio", "area_total", "dados_demonstrativo",
+    "shapefile_url", "shapefile_size", "shapefile_sha256", "shapefile_reaproveitado", "camadas",
+    "consulta_iniciada_em", "consulta_concluida_em", "created_at", "updated_at",
+    *COLUNAS_TIPADAS
+)
+
+# Padrão da listagem: o que um painel mostra por linha
+CAMPOS_LISTAGEM = (
+    "id", "numero_car", "status", "status_cadastro", "municipio", "area_total",
+    "consulta_concluida_em", "created_at", "updated_at"
+)
+
+LIMITE_MAXIMO = 200
+
+
+def projetar_campos(
+    campos: Optional[str],
+    padrao: Sequence[str],
+    obrigatorios: Sequence[str] = ()
+) -> List[str]:
+    """
+    Colunas a selecionar a partir de `?campos=a,b,c`
+
+    Args:
+        campos: Lista separada por vírgulas (None ou vazio usa `padrao`)
+        padrao: Colunas quando `campos` não é informado
+        obrigatorios: Colunas sempre incluídas (cursor, ETag)
+
+    Returns:
+        Colunas sem repetição, na ordem pedida
+
+    Raises:
+        ValueError: Coluna fora de CAMPOS_CONSULTA
+    """
+    pedidos = [c.strip() for c in campos.split(",") if c.strip()] if campos else list(padrao)
+    desconhecidos = [c for c in pedidos if c not in CAMPOS_CONSULTA]
+    if desconhecidos:
+        raise ValueError(f"Campos inválidos: {', '.join(desconhecidos)}")
+    return list(dict.fromkeys([*pedidos, *obrigatorios]))
+
+
+def codificar_cursor(linha: Dict[str, Any]) -> str:
+    """Cursor opaco apontando para depois da linha (created_at, id)"""
+    bruto = json.dumps([linha["created_at"], linha["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Raises:
+        ValueError: Cursor malformado (ou adulterado: os valores vão para o
+            filtro do PostgREST, então só passam UUID e data ISO 8601)
+    """
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        criado_em, id_linha = json.loads(bruto)
+        id_linha = str(uuid.UUID(id_linha))
+        datetime.fromisoformat(criado_em)
+    except Exception:
+        raise ValueError("Cursor inválido")
+    return criado_em, id_linha
+
+
+def filtro_apos_cursor(criado_em: str, id_linha: str) -> str:
+    """Filtro `or` do PostgREST para (created_at, id) < cursor em ordem decrescente"""
+    return f'created_at.lt."{criado_em}",and(created_at.eq."{criado_em}",id.lt.{id_linha})'
+
+
+def etag_versoes(campos: Sequence[str], linhas: List[Dict[str, Any]]) -> str:
+    """
+    ETag fraco da resposta: muda quando alguma linha é atualizada (updated_at),
+    entra ou sai da página, ou quando a projeção muda
+    """
+    versoes = [[linha.get("id"), linha.get("updated_at")] for linha in linhas]
+    bruto = json.dumps([list(campos), versoes], separators=(",", ":")).encode()
+    return 'W/"' + hashlib.sha256(bruto).hexdigest()[:32] + '"'
+
+
+def corresponde_etag(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparação fraca do If-None-Match (lista de ETags ou "*")"""
+    if not if_none_match:
+        return False
+
+    def opaco(valor: str) -> str:
+        valor = valor.strip()
+        return valor[2:] if valor.startswith("W/") else valor
+
+    candidatos = [opaco(v) for v in if_none_match.split(",")]
+    return "*" in candidatos or opaco(etag) in candidatos
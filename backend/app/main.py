@@ -2,29 +2,73 @@
 roboCAR Backend API
 FastAPI application with WebSocket support for CAR automation
 """
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, status
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
 import logging
 import base64
 import asyncio
-from datetime import datetime
+import gzip
+import re
+import time
+import uuid
+from datetime import date, datetime, timedelta
 from typing import Optional
-import tempfile
-import shutil
-import os
 
 from .config import settings
 from .models import (
     CarDownloadRequest,
+    ConsultaWebhookRequest,
+    IntersecaoRequest,
+    WatchlistItemRequest,
     ProgressMessage,
+    QueuedMessage,
     CaptchaMessage,
+    CaptchaLoteItem,
+    CaptchaLoteMessage,
     CompletedMessage,
-    ErrorMessage
+    PartialResultMessage,
+    ErrorMessage,
+    CancelledMessage,
+    SessionMessage
 )
-from .car_downloader import download_car_websocket
-from .supabase_client import supabase_client
+from .admissao import PRIORIDADES, PRIORIDADE_INTERATIVA
+from .consulta_executor import (
+    executar_consulta,
+    ConsultaInterrompida,
+    MODOS_CONSULTA,
+    armazem_camadas,
+    controle_admissao,
+    escritor_consultas,
+    indice_espacial,
+    solucionador_captcha,
+    storage_artefatos
+)
+from .camadas import escolher_codificacao, etag_conteudo, etag_variante, serializar_geojson, variantes_camada
+from .captcha_imagem import MetricasCaptcha, VARIANTE_PREPROCESSADA, preprocessar_captcha
+from .captcha_fila import FilaCaptcha, parse_tokens_operadores
+from .car_downloader import URL_CONSULTA_PUBLICA
+from .codec import CodecMensagens
+from .cota import CotaDiaria, CotaExcedida
+from .escrita import EscritorAgrupado
+from .geoespacial import CAMADA_IMOVEL, extrair_geometria, interpretar_bbox
+from .leitura import (
+    CAMPOS_CONSULTA,
+    CAMPOS_LISTAGEM,
+    LIMITE_MAXIMO,
+    codificar_cursor,
+    corresponde_etag,
+    decodificar_cursor,
+    etag_versoes,
+    filtro_apos_cursor,
+    projetar_campos
+)
+from .saude import MonitorSaude, SondaIndisponivel
+from .scheduler import AgendadorWatchlist
+from .sessoes import ConexaoWebSocket, GerenciadorSessoes, SessaoConsulta
+from .supabase_client import repositorio
 from .utils import normalizar_numero_car, validar_formato_car
+from .webhooks import EntregadorWebhook, ObservadorMarcos, validar_url_callback
 
 # Configurar logging
 logging.basicConfig(
@@ -37,7 +81,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="roboCAR API",
     description="API para automação de consulta de dados do CAR",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS
@@ -49,6 +94,127 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Cota diária por cliente (aplicada se ENABLE_RATE_LIMIT=true)
+cota_diaria = CotaDiaria(
+    supabase=repositorio,
+    limite_diario=settings.max_consultas_por_dia,
+    fuso_horario=settings.fuso_horario
+)
+
+# Fila compartilhada de CAPTCHAs (cliente solicitante + operadores)
+fila_captcha = FilaCaptcha(
+    validade=settings.captcha_validade_segundos,
+    prazo_operador=settings.captcha_prazo_operador_segundos
+)
+tokens_operadores = parse_tokens_operadores(settings.captcha_operador_tokens)
+
+# Taxa de retentativa por variante da imagem (original x pré-processada)
+metricas_captcha = MetricasCaptcha(
+    fracao_preprocessada=settings.captcha_fracao_preprocessada if settings.captcha_preprocessamento else 0.0
+)
+
+# Sessões retomáveis das consultas via WebSocket
+gerenciador_sessoes = GerenciadorSessoes(
+    carencia=settings.sessao_carencia_segundos,
+    max_eventos=settings.sessao_max_eventos
+)
+
+# Entregas de webhook em andamento (referência forte até o último lote)
+entregas_webhook: dict = {}
+
+# Reagendamentos da watchlist gravados em lote; só atualizam (item removido
+# pelo cliente durante a re-verificação não volta)
+escritor_watchlist = EscritorAgrupado(
+    repositorio,
+    "duploa_watchlist_car",
+    intervalo=settings.escrita_intervalo_segundos,
+    max_lote=settings.escrita_max_lote,
+    somente_atualizar=True
+)
+
+# Agendador da watchlist (re-verificações fora de pico)
+agendador = AgendadorWatchlist(
+    supabase=repositorio,
+    executar_consulta=executar_consulta,
+    fila_captcha=fila_captcha,
+    escritor=escritor_watchlist,
+    janela_inicio=settings.scheduler_janela_inicio,
+    janela_fim=settings.scheduler_janela_fim,
+    fuso_horario=settings.fuso_horario,
+    orcamento_por_hora=settings.portal_orcamento_por_hora,
+    max_simultaneas=settings.scheduler_max_simultaneas,
+    intervalo_tick=settings.scheduler_intervalo_tick
+)
+
+
+# Sondas de dependências em segundo plano (/health e /ready leem o cache)
+monitor_saude = MonitorSaude(
+    intervalo=settings.saude_intervalo_segundos,
+    timeout=settings.saude_timeout_segundos
+)
+
+
+async def _sondar_supabase():
+    await repositorio.table("duploa_consultas_car").select("id").limit(1).execute()
+
+
+async def _sondar_storage():
+    return await storage_artefatos.verificar("car-shapefiles")
+
+
+async def _sondar_navegadores():
+    metricas = controle_admissao.metricas()
+    detalhes = {
+        "ativos": metricas["navegadores_ativos"],
+        "max": metricas["max_navegadores"],
+        "fila": metricas["fila"],
+        "bloqueado_por_memoria": metricas["bloqueado_por_memoria"],
+        "memoria_disponivel_mb": metricas["memoria_disponivel_mb"]
+    }
+    if metricas["fila"] >= settings.readiness_max_fila:
+        raise SondaIndisponivel(f"{metricas['fila']} consultas aguardando navegador", detalhes)
+    return detalhes
+
+
+async def _sondar_fila_captcha():
+    return {"pendentes": fila_captcha.pendentes, "operadores_online": fila_captcha.operadores_online}
+
+
+async def _sondar_portal():
+    import httpx
+
+    async with httpx.AsyncClient(timeout=settings.saude_timeout_segundos, follow_redirects=True) as cliente:
+        resposta = await cliente.head(URL_CONSULTA_PUBLICA)
+    if resposta.status_code >= 500:
+        raise SondaIndisponivel(f"Portal respondeu HTTP {resposta.status_code}")
+    return {"http": resposta.status_code}
+
+
+monitor_saude.registrar("supabase", _sondar_supabase)
+monitor_saude.registrar("storage", _sondar_storage)
+monitor_saude.registrar("navegadores", _sondar_navegadores)
+# Não críticas: afetam todas as réplicas igualmente, tirar uma do balanceador não ajuda
+monitor_saude.registrar("fila_captcha", _sondar_fila_captcha, critica=False)
+monitor_saude.registrar("portal", _sondar_portal, critica=False, intervalo=settings.saude_intervalo_portal_segundos)
+
+
+@app.on_event("startup")
+async def iniciar_agendador():
+    await monitor_saude.iniciar()
+    if settings.enable_scheduler:
+        await agendador.iniciar()
+
+
+@app.on_event("shutdown")
+async def parar_agendador():
+    monitor_saude.drenar()
+    await monitor_saude.parar()
+    await agendador.parar()
+    # Alterações ainda no buffer vão para o banco antes de fechar o pool
+    await escritor_consultas.descarregar_tudo()
+    await escritor_watchlist.descarregar_tudo()
+    await repositorio.fechar()
+
 
 @app.get("/")
 async def root():
@@ -62,43 +228,609 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    checks = {
-        "api": "ok",
-        "supabase": "unknown",
-        "timestamp": datetime.utcnow().isoformat()
-    }
+    """
+    Health check (liveness): snapshot em cache das sondas, sem chamadas externas
+
+    Responde 200 enquanto o processo atende; dependências com problema
+    aparecem como "degraded" no corpo. Decisões de tráfego usam /ready.
+    """
+    return monitor_saude.snapshot()
+
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 503 se alguma dependência crítica falhou, está desatualizada ou a fila lotou"""
+    motivos = monitor_saude.motivos_nao_pronto()
+    return ORJSONResponse(
+        content={"pronto": not motivos, "motivos": motivos},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE if motivos else status.HTTP_200_OK
+    )
 
-    # Verificar Supabase
+
+@app.post("/api/consultas", status_code=status.HTTP_202_ACCEPTED)
+async def criar_consulta_webhook(request: ConsultaWebhookRequest):
+    """
+    Inicia uma consulta em segundo plano e entrega o andamento por webhook
+
+    Os lotes de eventos (mudanças de etapa, CAPTCHA pendente, conclusão ou
+    erro) são enviados para `callback_url` assinados com HMAC-SHA256. Se for
+    preciso CAPTCHA, ele vai para a fila de operadores; um humano também pode
+    resolvê-lo conectando em /ws/consultas com o `resume_token` dentro da
+    carência.
+    """
+    if not settings.webhook_segredo:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Webhooks não configurados (WEBHOOK_SEGREDO)")
+
+    callback_url = str(request.callback_url)
     try:
-        supabase_client.table("duploa_consultas_car").select("id").limit(1).execute()
-        checks["supabase"] = "ok"
-    except Exception as e:
-        checks["supabase"] = "error"
-        logger.error(f"Supabase health check failed: {e}")
+        await validar_url_callback(callback_url, settings.webhook_permitir_rede_interna)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    all_ok = all(v == "ok" for v in [checks["api"], checks["supabase"]])
+    numero_car = normalizar_numero_car(request.numero_car)
+    try:
+        sessao = await _iniciar_sessao(numero_car, request.cliente_id, {
+            "modo": request.modo,
+            "prioridade": request.prioridade
+        })
+    except CotaExcedida as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    entregador = EntregadorWebhook(
+        url=callback_url,
+        segredo=settings.webhook_segredo,
+        job_id=sessao.id,
+        intervalo_lote=settings.webhook_intervalo_lote,
+        max_tentativas=settings.webhook_max_tentativas
+    )
+    sessao.observar(ObservadorMarcos(entregador))
+    entregas_webhook[sessao.id] = entregador
+    entregador.iniciar().add_done_callback(lambda _: entregas_webhook.pop(sessao.id, None))
 
-    return JSONResponse(
+    # Sem cliente conectado: a carência começa já (CAPTCHA fica com operadores)
+    sessao.desanexar()
+
+    logger.info(f"[WEBHOOK] Consulta {sessao.id} iniciada para {numero_car} -> {callback_url}")
+    return {
+        "job_id": sessao.id,
+        "numero_car": numero_car,
+        "resume_token": sessao.token
+    }
+
+
+def _validar_uuid(valor: str, nome: str):
+    try:
+        uuid.UUID(valor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{nome} inválido")
+
+
+@app.get("/api/consultas")
+async def listar_consultas(
+    request: Request,
+    cliente_id: str,
+    campos: Optional[str] = None,
+    limite: int = 50,
+    cursor: Optional[str] = None,
+    status_consulta: Optional[str] = Query(None, alias="status"),
+    numero_car: Optional[str] = None,
+    uf: Optional[str] = None,
+    area_min_ha: Optional[float] = None,
+    area_max_ha: Optional[float] = None
+):
+    """
+    Consultas de um cliente, da mais recente para a mais antiga
+
+    Paginação por cursor (`proximo_cursor` da página anterior), sem OFFSET.
+    Com `If-None-Match`, só id e updated_at da página são lidos para decidir
+    se a resposta mudou (304 sem transferir as demais colunas).
+    `area_min_ha`/`area_max_ha` filtram pela coluna tipada area_total_ha.
+    """
+    _validar_uuid(cliente_id, "cliente_id")
+    if not 1 <= limite <= LIMITE_MAXIMO:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"limite deve estar entre 1 e {LIMITE_MAXIMO}")
+    try:
+        colunas = projetar_campos(campos, CAMPOS_LISTAGEM, obrigatorios=("id", "created_at", "updated_at"))
+        apos = decodificar_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    def pagina(selecao: str):
+        consulta = repositorio.table("duploa_consultas_car").select(selecao).eq("cliente_id", cliente_id)
+        if status_consulta:
+            consulta = consulta.eq("status", status_consulta)
+        if numero_car:
+            consulta = consulta.eq("numero_car", normalizar_numero_car(numero_car))
+        if uf:
+            consulta = consulta.eq("uf", uf.upper())
+        if area_min_ha is not None:
+            consulta = consulta.gte("area_total_ha", area_min_ha)
+        if area_max_ha is not None:
+            consulta = consulta.lte("area_total_ha", area_max_ha)
+        if apos:
+            consulta = consulta.or_(filtro_apos_cursor(*apos))
+        return consulta.order("created_at", desc=True).order("id", desc=True).limit(limite)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        versoes = await pagina("id, updated_at").execute()
+        etag = etag_versoes(colunas, versoes.data)
+        if corresponde_etag(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+    registros = await pagina(",".join(colunas)).execute()
+    linhas = registros.data or []
+    return ORJSONResponse(
         content={
-            "status": "healthy" if all_ok else "degraded",
-            "checks": checks
+            "itens": linhas,
+            "proximo_cursor": codificar_cursor(linhas[-1]) if len(linhas) == limite else None
         },
-        status_code=status.HTTP_200_OK if all_ok else status.HTTP_503_SERVICE_UNAVAILABLE
+        headers={"ETag": etag_versoes(colunas, linhas), "Cache-Control": "private, no-cache"}
     )
 
 
+@app.get("/api/consultas/{consulta_id}")
+async def obter_consulta(consulta_id: str, request: Request, campos: Optional[str] = None):
+    """
+    Uma consulta, com as colunas de `?campos=` (padrão: todas menos o GeoJSON)
+
+    Com `If-None-Match`, responde 304 lendo só updated_at.
+    """
+    _validar_uuid(consulta_id, "consulta_id")
+    try:
+        colunas = projetar_campos(campos, CAMPOS_CONSULTA, obrigatorios=("id", "updated_at"))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    def linha(selecao: str):
+        return repositorio.table("duploa_consultas_car").select(selecao).eq("id", consulta_id).limit(1)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        versao = await linha("id, updated_at").execute()
+        if not versao.data:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Consulta não encontrada")
+        etag = etag_versoes(colunas, versao.data)
+        if corresponde_etag(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+    registro = await linha(",".join(colunas)).execute()
+    if not registro.data:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Consulta não encontrada")
+
+    return ORJSONResponse(
+        content=registro.data[0],
+        headers={"ETag": etag_versoes(colunas, registro.data), "Cache-Control": "private, no-cache"}
+    )
+
+
+@app.get("/api/consultas/{consulta_id}/camadas/{nome}")
+async def obter_camada(consulta_id: str, nome: str, request: Request):
+    """
+    GeoJSON de uma camada da consulta (referenciada na mensagem `completed`)
+
+    Lê só a entrada do manifesto na linha e a variante pré-comprimida (brotli
+    ou gzip, conforme o Accept-Encoding) no Storage, sem comprimir nada aqui.
+    O conteúdo de uma camada não muda depois de gravado, então a resposta é
+    cacheável por longo prazo; cada codificação tem seu ETag forte e
+    `If-None-Match` coincidente responde 304.
+    """
+    _validar_uuid(consulta_id, "consulta_id")
+    if not re.fullmatch(r"\w+", nome):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Nome de camada inválido")
+
+    registro = await repositorio.table("duploa_consultas_car").select(
+        f"camada:camadas->{nome}"
+    ).eq("id", consulta_id).limit(1).execute()
+    entrada = registro.data[0].get("camada") if registro.data else None
+
+    if not entrada:
+        return await _obter_camada_legado(consulta_id, nome, request)
+
+    variantes = variantes_camada(entrada)
+    codificacao = escolher_codificacao(request.headers.get("accept-encoding"), variantes)
+    etag = etag_variante(entrada["etag"], codificacao)
+    cabecalhos = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable", "Vary": "Accept-Encoding"}
+
+    if corresponde_etag(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cabecalhos)
+
+    if codificacao:
+        cabecalhos["Content-Encoding"] = codificacao
+        conteudo = await armazem_camadas.ler(entrada, codificacao)
+    else:
+        # Cliente sem compressão (raro): descomprime a variante gzip
+        conteudo = await asyncio.to_thread(gzip.decompress, await armazem_camadas.ler(entrada, "gzip"))
+
+    return Response(content=conteudo, media_type="application/geo+json", headers=cabecalhos)
+
+
+async def _obter_camada_legado(consulta_id: str, nome: str, request: Request):
+    """Consultas anteriores à migração do manifesto: GeoJSON ainda em geojson_layers"""
+    registro = await repositorio.table("duploa_consultas_car").select(
+        f"camada:geojson_layers->{nome}"
+    ).eq("id", consulta_id).limit(1).execute()
+
+    if not registro.data or not registro.data[0].get("camada"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Camada não encontrada")
+
+    conteudo = await asyncio.to_thread(serializar_geojson, registro.data[0]["camada"])
+    etag = etag_conteudo(conteudo)
+    cabecalhos = {"ETag": etag, "Cache-Control": "private, max-age=300"}
+
+    if corresponde_etag(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cabecalhos)
+
+    return Response(content=conteudo, media_type="application/geo+json", headers=cabecalhos)
+
+
+def _exigir_postgis():
+    if not settings.enable_postgis:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Consultas espaciais desativadas (ENABLE_POSTGIS)")
+
+
+@app.get("/api/espacial/imoveis")
+async def imoveis_na_bbox(bbox: str, camada: str = CAMADA_IMOVEL, limite: int = 100):
+    """Imóveis com feições da camada na caixa `bbox=xmin,ymin,xmax,ymax` (índice GiST)"""
+    _exigir_postgis()
+    if not 1 <= limite <= 1000:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="limite deve estar entre 1 e 1000")
+    try:
+        caixa = interpretar_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"itens": await indice_espacial.na_bbox(caixa, camada, limite)}
+
+
+@app.post("/api/espacial/intersecao")
+async def imoveis_intersectando(request: IntersecaoRequest):
+    """Imóveis/camadas que intersectam a geometria, com a área de interseção em hectares"""
+    _exigir_postgis()
+    try:
+        geometria = extrair_geometria(request.geometria)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"itens": await indice_espacial.intersecao(geometria, request.camada, request.limite)}
+
+
+@app.get("/api/espacial/imoveis/{numero_car}")
+async def areas_imovel(numero_car: str):
+    """Área por camada do imóvel e outros imóveis sobrepostos à sua área"""
+    _exigir_postgis()
+    numero_car = normalizar_numero_car(numero_car)
+    areas, sobreposicoes = await asyncio.gather(
+        indice_espacial.areas(numero_car),
+        indice_espacial.sobreposicoes(numero_car)
+    )
+    if not areas:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Imóvel sem geometrias indexadas")
+    return {"numero_car": numero_car, "camadas": areas, "sobreposicoes": sobreposicoes}
+
+
+@app.post("/api/watchlist", status_code=status.HTTP_201_CREATED)
+async def adicionar_watchlist(item: WatchlistItemRequest):
+    """Adiciona (ou reativa) um CAR na watchlist de re-verificação agendada"""
+    numero_car = normalizar_numero_car(item.numero_car)
+
+    registro = await repositorio.table("duploa_watchlist_car").upsert({
+        "cliente_id": item.cliente_id,
+        "numero_car": numero_car,
+        "intervalo_horas": item.intervalo_horas,
+        "ativo": True,
+        # Primeira verificação na próxima janela fora de pico
+        "proxima_verificacao": agendador.proxima_verificacao(numero_car, 0).isoformat()
+    }, on_conflict="cliente_id,numero_car").execute()
+
+    return registro.data[0]
+
+
+@app.get("/api/watchlist")
+async def listar_watchlist(cliente_id: str):
+    """Lista os CARs monitorados de um cliente"""
+    registros = await repositorio.table("duploa_watchlist_car").select("*").eq(
+        "cliente_id", cliente_id
+    ).order("proxima_verificacao").execute()
+
+    return registros.data
+
+
+@app.delete("/api/watchlist/{item_id}")
+async def remover_watchlist(item_id: str):
+    """Remove um CAR da watchlist"""
+    registro = await repositorio.table("duploa_watchlist_car").delete().eq("id", item_id).execute()
+
+    if not registro.data:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item da watchlist não encontrado")
+
+    return {"removido": item_id}
+
+
+@app.get("/fila")
+async def metricas_fila():
+    """Navegadores ativos, filas por prioridade (com p50/p95 de espera) e memória disponível"""
+    return controle_admissao.metricas()
+
+
+@app.get("/captcha/operadores")
+async def estatisticas_captcha():
+    """Fila de CAPTCHAs, latência/precisão por operador e retentativas por variante da imagem"""
+    return {**fila_captcha.estatisticas(), "imagem": metricas_captcha.estatisticas()}
+
+
+@app.get("/captcha/solucionador")
+async def estatisticas_solucionador():
+    """Precisão do solucionador automático de CAPTCHA"""
+    return solucionador_captcha.estatisticas()
+
+
+@app.get("/sessoes")
+async def metricas_sessoes():
+    """Sessões WebSocket ativas, desconectadas (em carência) e retomadas"""
+    return gerenciador_sessoes.metricas()
+
+
+@app.get("/scheduler/metricas")
+async def metricas_agendador():
+    """Backlog, atraso e orçamento do agendador da watchlist"""
+    return agendador.metricas()
+
+
+async def _resolver_captcha_sessao(sessao: SessaoConsulta, image_bytes: bytes, ultimo_captcha: dict) -> str:
+    """
+    Envia o CAPTCHA ao cliente da sessão (e à fila de operadores) e aguarda a
+    primeira resposta. Se o cliente não voltar dentro da carência e não houver
+    operador conectado, a consulta é interrompida.
+    """
+    logger.info(f"CAPTCHA detectado, enviando para cliente {sessao.cliente_id}...")
+
+    # Recortar, limpar, ampliar e recomprimir (fora do event loop)
+    variante = metricas_captcha.sortear_variante()
+    if variante == VARIANTE_PREPROCESSADA:
+        image_bytes = await asyncio.to_thread(preprocessar_captcha, image_bytes)
+    metricas_captcha.registrar_envio(variante, len(image_bytes))
+
+    # Publicar na fila compartilhada: operadores também podem resolver
+    item = fila_captcha.publicar(image_bytes, sessao.numero_car, sessao.cliente_id)
+    ultimo_captcha["id"] = item.id
+    ultimo_captcha["variante"] = variante
+
+    captcha_msg = CaptchaMessage(captcha_id=item.id)
+    await sessao.emitir(captcha_msg.model_dump(exclude_none=True), imagem=image_bytes)
+
+    # Aguardar a primeira resposta: do cliente ou de um operador (timeout de 5 minutos)
+    resposta = asyncio.create_task(fila_captcha.aguardar(item, timeout=300))
+    abandono = asyncio.create_task(sessao.abandonada.wait())
+    try:
+        await asyncio.wait({resposta, abandono}, return_when=asyncio.FIRST_COMPLETED)
+        if not resposta.done() and not fila_captcha.operadores_online:
+            raise ConsultaInterrompida("Cliente desconectado e nenhum operador disponível para o CAPTCHA")
+        captcha_text = await resposta
+    finally:
+        abandono.cancel()
+        resposta.cancel()
+        sessao.captcha_resolvido()
+
+    if item.respondido_por != f"cliente:{sessao.cliente_id}":
+        await sessao.emitir(ProgressMessage(etapa="captcha", mensagem="CAPTCHA resolvido por um operador").model_dump())
+
+    logger.info(f"CAPTCHA {item.id} resolvido por {item.respondido_por}: {captcha_text}")
+    return captcha_text
+
+
+async def _executar_sessao(sessao: SessaoConsulta, modo: str, prioridade: str, dia_cota: Optional[date] = None):
+    """
+    Executa a consulta da sessão; os eventos vão para o buffer da sessão
+
+    Args:
+        dia_cota: Dia em que a cota diária foi reservada (None se não houve
+            reserva); a reserva é devolvida se a consulta não for concluída
+    """
+    numero_car = sessao.numero_car
+    concluida = False
+    ultimo_captcha = {"id": None, "variante": None}
+
+    async def resolver_captcha_remoto(image_bytes: bytes) -> str:
+        return await _resolver_captcha_sessao(sessao, image_bytes, ultimo_captcha)
+
+    async def reportar_resultado_captcha(aceito: bool):
+        """Alimenta a precisão por operador e a taxa de retentativa com a resposta do portal"""
+        if ultimo_captcha["id"]:
+            fila_captcha.registrar_resultado(ultimo_captcha["id"], aceito)
+            metricas_captcha.registrar_resultado(ultimo_captcha["variante"], aceito)
+
+    # Callback para enviar progresso
+    async def enviar_progresso(etapa: str, mensagem: str):
+        """Envia atualização de progresso para o cliente"""
+        logger.info(f"Progresso - {etapa}: {mensagem}")
+        progress_msg = ProgressMessage(etapa=etapa, mensagem=mensagem)
+        await sessao.emitir(progress_msg.model_dump())
+
+    # Callback para informar posição na fila de admissão
+    async def enviar_posicao_fila(posicao: int, espera_estimada: float):
+        """Envia posição na fila e horário estimado de início"""
+        logger.info(f"[WS] Consulta na fila de admissão: posição {posicao}")
+        queued_msg = QueuedMessage(
+            posicao=posicao,
+            espera_estimada_segundos=int(espera_estimada),
+            inicio_estimado=datetime.utcnow() + timedelta(seconds=espera_estimada)
+        )
+        await sessao.emitir(queued_msg.model_dump(mode="json"))
+
+    # Callback para resultados parciais (popup, demonstrativo e cada camada)
+    async def enviar_parcial(parte: str, dados: dict, camada: Optional[str] = None):
+        """Envia cada parte do resultado assim que fica pronta"""
+        parcial_msg = PartialResultMessage(parte=parte, camada=camada, data=dados)
+        await sessao.emitir(parcial_msg.model_dump())
+
+    try:
+        # Executar consulta (registro, download, upload e GeoJSON)
+        consulta = await executar_consulta(
+            numero_car=numero_car,
+            cliente_id=sessao.cliente_id,
+            resolver_captcha=resolver_captcha_remoto,
+            enviar_progresso=enviar_progresso,
+            modo=modo,
+            ao_enfileirar=enviar_posicao_fila,
+            prioridade=prioridade,
+            resultado_captcha=reportar_resultado_captcha,
+            enviar_parcial=enviar_parcial
+        )
+
+        # Enviar resultado final
+        completed_msg = CompletedMessage(
+            consulta_id=consulta["consulta_id"],
+            numero_car=numero_car,
+            shapefile_url=consulta["shapefile_url"],
+            shapefile_reaproveitado=consulta["shapefile_reaproveitado"],
+            resumo=consulta["resumo"],
+            camadas=consulta["camadas"]
+        )
+
+        concluida = True
+        await sessao.emitir(completed_msg.model_dump())
+        logger.info(f"Consulta CAR concluída com sucesso: {numero_car}")
+
+    except ConsultaInterrompida as e:
+        # Status da consulta já foi marcado como 'erro' pelo executor; o evento final
+        # encerra a entrega do webhook e avisa o cliente que retomar a sessão
+        logger.warning(f"Consulta {numero_car} interrompida: {e}")
+        error_msg = ErrorMessage(
+            message=f"Consulta interrompida: {e}",
+            details=f"CAR: {numero_car} | Cliente: {sessao.cliente_id}"
+        )
+        await sessao.emitir(error_msg.model_dump())
+
+    except asyncio.CancelledError:
+        logger.info(f"Consulta {numero_car} cancelada pelo cliente")
+        await sessao.emitir(CancelledMessage(numero_car=numero_car).model_dump())
+
+    except Exception as e:
+        logger.error(f"Erro no processamento do CAR {numero_car}: {e}")
+
+        # Enviar erro para cliente com mensagem clara
+        erro_msg = str(e).lower()
+
+        # Mensagem amigável para o usuário
+        if "captcha" in erro_msg or "shapefile" in erro_msg:
+            mensagem_usuario = "❌ Falha no download do shapefile. Isso geralmente acontece quando o CAPTCHA foi digitado incorretamente. Por favor, tente novamente prestando atenção ao CAPTCHA."
+        else:
+            mensagem_usuario = str(e)
+
+        error_msg = ErrorMessage(
+            message=mensagem_usuario,
+            details=f"CAR: {numero_car} | Cliente: {sessao.cliente_id}"
+        )
+        await sessao.emitir(error_msg.model_dump())
+
+    finally:
+        # Só consultas concluídas contam para a cota diária
+        if dia_cota is not None and not concluida:
+            await cota_diaria.devolver(sessao.cliente_id, dia_cota)
+        sessao.finalizar()
+
+
+async def _iniciar_sessao(numero_car: str, cliente_id: str, config: dict) -> SessaoConsulta:
+    """
+    Valida a configuração, aplica a cota e inicia a consulta numa nova sessão
+
+    A mensagem "session" fica no buffer e chega ao cliente quando a conexão
+    for anexada.
+
+    Raises:
+        ValueError: Configuração inválida
+        CotaExcedida: Cliente atingiu o limite diário
+    """
+    modo = config.get("modo", "completo")
+    if modo not in MODOS_CONSULTA:
+        raise ValueError(f"modo inválido: {modo}")
+
+    prioridade = config.get("prioridade", PRIORIDADE_INTERATIVA)
+    if prioridade not in PRIORIDADES:
+        raise ValueError(f"prioridade inválida: {prioridade}")
+
+    # Cota diária: rejeitar antes de qualquer trabalho de navegador
+    dia_cota = None
+    if settings.enable_rate_limit:
+        dia_cota = cota_diaria.dia
+        restantes = await cota_diaria.reservar(cliente_id)
+        logger.info(f"[WS] Cota diária do cliente {cliente_id}: {restantes} consultas restantes")
+
+    sessao = gerenciador_sessoes.criar(numero_car, cliente_id)
+    session_msg = SessionMessage(
+        session_id=sessao.id,
+        resume_token=sessao.token,
+        carencia_segundos=settings.sessao_carencia_segundos
+    )
+    await sessao.emitir(session_msg.model_dump())
+
+    # A consulta roda independente desta conexão
+    sessao.tarefa = asyncio.create_task(_executar_sessao(sessao, modo, prioridade, dia_cota))
+    return sessao
+
+
+def _responder_captcha(sessao: SessaoConsulta, resposta: dict):
+    """Repassa a resposta do cliente à fila (respostas atrasadas são ignoradas pela fila)"""
+    captcha_text = resposta.get("captcha_text")
+    captcha_id = resposta.get("captcha_id") or sessao.captcha_pendente_id
+    if captcha_text and captcha_id:
+        fila_captcha.responder(captcha_id, f"cliente:{sessao.cliente_id}", captcha_text)
+
+
+async def _receber_mensagem(websocket: WebSocket, codec: CodecMensagens) -> dict:
+    """Próxima mensagem do cliente: texto JSON ou frame binário no codec negociado"""
+    mensagem = await websocket.receive()
+    if mensagem["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(mensagem.get("code", 1000))
+    if mensagem.get("bytes") is not None:
+        return codec.decodificar(mensagem["bytes"])
+    return codec.decodificar(mensagem["text"])
+
+
+async def _atender_conexao(websocket: WebSocket, sessao: SessaoConsulta, conexao: ConexaoWebSocket):
+    """Repassa respostas de CAPTCHA do cliente até a consulta terminar"""
+
+    async def receber_respostas():
+        while True:
+            _responder_captcha(sessao, await _receber_mensagem(websocket, conexao.codec))
+
+    recebendo = asyncio.create_task(receber_respostas())
+    concluida = asyncio.create_task(sessao.concluida.wait())
+    try:
+        await asyncio.wait({recebendo, concluida}, return_when=asyncio.FIRST_COMPLETED)
+        if recebendo.done():
+            recebendo.result()  # Propaga WebSocketDisconnect
+
+        # Entregar o que restou na fila de saída antes de fechar o socket
+        await conexao.esvaziar()
+    finally:
+        recebendo.cancel()
+        concluida.cancel()
+
+
 @app.websocket("/ws/car/{numero_car}")
 async def websocket_car_download(websocket: WebSocket, numero_car: str):
     """
     WebSocket endpoint para download de CAR com resolução de CAPTCHA remota
 
     Fluxo:
-    1. Cliente conecta e envia { "cliente_id": "..." }
-    2. Backend inicia processamento
-    3. Quando CAPTCHA aparecer, envia { "type": "captcha_required", "image": "base64..." }
-    4. Cliente responde { "captcha_text": "ABC123" }
+    1. Cliente conecta e envia { "cliente_id": "...", "modo": "completo" | "refresh",
+       "prioridade": "interativa" | "bulk" }
+    2. Backend responde { "type": "session", "session_id": "...", "resume_token": "..." }
+       e inicia processamento
+    3. Quando CAPTCHA aparecer, envia { "type": "captcha_required", "captcha_id": "...", "image": "base64..." }
+    4. Cliente responde { "captcha_id": "...", "captcha_text": "ABC123" }
     5. Backend continua e envia { "type": "completed", ... }
+
+    Toda mensagem do servidor leva "seq". Se a conexão cair, a consulta
+    continua; dentro da carência o cliente reconecta enviando
+    { "resume_token": "...", "ultimo_seq": N } e recebe as mensagens
+    posteriores a N e o CAPTCHA pendente.
+
+    No modo "refresh" o backend para após popup/demonstrativo se o cadastro
+    não mudou desde a última consulta concluída, reaproveitando shapefile e
+    GeoJSON sem pedir CAPTCHA.
     """
     # NORMALIZAR número CAR (remover pontos)
     numero_car_original = numero_car
@@ -119,8 +851,8 @@ async def websocket_car_download(websocket: WebSocket, numero_car: str):
     logger.info(f"[WS] WebSocket aceita para CAR: {numero_car}")
 
     cliente_id = None
-    consulta_id = None
-    temp_dir = None
+    sessao = None
+    conexao = None
 
     try:
         # Receber configuração inicial
@@ -129,249 +861,254 @@ async def websocket_car_download(websocket: WebSocket, numero_car: str):
         config = await websocket.receive_json()
         print(f"=== [WS] Configuracao recebida: {config} ===")
         logger.info(f"[WS] Configuracao recebida: {config}")
-        cliente_id = config.get("cliente_id")
 
-        if not cliente_id:
-            logger.error(f"[WS] cliente_id nao fornecido!")
-            raise ValueError("cliente_id não fornecido")
-
-        logger.info(f"[WS] Cliente ID: {cliente_id}")
-
-        # Criar registro no Supabase
-        consulta = supabase_client.table("duploa_consultas_car").insert({
-            "cliente_id": cliente_id,
-            "numero_car": numero_car,
-            "status": "processando",
-            "consulta_iniciada_em": datetime.utcnow().isoformat()
-        }).execute()
+        # Cliente pode pedir o CAPTCHA como frame binário em vez de base64 no JSON
+        # e escolher o codec das mensagens seguintes (json/msgpack, compressão)
+        conexao = ConexaoWebSocket(
+            websocket,
+            captcha_binario=bool(config.get("captcha_binario", False)),
+            max_fila=settings.ws_max_fila_saida,
+            lotes=bool(config.get("lotes", False)),
+            codec=CodecMensagens.negociar(config)
+        )
 
-        consulta_id = consulta.data[0]["id"]
-        logger.info(f"Consulta criada: {consulta_id}")
+        if config.get("resume_token"):
+            # Retomada: reanexar à sessão em andamento
+            sessao = gerenciador_sessoes.obter(config["resume_token"], config.get("cliente_id"))
+            if sessao is None or sessao.numero_car != numero_car:
+                raise ValueError("Sessão expirada ou inexistente. Inicie uma nova consulta.")
 
-        # Criar diretório temporário
-        temp_dir = tempfile.mkdtemp(prefix=f"car_{consulta_id}_")
-        logger.info(f"Diretório temporário: {temp_dir}")
+            cliente_id = sessao.cliente_id
+            logger.info(f"[WS] Retomando sessão {sessao.id} do cliente {cliente_id}")
+            await sessao.anexar(conexao, ultimo_seq=int(config.get("ultimo_seq", 0)))
 
-        # Callback para resolver CAPTCHA remotamente
-        async def resolver_captcha_remoto(image_bytes: bytes) -> str:
-            """Envia CAPTCHA para frontend e aguarda resposta"""
-            logger.info(f"CAPTCHA detectado, enviando para cliente {cliente_id}...")
+        else:
+            cliente_id = config.get("cliente_id")
 
-            # Converter para base64
-            img_base64 = base64.b64encode(image_bytes).decode('utf-8')
+            if not cliente_id:
+                logger.error(f"[WS] cliente_id nao fornecido!")
+                raise ValueError("cliente_id não fornecido")
 
-            # Enviar para frontend
-            captcha_msg = CaptchaMessage(image=img_base64)
-            await websocket.send_json(captcha_msg.model_dump())
+            logger.info(f"[WS] Cliente ID: {cliente_id}")
+            sessao = await _iniciar_sessao(numero_car, cliente_id, config)
+            await sessao.anexar(conexao)
 
-            # Aguardar resposta (timeout de 5 minutos)
-            try:
-                response = await asyncio.wait_for(
-                    websocket.receive_json(),
-                    timeout=300
-                )
-                captcha_text = response.get("captcha_text")
+        await _atender_conexao(websocket, sessao, conexao)
 
-                if not captcha_text:
-                    raise ValueError("CAPTCHA text não fornecido")
+    except WebSocketDisconnect:
+        logger.warning(f"WebSocket desconectado: {numero_car}")
 
-                logger.info(f"CAPTCHA recebido do cliente {cliente_id}: {captcha_text}")
-                return captcha_text
+    except Exception as e:
+        logger.error(f"Erro no processamento do CAR {numero_car}: {e}")
 
-            except asyncio.TimeoutError:
-                raise TimeoutError("Timeout aguardando solução do CAPTCHA")
+        # Erros de configuração/retomada (a consulta em si reporta pelos eventos da sessão)
+        try:
+            error_msg = ErrorMessage(
+                message=str(e),
+                details=f"CAR: {numero_car} | Cliente: {cliente_id}"
+            )
+            await websocket.send_json(error_msg.model_dump())
+        except:
+            pass  # WebSocket pode já estar fechado
 
-        # Callback para enviar progresso
-        async def enviar_progresso(etapa: str, mensagem: str):
-            """Envia atualização de progresso para o cliente"""
-            logger.info(f"Progresso - {etapa}: {mensagem}")
-            progress_msg = ProgressMessage(etapa=etapa, mensagem=mensagem)
-            await websocket.send_json(progress_msg.model_dump())
+    finally:
+        if sessao is not None and conexao is not None:
+            sessao.desanexar(conexao)
 
-        # Callback para salvar dados assim que demonstrativo for extraído
-        async def salvar_dados_demonstrativo(dados: dict):
-            """Salva dados do popup + demonstrativo ANTES de tentar o shapefile"""
-            logger.info("📊 SALVANDO dados do demonstrativo no Supabase (ANTES do shapefile)...")
+        # Fechar WebSocket
+        try:
+            await websocket.close()
+        except:
+            pass
 
-            try:
-                supabase_client.table("duploa_consultas_car").update({
-                    "status_cadastro": dados["info_popup"].get("Status do Cadastro"),
-                    "tipo_imovel": dados["info_popup"].get("Tipo de imóvel"),
-                    "municipio": dados["info_popup"].get("Município"),
-                    "area_total": dados["info_popup"].get("Área"),
-                    "dados_demonstrativo": dados.get("dados_demonstrativo"),
-                    # Status ainda é 'processando' pois falta o shapefile
-                }).eq("id", consulta_id).execute()
-
-                logger.info("✅ Dados do demonstrativo salvos com sucesso!")
-                await enviar_progresso("dados_salvos", "Dados do demonstrativo salvos no banco")
-
-            except Exception as e:
-                logger.error(f"Erro ao salvar dados do demonstrativo: {e}")
-                # Não falhar a consulta por erro ao salvar
-
-        # Executar download
-        logger.info("Iniciando download CAR...")
-        resultados = await download_car_websocket(
-            numero_car=numero_car,
-            pasta_destino=temp_dir,
-            resolver_captcha=resolver_captcha_remoto,
-            enviar_progresso=enviar_progresso,
-            callback_dados_extraidos=salvar_dados_demonstrativo,
-            headless=settings.headless,
-            slow_mo=settings.slow_mo
-        )
 
-        logger.info("Download concluído, processando resultados...")
+@app.websocket("/ws/consultas")
+async def websocket_consultas_multiplexadas(websocket: WebSocket):
+    """
+    WebSocket multiplexado: várias consultas CAR numa única conexão
 
-        # VALIDAÇÃO CRÍTICA: Shapefile é OBRIGATÓRIO!
-        if not resultados.get("arquivo_shapefile"):
-            logger.error("❌ ERRO CRÍTICO: Shapefile não foi baixado!")
-            logger.error(f"❌ Cliente: {cliente_id} | CAR: {numero_car}")
-            raise Exception("Shapefile é obrigatório mas não foi baixado. Verifique se o CAPTCHA foi digitado corretamente.")
+    Fluxo:
+    1. Cliente conecta e envia { "cliente_id": "...", "captcha_binario": false }
+    2. Comandos (todas as respostas do servidor levam "job_id"):
+       { "acao": "iniciar", "numero_car": "...", "modo": "completo", "prioridade": "interativa", "ref": "x" }
+         -> { "type": "iniciado", "job_id": "...", "ref": "x" }, { "type": "session", "job_id": "...",
+            "resume_token": "..." } e os eventos da consulta
+       { "acao": "acompanhar", "resume_token": "...", "ultimo_seq": 0 }
+         -> reenvia eventos e CAPTCHA pendente de uma consulta já iniciada
+       { "acao": "resolver", "job_id": "...", "captcha_id": "...", "captcha_text": "ABC123" }
+       { "acao": "cancelar", "job_id": "..." }
+    3. Erros de comando: { "type": "error", "job_id": ..., "ref": ..., "message": "..." }
+
+    A conexão fica aberta enquanto o cliente quiser; se cair, cada consulta
+    segue as regras de carência/retomada das sessões.
+    """
+    await websocket.accept()
 
-        # Upload do shapefile para Supabase Storage
-        shapefile_url = None
-        shapefile_size = None
+    trava = asyncio.Lock()
+    canais: dict = {}  # job_id -> (sessao, conexao)
+    liberacoes: set = set()
+    codec = CodecMensagens()
 
-        logger.info("Fazendo upload do shapefile para Supabase Storage...")
+    async def liberar_ao_concluir(sessao: SessaoConsulta, conexao: ConexaoWebSocket):
+        """Consulta terminou: entrega os últimos eventos e solta o canal"""
+        await sessao.concluida.wait()
+        await conexao.esvaziar()
+        sessao.desanexar(conexao)
+        if canais.get(sessao.id, (None, None))[1] is conexao:
+            del canais[sessao.id]
 
-        try:
-            with open(resultados["arquivo_shapefile"], "rb") as f:
-                shapefile_bytes = f.read()
-
-            # Path no storage: {cliente_id}/{numero_car}/shapefile.zip
-            storage_path = f"{cliente_id}/{numero_car}/shapefile.zip"
-
-            # Upload para storage
-            storage = supabase_client.storage.from_("car-shapefiles")
-            storage.upload(
-                storage_path,
-                shapefile_bytes,
-                {"content-type": "application/zip", "upsert": "true"}
-            )
+    def acompanhar_conclusao(sessao: SessaoConsulta, conexao: ConexaoWebSocket):
+        tarefa = asyncio.create_task(liberar_ao_concluir(sessao, conexao))
+        liberacoes.add(tarefa)
+        tarefa.add_done_callback(liberacoes.discard)
 
-            # Obter URL pública
-            shapefile_url = storage.get_public_url(storage_path)
-            shapefile_size = len(shapefile_bytes)
+    async def enviar(mensagem: dict):
+        async with trava:
+            await codec.enviar(websocket, mensagem)
 
-            logger.info(f"Shapefile uploaded: {shapefile_url}")
+    async def enviar_erro(mensagem: str, job_id: Optional[str] = None, ref=None):
+        await enviar({**ErrorMessage(message=mensagem).model_dump(), "job_id": job_id, "ref": ref})
 
-        except Exception as e:
-            logger.error(f"Erro ao fazer upload do shapefile: {e}")
-            raise Exception(f"Erro crítico ao fazer upload do shapefile: {e}")
+    try:
+        config = await websocket.receive_json()
+        cliente_id = config.get("cliente_id")
+        if not cliente_id:
+            await enviar_erro("cliente_id não fornecido")
+            return
+        try:
+            codec = CodecMensagens.negociar(config)
+        except ValueError as e:
+            await enviar_erro(str(e))
+            return
 
-        # VALIDAÇÃO: GeoJSON layers também são obrigatórios
-        if not resultados.get("geojson_layers") or len(resultados.get("geojson_layers", {})) == 0:
-            logger.error("❌ ERRO CRÍTICO: GeoJSON layers não foram extraídos do shapefile!")
-            logger.error(f"❌ Cliente: {cliente_id} | CAR: {numero_car}")
-            raise Exception("GeoJSON layers são obrigatórios mas não foram extraídos do shapefile")
+        captcha_binario = bool(config.get("captcha_binario", False))
+        lotes = bool(config.get("lotes", False))
+        logger.info(f"[MUX] Conexão multiplexada do cliente {cliente_id}")
 
-        # Atualizar registro no Supabase (dados já foram salvos, só atualizar shapefile, geojson e status)
-        logger.info("Atualizando registro no Supabase com shapefile e GeoJSON layers...")
-        supabase_client.table("duploa_consultas_car").update({
-            "status": "concluido",
-            "shapefile_url": shapefile_url,
-            "shapefile_size": shapefile_size,
-            "geojson_layers": resultados.get("geojson_layers", {}),
-            "consulta_concluida_em": datetime.utcnow().isoformat()
-        }).eq("id", consulta_id).execute()
+        while True:
+            comando = await _receber_mensagem(websocket, codec)
+            acao = comando.get("acao")
+            job_id = comando.get("job_id")
+            ref = comando.get("ref")
 
-        logger.info("Registro atualizado com sucesso")
+            try:
+                if acao == "iniciar":
+                    ativos = sum(1 for sessao, _ in canais.values() if not sessao.concluida.is_set())
+                    if ativos >= settings.max_consultas_por_conexao:
+                        raise ValueError(f"Limite de {settings.max_consultas_por_conexao} consultas simultâneas por conexão")
+
+                    numero_car = normalizar_numero_car(comando.get("numero_car") or "")
+                    if not numero_car:
+                        raise ValueError("numero_car não fornecido")
+
+                    sessao = await _iniciar_sessao(numero_car, cliente_id, comando)
+                    conexao = ConexaoWebSocket(
+                        websocket, captcha_binario, job_id=sessao.id, trava=trava,
+                        max_fila=settings.ws_max_fila_saida, lotes=lotes, codec=codec
+                    )
+                    canais[sessao.id] = (sessao, conexao)
+                    if ref is not None:
+                        # Permite ao cliente associar o job_id ao comando antes dos eventos
+                        await enviar({"type": "iniciado", "job_id": sessao.id, "ref": ref, "numero_car": numero_car})
+                    await sessao.anexar(conexao)
+                    acompanhar_conclusao(sessao, conexao)
+
+                elif acao == "acompanhar":
+                    sessao = gerenciador_sessoes.obter(comando.get("resume_token"), cliente_id)
+                    if sessao is None:
+                        raise ValueError("Sessão expirada ou inexistente")
+                    conexao = ConexaoWebSocket(
+                        websocket, captcha_binario, job_id=sessao.id, trava=trava,
+                        max_fila=settings.ws_max_fila_saida, lotes=lotes, codec=codec
+                    )
+                    canais[sessao.id] = (sessao, conexao)
+                    await sessao.anexar(conexao, ultimo_seq=int(comando.get("ultimo_seq", 0)))
+                    acompanhar_conclusao(sessao, conexao)
+
+                elif acao in ("resolver", "cancelar"):
+                    sessao = gerenciador_sessoes.obter_por_id(job_id, cliente_id)
+                    if sessao is None:
+                        raise ValueError(f"job_id desconhecido: {job_id}")
+                    if acao == "resolver":
+                        _responder_captcha(sessao, comando)
+                    elif not sessao.cancelar():
+                        raise ValueError("Consulta já finalizada")
 
-        # Enviar resultado final
-        completed_msg = CompletedMessage(
-            consulta_id=consulta_id,
-            numero_car=numero_car,
-            shapefile_url=shapefile_url,
-            dados_extraidos=resultados
-        )
+                else:
+                    raise ValueError(f"acao inválida: {acao}")
 
-        await websocket.send_json(completed_msg.model_dump())
-        logger.info(f"Consulta CAR concluída com sucesso: {numero_car}")
+            except (ValueError, CotaExcedida) as e:
+                await enviar_erro(str(e), job_id, ref)
 
     except WebSocketDisconnect:
-        logger.warning(f"WebSocket desconectado: {numero_car}")
+        logger.info(f"[MUX] Conexão multiplexada encerrada ({len(canais)} consultas)")
 
-        # Atualizar status no Supabase
-        if consulta_id:
-            supabase_client.table("duploa_consultas_car").update({
-                "status": "erro",
-                "erro_mensagem": "Conexão WebSocket interrompida"
-            }).eq("id", consulta_id).execute()
+    finally:
+        for tarefa in list(liberacoes):
+            tarefa.cancel()
+        for sessao, conexao in canais.values():
+            sessao.desanexar(conexao)
 
-    except Exception as e:
-        logger.error(f"Erro no processamento do CAR {numero_car}: {e}", exc_info=True)
-        logger.error(f"🔍 INFORMAÇÕES DO ERRO - Cliente ID: {cliente_id}, CAR: {numero_car}, Consulta ID: {consulta_id}")
+        try:
+            await websocket.close()
+        except:
+            pass
 
-        # SEMPRE marcar como ERRO se não tiver shapefile
-        # Shapefile é OBRIGATÓRIO para o mapa funcionar!
-        erro_msg = str(e).lower()
 
-        if consulta_id:
-            # Mensagem de erro apropriada
-            mensagem_erro = str(e)
+@app.websocket("/ws/operador")
+async def websocket_operador_captcha(websocket: WebSocket, token: str):
+    """
+    WebSocket para operadores resolverem CAPTCHAs de qualquer consulta
 
-            # Se for erro de CAPTCHA/shapefile, mensagem específica
-            if "captcha" in erro_msg or "shapefile" in erro_msg:
-                logger.error(f"⚠️ FALHA CRÍTICA SHAPEFILE - Cliente: {cliente_id} | CAR: {numero_car}")
-                logger.error(f"   Erro: {str(e)}")
+    Fluxo:
+    1. Operador conecta em /ws/operador?token=...
+    2. Operador envia { "acao": "puxar", "limite": 5 }
+    3. Backend responde { "type": "captcha_lote", "itens": [{ "captcha_id", "image", ... }] }
+       (lote vazio após ~25s sem CAPTCHAs pendentes)
+    4. Operador envia { "respostas": [{ "captcha_id": "...", "captcha_text": "ABC123" }] }
+       e puxa o próximo lote
+    """
+    operador_id = tokens_operadores.get(token)
+    if not operador_id:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
 
-                # Verificar se foi erro de CAPTCHA
-                if "captcha" in erro_msg:
-                    mensagem_erro = "❌ ERRO: CAPTCHA incorreto ou shapefile não foi baixado. Por favor, tente novamente e digite o CAPTCHA com atenção."
-                else:
-                    mensagem_erro = f"❌ ERRO: Shapefile obrigatório não foi baixado. {str(e)}"
+    await websocket.accept()
+    fila_captcha.conectar_operador(operador_id)
+    logger.info(f"[OPERADOR] {operador_id} conectado")
 
-            # SEMPRE marca como ERRO (nunca "concluido_sem_shapefile")
-            supabase_client.table("duploa_consultas_car").update({
-                "status": "erro",
-                "erro_mensagem": mensagem_erro,
-                "consulta_concluida_em": datetime.utcnow().isoformat()
-            }).eq("id", consulta_id).execute()
+    try:
+        while True:
+            mensagem = await websocket.receive_json()
 
-        # Enviar erro para cliente com mensagem clara
-        try:
-            # Mensagem amigável para o usuário
-            if "captcha" in erro_msg or "shapefile" in erro_msg:
-                mensagem_usuario = "❌ Falha no download do shapefile. Isso geralmente acontece quando o CAPTCHA foi digitado incorretamente. Por favor, tente novamente prestando atenção ao CAPTCHA."
-            else:
-                mensagem_usuario = str(e)
+            respostas = mensagem.get("respostas") or []
+            for resposta in respostas:
+                aceita = fila_captcha.responder(
+                    resposta.get("captcha_id"), operador_id, resposta.get("captcha_text")
+                )
+                if not aceita:
+                    logger.info(f"[OPERADOR] Resposta de {operador_id} descartada (CAPTCHA já resolvido ou expirado)")
+
+            if mensagem.get("acao") == "puxar":
+                limite = min(int(mensagem.get("limite", settings.captcha_lote_maximo)), settings.captcha_lote_maximo)
+                itens = await fila_captcha.puxar(operador_id, limite=limite)
+
+                lote = CaptchaLoteMessage(itens=[
+                    CaptchaLoteItem(
+                        captcha_id=item.id,
+                        image=base64.b64encode(item.imagem).decode('utf-8'),
+                        numero_car=item.numero_car,
+                        expira_em_segundos=max(0, int(item.expira_em - time.monotonic()))
+                    )
+                    for item in itens
+                ])
+                await websocket.send_json(lote.model_dump())
 
-            error_msg = ErrorMessage(
-                message=mensagem_usuario,
-                details=f"CAR: {numero_car} | Cliente: {cliente_id}"
-            )
-            await websocket.send_json(error_msg.model_dump())
-        except:
-            pass  # WebSocket pode já estar fechado
+    except WebSocketDisconnect:
+        logger.info(f"[OPERADOR] {operador_id} desconectado")
 
     finally:
-        # Copiar screenshot de debug antes de remover diretório
-        if temp_dir and os.path.exists(temp_dir):
-            try:
-                debug_screenshot = os.path.join(temp_dir, "debug_before_shapefile.png")
-                if os.path.exists(debug_screenshot):
-                    # Copiar para diretório atual
-                    debug_dest = f"debug_{consulta_id}.png"
-                    shutil.copy2(debug_screenshot, debug_dest)
-                    logger.info(f"Screenshot de debug copiado para: {debug_dest}")
-            except Exception as e:
-                logger.warning(f"Erro ao copiar screenshot de debug: {e}")
-
-        # Limpar diretório temporário
-        if temp_dir and os.path.exists(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-                logger.info(f"Diretório temporário removido: {temp_dir}")
-            except Exception as e:
-                logger.error(f"Erro ao remover diretório temporário: {e}")
-
-        # Fechar WebSocket
-        try:
-            await websocket.close()
-        except:
-            pass
+        fila_captcha.desconectar_operador(operador_id)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,8 @@
 """
 Modelos Pydantic para validação de dados
 """
-from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, Field, HttpUrl
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 
@@ -12,6 +12,29 @@ class CarDownloadRequest(BaseModel):
     cliente_id: str = Field(..., description="ID do cliente no Supabase")
 
 
+class WatchlistItemRequest(BaseModel):
+    """Request para adicionar um CAR à watchlist"""
+    numero_car: str = Field(..., description="Número do CAR", min_length=10)
+    cliente_id: str = Field(..., description="ID do cliente no Supabase")
+    intervalo_horas: int = Field(168, description="Intervalo mínimo entre re-verificações", ge=1)
+
+
+class IntersecaoRequest(BaseModel):
+    """Imóveis que intersectam uma geometria (PostGIS)"""
+    geometria: Dict[str, Any] = Field(..., description="Geometria GeoJSON (EPSG:4326) ou Feature")
+    camada: Optional[str] = Field(None, description="Restringe a uma camada (ex.: area_do_imovel)")
+    limite: int = Field(100, ge=1, le=1000)
+
+
+class ConsultaWebhookRequest(BaseModel):
+    """Consulta em segundo plano com resultado entregue por webhook"""
+    numero_car: str = Field(..., description="Número do CAR")
+    cliente_id: str = Field(..., description="ID do cliente no Supabase")
+    callback_url: HttpUrl = Field(..., description="URL pública que recebe os webhooks (http/https)")
+    modo: str = "completo"
+    prioridade: str = "bulk"
+
+
 class CaptchaSolution(BaseModel):
     """Solução do CAPTCHA enviada pelo frontend"""
     captcha_text: str = Field(..., min_length=1, max_length=20)
@@ -30,19 +53,92 @@ class ProgressMessage(WebSocketMessage):
     mensagem: str
 
 
+class QueuedMessage(WebSocketMessage):
+    """Mensagem de consulta aguardando slot de navegador"""
+    type: str = "queued"
+    posicao: int
+    espera_estimada_segundos: int
+    inicio_estimado: datetime
+
+
+class SessionMessage(WebSocketMessage):
+    """Primeira mensagem da consulta: identificação e token de retomada"""
+    type: str = "session"
+    session_id: str
+    resume_token: str
+    carencia_segundos: int
+
+
 class CaptchaMessage(WebSocketMessage):
-    """Mensagem de CAPTCHA necessário"""
+    """
+    Mensagem de CAPTCHA necessário
+
+    A imagem vai em `image` (base64) ou, com captcha_binario, num frame binário
+    cujo cabeçalho JSON é esta mensagem acrescida de "mime" e "tamanho".
+    """
     type: str = "captcha_required"
+    image: Optional[str] = None  # Base64
+    captcha_id: Optional[str] = None  # Ecoar na resposta para ignorar respostas atrasadas
+
+
+class CaptchaLoteItem(BaseModel):
+    """CAPTCHA entregue a um operador"""
+    captcha_id: str
     image: str  # Base64
+    numero_car: str
+    expira_em_segundos: int
+
+
+class CaptchaLoteMessage(WebSocketMessage):
+    """Lote de CAPTCHAs para a tela de operador"""
+    type: str = "captcha_lote"
+    itens: List[CaptchaLoteItem]
+
+
+class PartialResultMessage(WebSocketMessage):
+    """
+    Resultado parcial, enviado assim que fica pronto
+
+    `parte` é "info_popup" (etapa 2), "dados_demonstrativo" (etapa 3) ou
+    "camada" (resumo de cada camada, com o nome em `camada`: feições e bbox
+    ao terminar a conversão, depois URL e ETag ao ser armazenada; o GeoJSON
+    é lido pela URL).
+    """
+    type: str = "partial_result"
+    parte: str
+    camada: Optional[str] = None
+    data: Dict[str, Any]
+
+
+class CamadaResumo(BaseModel):
+    """Camada GeoJSON referenciada na conclusão (conteúdo buscado via HTTP)"""
+    url: str
+    etag: str
+    feicoes: int
+    bytes: int
+    bbox: Optional[List[float]] = None
 
 
 class CompletedMessage(WebSocketMessage):
-    """Mensagem de conclusão"""
+    """
+    Mensagem de conclusão
+
+    Leva apenas identificadores, estatísticas e o manifesto das camadas; o
+    GeoJSON de cada camada é buscado em `camadas[nome].url`.
+    """
     type: str = "completed"
     consulta_id: str
     numero_car: str
     shapefile_url: Optional[str] = None
-    dados_extraidos: Dict[str, Any]
+    shapefile_reaproveitado: bool = False  # Modo refresh sem alteração no cadastro
+    resumo: Dict[str, Any]
+    camadas: Dict[str, CamadaResumo]
+
+
+class CancelledMessage(WebSocketMessage):
+    """Consulta cancelada pelo cliente"""
+    type: str = "cancelled"
+    numero_car: str
 
 
 class ErrorMessage(WebSocketMessage):
@@ -65,6 +161,7 @@ class ConsultaCAR(BaseModel):
     dados_demonstrativo: Optional[Dict[str, Any]] = None
     shapefile_url: Optional[str] = None
     shapefile_size: Optional[int] = None
+    shapefile_reaproveitado: bool = False
     erro_mensagem: Optional[str] = None
     consulta_iniciada_em: Optional[datetime] = None
     consulta_concluida_em: Optional[datetime] = None
@@ -0,0 +1,177 @@
+"""
+Normalização dos dados do popup e do demonstrativo em colunas tipadas
+O portal entrega números no formato brasileiro com unidade ("15.647,5361 ha"),
+datas como "dd/mm/aaaa" e coordenadas em graus/minutos/segundos. Aqui eles
+viram numéricos (hectares), datas ISO e graus decimais gravados em colunas
+próprias e indexadas de duploa_consultas_car: filtros por faixa e somas não
+precisam converter texto do JSONB linha a linha. O JSON original é mantido.
+Ver migrations/add_colunas_tipadas.sql
+"""
+import re
+from datetime import date
+from typing import Any, Callable, Dict, Optional, Tuple
+
+_NUMERO = re.compile(r"[-−]?\s*\d[\d.]*(?:,\d+)?")
+_MILHARES = re.compile(r"^\d{1,3}(?:\.\d{3})+$")
+_DATA = re.compile(r"(\d{1,2})/(\d{1,2})/(\d{4})")
+_GMS = re.compile(r"(\d+(?:[.,]\d+)?)\s*°\s*(?:(\d+(?:[.,]\d+)?)\s*['′])?\s*(?:(\d+(?:[.,]\d+)?)\s*(?:\"|''|″))?\s*([NSLOEW])?", re.I)
+
+# Fator para hectares por unidade (sem unidade: hectares, padrão do demonstrativo)
+UNIDADES_AREA = {"ha": 1.0, "m²": 0.0001, "m2": 0.0001, "km²": 100.0, "km2": 100.0}
+
+
+def converter_numero_br(texto: Any) -> Optional[float]:
+    """
+    Primeiro número de um texto em formato brasileiro
+
+    "15.647,5361 ha" -> 15647.5361, "-1.234,5" -> -1234.5, "14,4012" -> 14.4012.
+    Só pontos: separador de milhar se os grupos têm 3 dígitos ("15.647" ->
+    15647), senão decimal ("8.5" -> 8.5). Sem número: None
+    """
+    if isinstance(texto, (int, float)) and not isinstance(texto, bool):
+        return float(texto)
+    if not isinstance(texto, str):
+        return None
+    encontrado = _NUMERO.search(texto)
+    if not encontrado:
+        return None
+
+    bruto = encontrado.group(0).replace(" ", "").replace("−", "-")
+    negativo = bruto.startswith("-")
+    bruto = bruto.lstrip("-").rstrip(".")
+    if "," in bruto:
+        bruto = bruto.replace(".", "").replace(",", ".")
+    elif _MILHARES.match(bruto):
+        bruto = bruto.replace(".", "")
+    try:
+        valor = float(bruto)
+    except ValueError:
+        return None
+    return -valor if negativo else valor
+
+
+def converter_area_ha(texto: Any) -> Optional[float]:
+    """Área em hectares, convertendo m² e km² pela unidade informada"""
+    valor = converter_numero_br(texto)
+    if valor is None:
+        return None
+    unidade = texto.strip().rsplit(None, 1)[-1].lower() if isinstance(texto, str) and " " in texto.strip() else "ha"
+    return round(valor * UNIDADES_AREA.get(unidade, 1.0), 4)
+
+
+def converter_data_br(texto: Any) -> Optional[str]:
+    """"dd/mm/aaaa" (com ou sem horário) -> "aaaa-mm-dd"; None se ausente ou inválida"""
+    if not isinstance(texto, str):
+        return None
+    encontrado = _DATA.search(texto)
+    if not encontrado:
+        return None
+    dia, mes, ano = (int(parte) for parte in encontrado.groups())
+    try:
+        return date(ano, mes, dia).isoformat()
+    except ValueError:
+        return None
+
+
+def converter_coordenada(texto: Any) -> Optional[float]:
+    """
+    Graus decimais de "-8.4512", "-8,4512" ou "08°27'04,32\" S"
+    (S e O/W negativos)
+    """
+    if not isinstance(texto, str):
+        return converter_numero_br(texto)
+    gms = _GMS.search(texto)
+    if not gms:
+        valor = converter_numero_br(texto.replace(".", ",", 1) if texto.count(".") == 1 else texto)
+        return round(valor, 7) if valor is not None else None
+
+    graus, minutos, segundos, hemisferio = gms.groups()
+    valor = sum(
+        float(parte.replace(",", ".")) / divisor
+        for parte, divisor in ((graus, 1), (minutos, 60), (segundos, 3600))
+        if parte
+    )
+    negativo = texto.strip().startswith(("-", "−")) or (hemisferio or "").upper() in ("S", "O", "W")
+    return round(-valor if negativo else valor, 7)
+
+
+def extrair_uf(municipio_uf: Any) -> Optional[str]:
+    """"Canto do Buriti / PI" -> "PI" """
+    if not isinstance(municipio_uf, str) or "/" not in municipio_uf:
+        return None
+    uf = municipio_uf.rsplit("/", 1)[1].strip().upper()
+    return uf if re.fullmatch(r"[A-Z]{2}", uf) else None
+
+
+# Coluna tipada -> (caminho no dados_demonstrativo, conversor)
+COLUNAS_DEMONSTRATIVO: Dict[str, Tuple[Tuple[str, ...], Callable[[Any], Any]]] = {
+    "area_imovel_ha": (("dados_imovel_rural", "area_imovel_rural"), converter_area_ha),
+    "modulos_fiscais": (("dados_imovel_rural", "modulos_fiscais"), converter_numero_br),
+    "uf": (("dados_imovel_rural", "municipio_uf"), extrair_uf),
+    "latitude": (("dados_imovel_rural", "coordenadas_geograficas", "latitude"), converter_coordenada),
+    "longitude": (("dados_imovel_rural", "coordenadas_geograficas", "longitude"), converter_coordenada),
+    "data_inscricao": (("dados_imovel_rural", "data_inscricao"), converter_data_br),
+    "data_ultima_retificacao": (("dados_imovel_rural", "data_ultima_retificacao"), converter_data_br),
+    "area_vegetacao_nativa_ha": (("cobertura_solo", "area_remanescente_vegetacao_nativa"), converter_area_ha),
+    "area_rural_consolidada_ha": (("cobertura_solo", "area_rural_consolidada"), converter_area_ha),
+    "area_servidao_administrativa_ha": (("cobertura_solo", "area_servidao_administrativa"), converter_area_ha),
+    "area_reserva_legal_averbada_art30_ha": (
+        ("reserva_legal", "informacao_documental", "area_reserva_legal_averbada_art30"), converter_area_ha
+    ),
+    "area_reserva_legal_averbada_ha": (
+        ("reserva_legal", "informacao_georreferenciada", "area_reserva_legal_averbada"), converter_area_ha
+    ),
+    "area_reserva_legal_aprovada_nao_averbada_ha": (
+        ("reserva_legal", "informacao_georreferenciada", "area_reserva_legal_aprovada_nao_averbada"), converter_area_ha
+    ),
+    "area_reserva_legal_proposta_ha": (
+        ("reserva_legal", "informacao_georreferenciada", "area_reserva_legal_proposta"), converter_area_ha
+    ),
+    "total_reserva_legal_declarada_ha": (
+        ("reserva_legal", "informacao_georreferenciada", "total_reserva_legal_declarada"), converter_area_ha
+    ),
+    "app_total_ha": (("areas_preservacao_permanente_app", "app_total"), converter_area_ha),
+    "app_area_rural_consolidada_ha": (("areas_preservacao_permanente_app", "app_area_rural_consolidada"), converter_area_ha),
+    "app_area_vegetacao_nativa_ha": (
+        ("areas_preservacao_permanente_app", "app_area_remanescente_vegetacao_nativa"), converter_area_ha
+    ),
+    "area_uso_restrito_ha": (("uso_restrito", "area_uso_restrito"), converter_area_ha),
+    "passivo_excedente_reserva_legal_ha": (
+        ("regularidade_ambiental", "passivo_excedente_reserva_legal"), converter_area_ha
+    ),
+    "area_reserva_legal_recompor_ha": (("regularidade_ambiental", "area_reserva_legal_recompor"), converter_area_ha),
+    "area_app_recompor_ha": (("regularidade_ambiental", "area_app_recompor"), converter_area_ha),
+    "area_uso_restrito_recompor_ha": (("regularidade_ambiental", "area_uso_restrito_recompor"), converter_area_ha),
+}
+
+COLUNAS_TIPADAS = ("area_total_ha", *COLUNAS_DEMONSTRATIVO)
+
+
+def _valor_em(dados: Dict[str, Any], caminho: Tuple[str, ...]) -> Any:
+    for chave in caminho:
+        if not isinstance(dados, dict):
+            return None
+        dados = dados.get(chave)
+    return dados
+
+
+def normalizar_dados(area_popup: Any, dados_demonstrativo: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Colunas tipadas de uma consulta
+
+    Args:
+        area_popup: Texto "Área" do popup (coluna area_total)
+        dados_demonstrativo: JSON extraído por extrair_dados_demonstrativo_html
+
+    Returns:
+        Dict com todas as COLUNAS_TIPADAS (None quando ausente ou ilegível,
+        para que um refresh também limpe valores que deixaram de existir)
+    """
+    colunas = {
+        coluna: conversor(_valor_em(dados_demonstrativo or {}, caminho))
+        for coluna, (caminho, conversor) in COLUNAS_DEMONSTRATIVO.items()
+    }
+    # Área do popup; sem ela, a do demonstrativo
+    area_total = converter_area_ha(area_popup)
+    colunas["area_total_ha"] = area_total if area_total is not None else colunas["area_imovel_ha"]
+    return colunas
@@ -0,0 +1,332 @@
+"""
+Repositório assíncrono do Supabase
+Acesso ao PostgREST e ao Storage por um cliente HTTP assíncrono compartilhado
+(pool de conexões), com timeout por requisição e retentativas com backoff.
+A interface imita o construtor de consultas do supabase-py
+(`tabela(...).select(...).eq(...)`), mas `execute()` é aguardável e nunca
+bloqueia o event loop
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# Falhas em que a requisição não chegou ao servidor (seguras para repetir sempre)
+ERROS_CONEXAO = ("ConnectError", "ConnectTimeout", "PoolTimeout")
+
+
+class ErroRepositorio(Exception):
+    """Requisição ao Supabase recusada ou sem resposta após as retentativas"""
+
+    def __init__(self, mensagem: str, status: Optional[int] = None):
+        self.status = status
+        super().__init__(mensagem)
+
+
+class Resposta:
+    """Resultado de `execute()` (mesmos atributos da resposta do supabase-py)"""
+
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def _contagem(content_range: Optional[str]) -> Optional[int]:
+    """Total de linhas do cabeçalho Content-Range ("0-9/123")"""
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.rsplit("/", 1)[1]
+    return int(total) if total.isdigit() else None
+
+
+def _valor_filtro(valor: Any) -> str:
+    if valor is None:
+        return "null"
+    if isinstance(valor, bool):
+        return "true" if valor else "false"
+    return str(valor)
+
+
+class ConsultaTabela:
+    """Construtor de uma requisição ao PostgREST para uma tabela"""
+
+    def __init__(self, repositorio: "RepositorioSupabase", tabela: str):
+        self._repositorio = repositorio
+        self._tabela = tabela
+        self._metodo = "GET"
+        self._params: List[Tuple[str, str]] = []
+        self._corpo: Any = None
+        self._preferencias: List[str] = []
+        self._idempotente = True
+
+    # Operações
+
+    def select(self, colunas: str = "*", count: Optional[str] = None) -> "ConsultaTabela":
+        self._metodo = "GET"
+        self._params.append(("select", colunas.replace(" ", "")))
+        if count:
+            self._preferencias.append(f"count={count}")
+        return self
+
+    def insert(self, dados: Union[Dict[str, Any], List[Dict[str, Any]]]) -> "ConsultaTabela":
+        self._metodo = "POST"
+        self._corpo = dados
+        self._preferencias.append("return=representation")
+        self._idempotente = False
+        return self
+
+    def upsert(
+        self,
+        dados: Union[Dict[str, Any], List[Dict[str, Any]]],
+        on_conflict: Optional[str] = None
+    ) -> "ConsultaTabela":
+        self._metodo = "POST"
+        self._corpo = dados
+        self._preferencias += ["return=representation", "resolution=merge-duplicates"]
+        if on_conflict:
+            self._params.append(("on_conflict", on_conflict))
+        return self
+
+    def update(self, dados: Dict[str, Any]) -> "ConsultaTabela":
+        self._metodo = "PATCH"
+        self._corpo = dados
+        self._preferencias.append("return=representation")
+        return self
+
+    def delete(self) -> "ConsultaTabela":
+        self._metodo = "DELETE"
+        self._preferencias.append("return=representation")
+        return self
+
+    # Filtros e modificadores
+
+    def _filtro(self, coluna: str, operador: str, valor: Any) -> "ConsultaTabela":
+        self._params.append((coluna, f"{operador}.{_valor_filtro(valor)}"))
+        return self
+
+    def eq(self, coluna: str, valor: Any) -> "ConsultaTabela":
+        return self._filtro(coluna, "eq", valor)
+
+    def neq(self, coluna: str, valor: Any) -> "ConsultaTabela":
+        return self._filtro(coluna, "neq", valor)
+
+    def lt(self, coluna: str, valor: Any) -> "ConsultaTabela":
+        return self._filtro(coluna, "lt", valor)
+
+    def lte(self, coluna: str, valor: Any) -> "ConsultaTabela":
+        return self._filtro(coluna, "lte", valor)
+
+    def gt(self, coluna: str, valor: Any) -> "ConsultaTabela":
+        return self._filtro(coluna, "gt", valor)
+
+    def gte(self, coluna: str, valor: Any) -> "ConsultaTabela":
+        return self._filtro(coluna, "gte", valor)
+
+    def is_(self, coluna: str, valor: Any) -> "ConsultaTabela":
+        return self._filtro(coluna, "is", valor)
+
+    def in_(self, coluna: str, valores: List[Any]) -> "ConsultaTabela":
+        lista = ",".join(_valor_filtro(v) for v in valores)
+        self._params.append((coluna, f"in.({lista})"))
+        return self
+
+    def or_(self, filtros: str) -> "ConsultaTabela":
+        """Disjunção no formato do PostgREST (ex.: "a.lt.1,and(a.eq.1,b.lt.2)")"""
+        self._params.append(("or", f"({filtros})"))
+        return self
+
+    def order(self, coluna: str, desc: bool = False) -> "ConsultaTabela":
+        # Várias chamadas viram um único parâmetro ("order=a.desc,b.desc")
+        criterio = f"{coluna}.{'desc' if desc else 'asc'}"
+        for i, (nome, valor) in enumerate(self._params):
+            if nome == "order":
+                self._params[i] = ("order", f"{valor},{criterio}")
+                return self
+        self._params.append(("order", criterio))
+        return self
+
+    def limit(self, quantidade: int) -> "ConsultaTabela":
+        self._params.append(("limit", str(quantidade)))
+        return self
+
+    async def execute(self) -> Resposta:
+        cabecalhos = {"Prefer": ",".join(self._preferencias)} if self._preferencias else {}
+        resposta = await self._repositorio.requisicao(
+            self._metodo,
+            f"/rest/v1/{self._tabela}",
+            params=self._params,
+            json=self._corpo,
+            cabecalhos=cabecalhos,
+            idempotente=self._idempotente
+        )
+        dados = resposta.json() if resposta.content else []
+        return Resposta(dados, _contagem(resposta.headers.get("content-range")))
+
+
+class ChamadaRpc:
+    """Chamada a uma função do Postgres exposta pelo PostgREST"""
+
+    def __init__(self, repositorio: "RepositorioSupabase", funcao: str, parametros: Dict[str, Any]):
+        self._repositorio = repositorio
+        self._funcao = funcao
+        self._parametros = parametros
+
+    async def execute(self) -> Resposta:
+        # Funções podem ter efeitos colaterais (ex.: incrementar contador): não repetir após envio
+        resposta = await self._repositorio.requisicao(
+            "POST", f"/rest/v1/rpc/{self._funcao}", json=self._parametros, idempotente=False
+        )
+        return Resposta(resposta.json() if resposta.content else None)
+
+
+class RepositorioSupabase:
+    """
+    Cliente assíncrono do Supabase (PostgREST + Storage)
+
+    Um único `httpx.AsyncClient` é criado na primeira requisição e mantém o
+    pool de conexões (keep-alive) entre todas as sessões. Cada tentativa tem
+    `timeout` segundos; timeouts, falhas de rede, 429 e 5xx são repetidos
+    com backoff exponencial até `max_tentativas` — exceto escritas não
+    idempotentes (insert, rpc), repetidas só quando a requisição nem chegou
+    ao servidor.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        chave: str,
+        timeout: float = 10.0,
+        max_tentativas: int = 3,
+        backoff_inicial: float = 0.2,
+        max_conexoes: int = 20,
+        cliente=None
+    ):
+        self.url = url.rstrip("/")
+        self.chave = chave
+        self.timeout = timeout
+        self.max_tentativas = max_tentativas
+        self.backoff_inicial = backoff_inicial
+        self.max_conexoes = max_conexoes
+        self._cliente = cliente
+
+        self.requisicoes = 0
+        self.retentativas = 0
+        self.falhas = 0
+
+    def _obter_cliente(self):
+        if self._cliente is None:
+            import httpx
+
+            self._cliente = httpx.AsyncClient(
+                base_url=self.url,
+                headers={"apikey": self.chave, "Authorization": f"Bearer {self.chave}"},
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_conexoes,
+                    max_keepalive_connections=self.max_conexoes
+                )
+            )
+        return self._cliente
+
+    def table(self, tabela: str) -> ConsultaTabela:
+        return ConsultaTabela(self, tabela)
+
+    def rpc(self, funcao: str, parametros: Dict[str, Any]) -> ChamadaRpc:
+        return ChamadaRpc(self, funcao, parametros)
+
+    async def enviar_arquivo(
+        self,
+        bucket: str,
+        caminho: str,
+        conteudo: bytes,
+        content_type: str = "application/octet-stream",
+        upsert: bool = True
+    ):
+        """Upload para o Storage (sobrescreve com `upsert`)"""
+        await self.requisicao(
+            "POST",
+            f"/storage/v1/object/{bucket}/{quote(caminho)}",
+            conteudo=conteudo,
+            cabecalhos={"Content-Type": content_type, "x-upsert": "true" if upsert else "false"},
+            idempotente=upsert
+        )
+
+    async def baixar_arquivo(self, bucket: str, caminho: str) -> bytes:
+        """Conteúdo de um objeto do Storage (acesso autenticado, vale para buckets privados)"""
+        resposta = await self.requisicao("GET", f"/storage/v1/object/{bucket}/{quote(caminho)}")
+        return resposta.content
+
+    def url_publica(self, bucket: str, caminho: str) -> str:
+        return f"{self.url}/storage/v1/object/public/{bucket}/{quote(caminho)}"
+
+    async def requisicao(
+        self,
+        metodo: str,
+        caminho: str,
+        params: Optional[List[Tuple[str, str]]] = None,
+        json: Any = None,
+        conteudo: Optional[bytes] = None,
+        cabecalhos: Optional[Dict[str, str]] = None,
+        idempotente: bool = True
+    ):
+        """
+        Executa a requisição com timeout e retentativas
+
+        Returns:
+            Resposta HTTP (2xx)
+
+        Raises:
+            ErroRepositorio: Status 4xx (exceto 408/429) ou falha após as retentativas
+        """
+        cliente = self._obter_cliente()
+        espera = self.backoff_inicial
+
+        for tentativa in range(1, self.max_tentativas + 1):
+            self.requisicoes += 1
+            ultima_tentativa = tentativa == self.max_tentativas
+            try:
+                resposta = await asyncio.wait_for(
+                    cliente.request(
+                        metodo, caminho, params=params, json=json,
+                        content=conteudo, headers=cabecalhos
+                    ),
+                    timeout=self.timeout
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                repetir = idempotente or type(e).__name__ in ERROS_CONEXAO
+                logger.warning(f"[SUPABASE] {metodo} {caminho} falhou (tentativa {tentativa}): {type(e).__name__} {e}")
+                if not repetir or ultima_tentativa:
+                    self.falhas += 1
+                    raise ErroRepositorio(f"{metodo} {caminho}: {type(e).__name__} {e}") from e
+            else:
+                if resposta.status_code < 400:
+                    return resposta
+
+                repetir = idempotente and (resposta.status_code in (408, 429) or resposta.status_code >= 500)
+                if not repetir or ultima_tentativa:
+                    self.falhas += 1
+                    raise ErroRepositorio(
+                        f"{metodo} {caminho}: HTTP {resposta.status_code} {resposta.text[:200]}",
+                        status=resposta.status_code
+                    )
+                logger.warning(f"[SUPABASE] {metodo} {caminho} HTTP {resposta.status_code} (tentativa {tentativa})")
+
+            self.retentativas += 1
+            await asyncio.sleep(espera)
+            espera *= 2
+
+    async def fechar(self):
+        if self._cliente is not None:
+            await self._cliente.aclose()
+            self._cliente = None
+
+    def metricas(self) -> Dict[str, int]:
+        return {
+            "requisicoes": self.requisicoes,
+            "retentativas": self.retentativas,
+            "falhas": self.falhas
+        }
@@ -0,0 +1,186 @@
+"""
+Monitor de saúde com sondas em segundo plano
+Cada dependência (Supabase, Storage, navegadores, fila, portal) é verificada
+num laço próprio, com timeout, e o resultado fica em cache. `/health` e
+`/ready` só leem o cache: responder não custa nenhuma chamada externa, não
+importa quantos healthchecks (Docker, nginx, balanceador) batam no endpoint.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Verificacao = Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class SondaIndisponivel(Exception):
+    """A dependência respondeu, mas não pode receber trabalho agora (ex.: fila cheia)"""
+
+    def __init__(self, mensagem: str, detalhes: Optional[Dict[str, Any]] = None):
+        super().__init__(mensagem)
+        self.detalhes = detalhes
+
+
+class Sonda:
+    """Uma dependência verificada periodicamente e o último resultado"""
+
+    def __init__(self, nome: str, verificar: Verificacao, intervalo: float, timeout: float, critica: bool):
+        self.nome = nome
+        self.verificar = verificar
+        self.intervalo = intervalo
+        self.timeout = timeout
+        self.critica = critica
+
+        self.status = "pendente"
+        self.detalhes: Dict[str, Any] = {}
+        self.erro: Optional[str] = None
+        self.latencia_ms: Optional[float] = None
+        self.verificado_em: Optional[float] = None  # time.monotonic()
+        self.verificado_em_iso: Optional[str] = None
+        self.falhas_seguidas = 0
+
+    async def executar(self):
+        inicio = time.monotonic()
+        try:
+            detalhes = await asyncio.wait_for(self.verificar(), timeout=self.timeout)
+            status, erro = "ok", None
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            detalhes, status, erro = None, "erro", f"timeout após {self.timeout:g}s"
+        except SondaIndisponivel as e:
+            detalhes, status, erro = e.detalhes, "indisponivel", str(e)
+        except Exception as e:
+            detalhes, status, erro = None, "erro", f"{type(e).__name__}: {e}"
+
+        if status != "ok" and self.falhas_seguidas == 0:
+            logger.warning(f"[SAUDE] {self.nome}: {erro}")
+        elif status == "ok" and self.falhas_seguidas:
+            logger.info(f"[SAUDE] {self.nome} recuperado após {self.falhas_seguidas} falhas")
+
+        self.falhas_seguidas = 0 if status == "ok" else self.falhas_seguidas + 1
+        self.status = status
+        self.erro = erro
+        self.detalhes = detalhes or {}
+        self.latencia_ms = round((time.monotonic() - inicio) * 1000, 1)
+        self.verificado_em = time.monotonic()
+        self.verificado_em_iso = datetime.utcnow().isoformat()
+
+    def idade(self) -> Optional[float]:
+        return None if self.verificado_em is None else time.monotonic() - self.verificado_em
+
+    def resumo(self) -> Dict[str, Any]:
+        resumo = {
+            "status": self.status,
+            "critica": self.critica,
+            "latencia_ms": self.latencia_ms,
+            "verificado_em": self.verificado_em_iso
+        }
+        if self.erro:
+            resumo["erro"] = self.erro
+        if self.detalhes:
+            resumo["detalhes"] = self.detalhes
+        return resumo
+
+
+class MonitorSaude:
+    """
+    Sondas de dependências com resultados em cache
+
+    Prontidão (readiness): todas as sondas críticas em "ok" e verificadas há
+    menos de `max_atrasos` intervalos (um laço travado não mantém um "ok"
+    antigo). Sondas não críticas, como o portal, que afeta todas as réplicas
+    igualmente, aparecem no snapshot mas não tiram a réplica do balanceador.
+    """
+
+    def __init__(self, intervalo: float = 15.0, timeout: float = 5.0, max_atrasos: int = 3):
+        self.intervalo = intervalo
+        self.timeout = timeout
+        self.max_atrasos = max_atrasos
+
+        self.sondas: Dict[str, Sonda] = {}
+        self.encerrando = False
+        self._tarefas: List[asyncio.Task] = []
+
+    def registrar(
+        self,
+        nome: str,
+        verificar: Verificacao,
+        critica: bool = True,
+        intervalo: Optional[float] = None,
+        timeout: Optional[float] = None
+    ):
+        """
+        Args:
+            nome: Chave no snapshot
+            verificar: Corrotina que retorna detalhes (dict ou None) ou levanta exceção;
+                SondaIndisponivel indica dependência viva porém sem capacidade
+            critica: Se a falha tira a réplica de prontidão
+            intervalo: Segundos entre verificações (padrão do monitor)
+            timeout: Limite de cada verificação (padrão do monitor)
+        """
+        self.sondas[nome] = Sonda(
+            nome,
+            verificar,
+            intervalo=intervalo or self.intervalo,
+            timeout=timeout or self.timeout,
+            critica=critica
+        )
+
+    async def verificar_todas(self):
+        """Executa uma rodada de todas as sondas em paralelo"""
+        await asyncio.gather(*(sonda.executar() for sonda in self.sondas.values()))
+
+    async def iniciar(self):
+        if self._tarefas:
+            return
+        self.encerrando = False
+        self._tarefas = [asyncio.create_task(self._loop(sonda)) for sonda in self.sondas.values()]
+        logger.info(f"Monitor de saúde iniciado ({', '.join(self.sondas)})")
+
+    async def parar(self):
+        for tarefa in self._tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*self._tarefas, return_exceptions=True)
+        self._tarefas = []
+
+    def drenar(self):
+        """Marca a réplica como não pronta (encerramento): o balanceador para de enviar tráfego"""
+        self.encerrando = True
+
+    async def _loop(self, sonda: Sonda):
+        while True:
+            await sonda.executar()
+            await asyncio.sleep(sonda.intervalo)
+
+    def _atrasada(self, sonda: Sonda) -> bool:
+        idade = sonda.idade()
+        return idade is not None and idade > sonda.intervalo * self.max_atrasos
+
+    def motivos_nao_pronto(self) -> List[str]:
+        """Por que a réplica não deve receber tráfego (lista vazia = pronta)"""
+        motivos = ["encerrando"] if self.encerrando else []
+        for sonda in self.sondas.values():
+            if not sonda.critica:
+                continue
+            if sonda.status == "pendente":
+                motivos.append(f"{sonda.nome}: ainda não verificado")
+            elif sonda.status != "ok":
+                motivos.append(f"{sonda.nome}: {sonda.erro}")
+            elif self._atrasada(sonda):
+                motivos.append(f"{sonda.nome}: última verificação há {sonda.idade():.0f}s")
+        return motivos
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado em cache de todas as sondas (não faz nenhuma chamada externa)"""
+        criticas_ok = all(s.status == "ok" for s in self.sondas.values() if s.critica)
+        checks: Dict[str, Any] = {"api": "ok"}
+        checks.update({nome: sonda.resumo() for nome, sonda in self.sondas.items()})
+        return {
+            "status": "healthy" if criticas_ok else "degraded",
+            "checks": checks,
+            "timestamp": datetime.utcnow().isoformat()
+        }
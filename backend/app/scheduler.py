@@ -0,0 +1,360 @@
+"""
+Agendador da watchlist
+Re-verifica CARs monitorados em segundo plano, espalhando as consultas pelas
+janelas fora de pico e respeitando um orçamento global de acessos ao portal
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from zoneinfo import ZoneInfo
+
+from .captcha_fila import CaptchaAbortado
+
+logger = logging.getLogger(__name__)
+
+
+def esta_na_janela(momento: datetime, inicio: int, fim: int) -> bool:
+    """
+    Verifica se um horário está dentro da janela fora de pico
+
+    Args:
+        momento: Datetime no fuso da janela
+        inicio: Hora de início (0-23)
+        fim: Hora de término (0-23, exclusiva). Se fim <= inicio a janela
+            atravessa a meia-noite (ex.: 22 -> 6)
+
+    Returns:
+        True se o horário está dentro da janela
+    """
+    hora = momento.hour
+    if inicio < fim:
+        return inicio <= hora < fim
+    return hora >= inicio or hora < fim
+
+
+def _fracao_estavel(numero_car: str) -> float:
+    """Fração em [0, 1) derivada do número CAR, estável entre processos"""
+    digest = hashlib.md5(numero_car.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) / 0x100000000
+
+
+def calcular_proxima_verificacao(
+    agora: datetime,
+    intervalo_horas: float,
+    numero_car: str,
+    inicio: int,
+    fim: int
+) -> datetime:
+    """
+    Calcula quando um CAR da watchlist deve ser re-verificado
+
+    O horário fica sempre dentro de uma janela fora de pico, no primeiro
+    ponto após `agora + intervalo_horas`. Cada CAR ocupa uma posição fixa
+    dentro da janela (derivada do número), o que espalha as re-verificações
+    de milhares de imóveis ao longo da janela em vez de concentrá-las no início.
+
+    Args:
+        agora: Datetime com fuso (timezone-aware)
+        intervalo_horas: Intervalo mínimo desde agora
+        numero_car: Número do CAR (define a posição dentro da janela)
+        inicio: Hora de início da janela
+        fim: Hora de término da janela
+
+    Returns:
+        Datetime (no mesmo fuso de `agora`) da próxima verificação
+    """
+    base = agora + timedelta(hours=intervalo_horas)
+    duracao_horas = (fim - inicio) % 24 or 24
+    deslocamento = timedelta(hours=duracao_horas * _fracao_estavel(numero_car))
+
+    dia = base.replace(hour=inicio, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    while True:
+        candidato = dia + deslocamento
+        if candidato >= base:
+            return candidato
+        dia += timedelta(days=1)
+
+
+class OrcamentoPortal:
+    """
+    Token bucket com o orçamento global de consultas ao portal do CAR
+
+    Cada consulta agendada consome um token; os tokens são repostos de forma
+    contínua até `por_hora` consultas por hora.
+    """
+
+    def __init__(self, por_hora: int, relogio: Callable[[], float] = time.monotonic):
+        self.capacidade = float(max(por_hora, 1))
+        self.taxa = self.capacidade / 3600.0
+        self._relogio = relogio
+        self._tokens = self.capacidade
+        self._ultima_reposicao = relogio()
+
+    def _repor(self):
+        agora = self._relogio()
+        decorrido = agora - self._ultima_reposicao
+        self._tokens = min(self.capacidade, self._tokens + decorrido * self.taxa)
+        self._ultima_reposicao = agora
+
+    @property
+    def disponivel(self) -> float:
+        self._repor()
+        return self._tokens
+
+    def tentar_consumir(self) -> bool:
+        """Consome um token se houver; retorna False se o orçamento acabou"""
+        self._repor()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+class CaptchaIndisponivel(CaptchaAbortado):
+    """Consulta agendada precisou de CAPTCHA e não há solucionador disponível"""
+    pass
+
+
+class AgendadorWatchlist:
+    """
+    Agendador em processo das re-verificações da watchlist
+
+    A cada tick busca os itens vencidos de `duploa_watchlist_car` e, se
+    estiver dentro da janela fora de pico, dispara consultas em modo refresh
+    pelo mesmo executor usado no WebSocket. Os resultados ficam em
+    `duploa_consultas_car` e o item é reagendado. Se o cadastro mudou, o
+    CAPTCHA vai para a fila de operadores (quando há algum conectado); sem
+    operador, o item fica parado em "pendente_captcha" (sem gastar orçamento
+    nem criar consultas) até um operador conectar.
+    """
+
+    def __init__(
+        self,
+        supabase,
+        executar_consulta: Callable[..., Awaitable[Dict[str, Any]]],
+        janela_inicio: int = 0,
+        janela_fim: int = 6,
+        fuso_horario: str = "America/Sao_Paulo",
+        orcamento_por_hora: int = 30,
+        max_simultaneas: int = 1,
+        intervalo_tick: int = 60,
+        fila_captcha=None,
+        escritor=None
+    ):
+        self.supabase = supabase
+        self.executar_consulta = executar_consulta
+        self.janela_inicio = janela_inicio
+        self.janela_fim = janela_fim
+        self.fuso = ZoneInfo(fuso_horario)
+        self.orcamento = OrcamentoPortal(orcamento_por_hora)
+        self.max_simultaneas = max_simultaneas
+        self.intervalo_tick = intervalo_tick
+        self.fila_captcha = fila_captcha
+        self.escritor = escritor  # EscritorAgrupado (somente_atualizar): reagendamentos gravados em lote
+
+        self._tarefa: Optional[asyncio.Task] = None
+        self._em_execucao: Set[str] = set()
+        self._tarefas_itens: Set[asyncio.Task] = set()
+
+        self._backlog = 0
+        self._lag_segundos = 0.0
+        self._concluidas = 0
+        self._sem_alteracao = 0
+        self._falhas = 0
+        self._aguardando_operador = 0
+        self._ultimo_tick: Optional[str] = None
+
+    def agora(self) -> datetime:
+        return datetime.now(self.fuso)
+
+    def proxima_verificacao(self, numero_car: str, intervalo_horas: float) -> datetime:
+        """Próxima verificação de um CAR a partir de agora"""
+        return calcular_proxima_verificacao(
+            self.agora(), intervalo_horas, numero_car,
+            self.janela_inicio, self.janela_fim
+        )
+
+    async def iniciar(self):
+        if self._tarefa is None:
+            logger.info(
+                f"Agendador da watchlist iniciado (janela {self.janela_inicio}h-{self.janela_fim}h, "
+                f"orçamento {int(self.orcamento.capacidade)}/h)"
+            )
+            self._tarefa = asyncio.create_task(self._loop())
+
+    async def parar(self):
+        if self._tarefa:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+
+        for tarefa in list(self._tarefas_itens):
+            tarefa.cancel()
+
+        logger.info("Agendador da watchlist parado")
+
+    async def _loop(self):
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erro no tick do agendador: {e}", exc_info=True)
+
+            await asyncio.sleep(self.intervalo_tick)
+
+    @property
+    def operadores_online(self) -> bool:
+        return bool(self.fila_captcha and self.fila_captcha.operadores_online)
+
+    async def _tick(self):
+        agora = self.agora()
+        self._ultimo_tick = agora.isoformat()
+
+        consulta = self.supabase.table("duploa_watchlist_car").select(
+            "id, cliente_id, numero_car, intervalo_horas, proxima_verificacao, falhas_consecutivas",
+            count="exact"
+        ).eq("ativo", True).lte(
+            "proxima_verificacao", agora.astimezone(timezone.utc).isoformat()
+        )
+        if not self.operadores_online:
+            # Cadastro já sabidamente alterado: sem operador para o CAPTCHA, a consulta
+            # só gastaria orçamento e deixaria outra linha com erro
+            consulta = consulta.or_("ultimo_status.is.null,ultimo_status.neq.pendente_captcha")
+        vencidos = await consulta.order("proxima_verificacao").limit(100).execute()
+
+        itens = vencidos.data or []
+        self._backlog = vencidos.count if vencidos.count is not None else len(itens)
+        self._lag_segundos = 0.0
+        if itens:
+            mais_antigo = datetime.fromisoformat(itens[0]["proxima_verificacao"])
+            if mais_antigo.tzinfo is None:
+                mais_antigo = mais_antigo.replace(tzinfo=timezone.utc)
+            self._lag_segundos = max(0.0, (agora - mais_antigo).total_seconds())
+
+        if not esta_na_janela(agora, self.janela_inicio, self.janela_fim):
+            return
+
+        for item in itens:
+            if len(self._em_execucao) >= self.max_simultaneas:
+                break
+            if item["id"] in self._em_execucao:
+                continue
+            if not self.orcamento.tentar_consumir():
+                logger.info("Orçamento de consultas ao portal esgotado, aguardando reposição")
+                break
+
+            self._em_execucao.add(item["id"])
+            tarefa = asyncio.create_task(self._executar_item(item))
+            self._tarefas_itens.add(tarefa)
+            tarefa.add_done_callback(self._tarefas_itens.discard)
+
+    async def _executar_item(self, item: Dict[str, Any]):
+        numero_car = item["numero_car"]
+        captcha_solicitado = False
+
+        ultimo_captcha = {"id": None}
+
+        async def resolver_captcha_operadores(image_bytes: bytes) -> str:
+            nonlocal captcha_solicitado
+            captcha_solicitado = True
+            if not self.operadores_online:
+                raise CaptchaIndisponivel("CAPTCHA necessário em verificação agendada (cadastro alterado)")
+
+            item_captcha = self.fila_captcha.publicar(image_bytes, numero_car, item["cliente_id"])
+            ultimo_captcha["id"] = item_captcha.id
+            return await self.fila_captcha.aguardar(item_captcha)
+
+        async def reportar_resultado_captcha(aceito: bool):
+            if self.fila_captcha and ultimo_captcha["id"]:
+                self.fila_captcha.registrar_resultado(ultimo_captcha["id"], aceito)
+
+        logger.info(f"[WATCHLIST] Re-verificando CAR {numero_car} (item {item['id']})")
+
+        try:
+            consulta = await self.executar_consulta(
+                numero_car=numero_car,
+                cliente_id=item["cliente_id"],
+                resolver_captcha=resolver_captcha_operadores,
+                modo="refresh",
+                prioridade="bulk",
+                resultado_captcha=reportar_resultado_captcha
+            )
+
+            if consulta["shapefile_reaproveitado"]:
+                self._sem_alteracao += 1
+                ultimo_status = "sem_alteracao"
+            else:
+                ultimo_status = "atualizado"
+            self._concluidas += 1
+
+            atualizacao = {
+                "ultimo_status": ultimo_status,
+                "ultima_consulta_id": consulta["consulta_id"],
+                "falhas_consecutivas": 0,
+                "proxima_verificacao": self.proxima_verificacao(
+                    numero_car, item.get("intervalo_horas") or 168
+                ).isoformat()
+            }
+
+        except asyncio.CancelledError:
+            self._em_execucao.discard(item["id"])
+            raise
+
+        except CaptchaIndisponivel:
+            # Não é falha do CAR: sem backoff; parado até um operador conectar
+            self._aguardando_operador += 1
+            logger.info(f"[WATCHLIST] {numero_car} alterado, aguardando operador para o CAPTCHA")
+            atualizacao = {"ultimo_status": "pendente_captcha"}
+
+        except Exception as e:
+            self._falhas += 1
+            falhas = (item.get("falhas_consecutivas") or 0) + 1
+            logger.warning(f"[WATCHLIST] Falha ao re-verificar {numero_car} ({falhas}x): {e}")
+
+            # Backoff exponencial limitado a 1 dia, sempre dentro da janela
+            atualizacao = {
+                "ultimo_status": "pendente_captcha" if captcha_solicitado else "erro",
+                "falhas_consecutivas": falhas,
+                "proxima_verificacao": self.proxima_verificacao(
+                    numero_car, min(24, 2 ** falhas)
+                ).isoformat()
+            }
+
+        atualizacao["ultima_verificacao"] = self.agora().isoformat()
+
+        try:
+            if self.escritor:
+                self.escritor.alterar(item["id"], atualizacao)
+                await self.escritor.confirmar(item["id"])
+            else:
+                await self.supabase.table("duploa_watchlist_car").update(atualizacao).eq("id", item["id"]).execute()
+        except Exception as e:
+            logger.error(f"[WATCHLIST] Erro ao reagendar item {item['id']}: {e}")
+        finally:
+            # Só libera após reagendar, para o próximo tick não pegar o item de novo
+            self._em_execucao.discard(item["id"])
+
+    def metricas(self) -> Dict[str, Any]:
+        """Métricas de backlog e atraso do agendador"""
+        return {
+            "ativo": self._tarefa is not None,
+            "na_janela": esta_na_janela(self.agora(), self.janela_inicio, self.janela_fim),
+            "janela": f"{self.janela_inicio:02d}:00-{self.janela_fim:02d}:00",
+            "backlog": self._backlog,
+            "lag_segundos": round(self._lag_segundos, 1),
+            "em_execucao": len(self._em_execucao),
+            "orcamento_disponivel": round(self.orcamento.disponivel, 2),
+            "concluidas": self._concluidas,
+            "sem_alteracao": self._sem_alteracao,
+            "falhas": self._falhas,
+            "aguardando_operador": self._aguardando_operador,
+            "ultimo_tick": self._ultimo_tick
+        }
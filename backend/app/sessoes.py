@@ -0,0 +1,401 @@
+"""
+Sessões de consulta retomáveis
+A consulta roda desacoplada da conexão WebSocket: os eventos ficam num buffer
+numerado e, se a conexão cair, o cliente tem um período de carência para
+reconectar com o token de retomada, receber o que perdeu e o CAPTCHA pendente
+"""
+import asyncio
+import base64
+import collections
+import logging
+import secrets
+import time
+import uuid
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from .captcha_imagem import empacotar_frame
+from .codec import CodecMensagens
+
+logger = logging.getLogger(__name__)
+
+# Eventos que podem ser substituídos ou descartados sob pressão
+TIPOS_DESCARTAVEIS = ("progress", "queued")
+
+
+class Evento:
+    """Mensagem numerada de uma sessão (CAPTCHAs levam a imagem à parte)"""
+
+    __slots__ = ("seq", "mensagem", "imagem")
+
+    def __init__(self, seq: int, mensagem: Dict[str, Any], imagem: Optional[bytes] = None):
+        self.seq = seq
+        self.mensagem = mensagem
+        self.imagem = imagem
+
+
+class ConexaoWebSocket:
+    """
+    Conexão de um cliente a uma sessão, com fila de saída própria
+
+    `enfileirar` nunca espera a rede: o scraper só coloca o evento na fila e
+    uma tarefa separada envia. A fila é limitada a `max_fila` eventos:
+    - um `progress`/`queued` ainda não enviado é substituído pelo mais novo
+      do mesmo tipo (o antigo já está superado);
+    - com a fila cheia, eventos não críticos (progress/queued) são
+      descartados; críticos (CAPTCHA, conclusão, erro...) nunca.
+    Com `lotes`, os eventos JSON acumulados saem num único frame
+    { "type": "lote", "eventos": [...] }.
+
+    Serializa o evento com o codec negociado (JSON, msgpack, comprimido) e
+    conforme a preferência do cliente para o CAPTCHA (base64 no JSON, frame
+    binário ou bytes no msgpack); ignora eventos já entregues nesta conexão.
+    Numa conexão multiplexada cada sessão tem o seu canal: as mensagens levam
+    `job_id` e a `trava` compartilhada serializa os envios no mesmo socket.
+    """
+
+    def __init__(
+        self,
+        websocket,
+        captcha_binario: bool = False,
+        job_id: Optional[str] = None,
+        trava: Optional[asyncio.Lock] = None,
+        max_fila: int = 64,
+        lotes: bool = False,
+        max_lote: int = 50,
+        codec: Optional[CodecMensagens] = None
+    ):
+        self.websocket = websocket
+        self.captcha_binario = captcha_binario
+        self.codec = codec or CodecMensagens()
+        self.job_id = job_id
+        self.trava = trava or asyncio.Lock()
+        self.max_fila = max_fila
+        self.lotes = lotes
+        self.max_lote = max_lote
+        self.ultimo_seq = 0
+
+        # Chamada (com a conexão) quando um envio falha
+        self.ao_falhar: Optional[Callable[["ConexaoWebSocket"], None]] = None
+        self.fechada = False
+
+        self._fila: Deque[Evento] = collections.deque()
+        self._sinal = asyncio.Event()
+        self._vazia = asyncio.Event()
+        self._vazia.set()
+        self._tarefa: Optional[asyncio.Task] = None
+
+        self.enviados = 0
+        self.coalescidos = 0
+        self.descartados = 0
+
+    def enfileirar(self, evento: Evento, reenvio: bool = False):
+        """Coloca o evento na fila de saída (não bloqueia)"""
+        if self.fechada or (evento.seq <= self.ultimo_seq and not reenvio):
+            return
+        self.ultimo_seq = max(self.ultimo_seq, evento.seq)
+
+        tipo = evento.mensagem.get("type")
+        if tipo in TIPOS_DESCARTAVEIS:
+            for pendente in self._fila:
+                if pendente.mensagem.get("type") == tipo:
+                    self._fila.remove(pendente)
+                    self.coalescidos += 1
+                    break
+            if len(self._fila) >= self.max_fila:
+                self.descartados += 1
+                return
+        elif len(self._fila) >= self.max_fila:
+            # Abre espaço descartando o evento não crítico mais antigo
+            for pendente in self._fila:
+                if pendente.mensagem.get("type") in TIPOS_DESCARTAVEIS:
+                    self._fila.remove(pendente)
+                    self.descartados += 1
+                    break
+
+        self._fila.append(evento)
+        self._vazia.clear()
+        self._sinal.set()
+        if self._tarefa is None:
+            self._tarefa = asyncio.create_task(self._enviar_loop())
+
+    async def esvaziar(self, timeout: float = 5.0):
+        """Aguarda a fila de saída ser enviada (ex.: antes de fechar o socket)"""
+        try:
+            await asyncio.wait_for(self._vazia.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Fila de saída não esvaziou em {timeout}s ({len(self._fila)} eventos)")
+
+    def fechar(self):
+        self.fechada = True
+        self._fila.clear()
+        self._vazia.set()
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+
+    async def _enviar_loop(self):
+        try:
+            while True:
+                await self._sinal.wait()
+                self._sinal.clear()
+
+                while self._fila:
+                    lote: List[Dict[str, Any]] = []
+                    while self._fila and len(lote) < self.max_lote:
+                        evento = self._fila.popleft()
+                        if self.lotes and evento.imagem is None:
+                            lote.append(self._serializar(evento))
+                            continue
+                        if lote:
+                            await self._enviar_json({"type": "lote", "eventos": lote})
+                            lote = []
+                        await self._enviar(evento)
+
+                    if lote:
+                        await self._enviar_json({"type": "lote", "eventos": lote} if len(lote) > 1 else lote[0])
+
+                self._vazia.set()
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Falha ao enviar para o cliente: {e}")
+            self.fechar()
+            if self.ao_falhar:
+                self.ao_falhar(self)
+
+    def _serializar(self, evento: Evento) -> Dict[str, Any]:
+        mensagem = {**evento.mensagem, "seq": evento.seq}
+        if self.job_id:
+            mensagem["job_id"] = self.job_id
+        return mensagem
+
+    async def _enviar_json(self, mensagem: Dict[str, Any]):
+        async with self.trava:
+            await self.codec.enviar(self.websocket, mensagem)
+        self.enviados += 1
+
+    async def _enviar(self, evento: Evento):
+        mensagem = self._serializar(evento)
+
+        if evento.imagem is None:
+            await self._enviar_json(mensagem)
+        elif self.codec.bytes_nativos:
+            mensagem["image"] = evento.imagem
+            await self._enviar_json(mensagem)
+        elif self.captcha_binario and not self.codec.binario:
+            cabecalho = {**mensagem, "mime": "image/png", "tamanho": len(evento.imagem)}
+            async with self.trava:
+                await self.websocket.send_bytes(empacotar_frame(cabecalho, evento.imagem))
+            self.enviados += 1
+        else:
+            mensagem["image"] = base64.b64encode(evento.imagem).decode("utf-8")
+            await self._enviar_json(mensagem)
+
+
+class SessaoConsulta:
+    """
+    Estado de uma consulta que sobrevive à queda da conexão
+
+    - `emitir` numera e guarda cada evento e o entrega se houver conexão;
+      falhas de envio nunca chegam ao scraper, apenas desanexam a conexão.
+    - `anexar` (re)conecta um cliente, reenvia os eventos após `ultimo_seq`
+      e o CAPTCHA pendente.
+    - Sem conexão por mais de `carencia` segundos, `abandonada` é sinalizado
+      (quem espera CAPTCHA do cliente deve desistir).
+    """
+
+    def __init__(
+        self,
+        numero_car: str,
+        cliente_id: str,
+        carencia: float = 120.0,
+        max_eventos: int = 200,
+        ao_expirar: Optional[Callable[["SessaoConsulta"], None]] = None
+    ):
+        self.id = str(uuid.uuid4())
+        self.token = secrets.token_urlsafe(24)
+        self.numero_car = numero_car
+        self.cliente_id = cliente_id
+        self.carencia = carencia
+        self.ao_expirar = ao_expirar
+
+        self.abandonada = asyncio.Event()
+        self.concluida = asyncio.Event()
+        self.tarefa: Optional[asyncio.Task] = None
+
+        self._eventos: Deque[Evento] = collections.deque(maxlen=max_eventos)
+        self._seq = 0
+        self._conexao: Optional[ConexaoWebSocket] = None
+        self._captcha_pendente: Optional[Evento] = None
+        self._temporizador: Optional[asyncio.TimerHandle] = None
+        self.desconectada_em: Optional[float] = None
+        self.retomadas = 0
+        self._observadores: List[Callable[[Dict[str, Any], int], None]] = []
+
+    def observar(self, observador: Callable[[Dict[str, Any], int], None]):
+        """Registra função chamada com (mensagem, seq) para cada evento, com ou sem conexão"""
+        self._observadores.append(observador)
+
+    @property
+    def conectada(self) -> bool:
+        return self._conexao is not None
+
+    @property
+    def ultimo_seq(self) -> int:
+        return self._seq
+
+    async def emitir(self, mensagem: Dict[str, Any], imagem: Optional[bytes] = None) -> Evento:
+        """Registra o evento no buffer e entrega à conexão atual, se houver"""
+        self._seq += 1
+        evento = Evento(self._seq, mensagem, imagem)
+        self._eventos.append(evento)
+        if imagem is not None:
+            self._captcha_pendente = evento
+
+        for observador in self._observadores:
+            try:
+                observador(mensagem, evento.seq)
+            except Exception as e:
+                logger.warning(f"[SESSAO {self.id}] Erro no observador de eventos: {e}")
+
+        if self._conexao is not None:
+            self._conexao.enfileirar(evento)
+        return evento
+
+    @property
+    def captcha_pendente_id(self) -> Optional[str]:
+        if self._captcha_pendente is None:
+            return None
+        return self._captcha_pendente.mensagem.get("captcha_id")
+
+    def captcha_resolvido(self):
+        self._captcha_pendente = None
+
+    async def anexar(self, conexao: ConexaoWebSocket, ultimo_seq: int = 0):
+        """
+        Conecta um cliente à sessão, substituindo a conexão anterior
+
+        Args:
+            conexao: Nova conexão
+            ultimo_seq: Último evento recebido pelo cliente (0 = todos)
+        """
+        self._cancelar_temporizador()
+        if self.desconectada_em is not None:
+            self.retomadas += 1
+            logger.info(
+                f"[SESSAO {self.id}] Retomada após {time.monotonic() - self.desconectada_em:.1f}s "
+                f"(cliente tinha até o evento {ultimo_seq})"
+            )
+        self.desconectada_em = None
+        if not self.concluida.is_set():
+            self.abandonada.clear()
+
+        anterior = self._conexao
+        if anterior is not None and anterior is not conexao:
+            anterior.fechar()
+
+        conexao.ultimo_seq = ultimo_seq
+        conexao.ao_falhar = self.desanexar
+        self._conexao = conexao
+        for evento in list(self._eventos):
+            conexao.enfileirar(evento)
+        pendente = self._captcha_pendente
+        if pendente is not None and pendente.seq <= ultimo_seq:
+            conexao.enfileirar(pendente, reenvio=True)
+
+    def desanexar(self, conexao: Optional[ConexaoWebSocket] = None):
+        """Conexão caiu: inicia o período de carência"""
+        if conexao is not None and conexao is not self._conexao:
+            return
+        if self._conexao is None and self._temporizador is not None:
+            return
+
+        if self._conexao is not None:
+            self._conexao.fechar()
+        self._conexao = None
+        self.desconectada_em = time.monotonic()
+        self._cancelar_temporizador()
+        self._temporizador = asyncio.get_running_loop().call_later(self.carencia, self._expirar)
+        if not self.concluida.is_set():
+            logger.info(f"[SESSAO {self.id}] Cliente desconectado, aguardando retomada por {self.carencia:.0f}s")
+
+    def cancelar(self) -> bool:
+        """Cancela a consulta em andamento; False se já terminou"""
+        if self.tarefa is None or self.tarefa.done():
+            return False
+        self.tarefa.cancel()
+        return True
+
+    def finalizar(self):
+        """Consulta terminou (sucesso ou erro); eventos continuam disponíveis até a carência"""
+        self._captcha_pendente = None
+        self.concluida.set()
+        if self._conexao is None and self._temporizador is None:
+            self.desanexar()
+
+    def _cancelar_temporizador(self):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+
+    def _expirar(self):
+        self._temporizador = None
+        if not self.concluida.is_set():
+            logger.warning(f"[SESSAO {self.id}] Carência expirada sem retomada")
+        self.abandonada.set()
+        if self.ao_expirar:
+            self.ao_expirar(self)
+
+
+class GerenciadorSessoes:
+    """Sessões ativas, indexadas pelo token de retomada"""
+
+    def __init__(self, carencia: float = 120.0, max_eventos: int = 200):
+        self.carencia = carencia
+        self.max_eventos = max_eventos
+        self._sessoes: Dict[str, SessaoConsulta] = {}
+        self._retomadas = 0
+        self._expiradas = 0
+
+    def criar(self, numero_car: str, cliente_id: str) -> SessaoConsulta:
+        sessao = SessaoConsulta(
+            numero_car, cliente_id,
+            carencia=self.carencia,
+            max_eventos=self.max_eventos,
+            ao_expirar=self._ao_expirar
+        )
+        self._sessoes[sessao.token] = sessao
+        return sessao
+
+    def obter(self, token: Optional[str], cliente_id: Optional[str] = None) -> Optional[SessaoConsulta]:
+        sessao = self._sessoes.get(token) if token else None
+        if sessao is None or (cliente_id and sessao.cliente_id != cliente_id):
+            return None
+        self._retomadas += 1
+        return sessao
+
+    def obter_por_id(self, session_id: str, cliente_id: str) -> Optional[SessaoConsulta]:
+        """Busca sessão pelo id público (job_id), restrita ao cliente dono"""
+        for sessao in self._sessoes.values():
+            if sessao.id == session_id and sessao.cliente_id == cliente_id:
+                return sessao
+        return None
+
+    def _ao_expirar(self, sessao: SessaoConsulta):
+        # Sessão em andamento continua acessível até terminar (CAPTCHA via operadores)
+        if sessao.concluida.is_set():
+            self._sessoes.pop(sessao.token, None)
+        else:
+            self._expiradas += 1
+
+    def remover(self, sessao: SessaoConsulta):
+        self._sessoes.pop(sessao.token, None)
+
+    def metricas(self) -> Dict[str, Any]:
+        sessoes = list(self._sessoes.values())
+        return {
+            "ativas": sum(1 for s in sessoes if not s.concluida.is_set()),
+            "desconectadas": sum(1 for s in sessoes if not s.conectada and not s.concluida.is_set()),
+            "retomadas": self._retomadas,
+            "expiradas": self._expiradas
+        }
@@ -8,18 +8,23 @@ import json
 import tempfile
 import shutil
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Callable, Dict, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def processar_shapefile_car(zip_path: str) -> Dict[str, dict]:
+def processar_shapefile_car(
+    zip_path: str,
+    ao_converter_camada: Optional[Callable[[str, dict], None]] = None
+) -> Dict[str, dict]:
     """
     Processa o ZIP do CAR e extrai todos os shapefiles, convertendo para GeoJSON
 
     Args:
         zip_path: Caminho para o arquivo .zip baixado do CAR
+        ao_converter_camada: Função opcional chamada com (nome, GeoJSON) assim que
+            cada camada termina de converter (na mesma thread do processamento)
 
     Returns:
         Dict com camadas GeoJSON organizadas por nome da pasta
@@ -90,6 +95,12 @@ def processar_shapefile_car(zip_path: str) -> Dict[str, dict]:
                 if geojson:
                     geojson_layers[layer_name] = geojson
                     logger.info(f"Camada {layer_name} convertida com sucesso")
+
+                    if ao_converter_camada:
+                        try:
+                            ao_converter_camada(layer_name, geojson)
+                        except Exception as e:
+                            logger.warning(f"Erro no callback da camada {layer_name}: {e}")
                 else:
                     logger.warning(f"Camada {layer_name} retornou vazia")
 
@@ -1,8 +1,11 @@
 """
 Cliente Supabase para persistência de dados
+O backend usa o repositório assíncrono (`repositorio`); o cliente síncrono
+fica para scripts de manutenção (ex.: reprocessar_consulta.py)
 """
 from supabase import create_client, Client
 from .config import settings
+from .repositorio import RepositorioSupabase
 import logging
 
 logger = logging.getLogger(__name__)
@@ -26,3 +29,12 @@ class SupabaseClient:
 
 # Singleton instance
 supabase_client = SupabaseClient()
+
+# Singleton: repositório assíncrono com pool de conexões compartilhado
+repositorio = RepositorioSupabase(
+    settings.supabase_url,
+    settings.supabase_service_key,
+    timeout=settings.supabase_timeout_segundos,
+    max_tentativas=settings.supabase_max_tentativas,
+    max_conexoes=settings.supabase_max_conexoes
+)
@@ -70,3 +70,41 @@ def validar_formato_car(numero_car: str) -> bool:
         logger.warning(f"  Formato esperado: UF-NUMERO-HASH (ex: SC-4215075-3B95B0823AD7...)")
 
     return is_valid
+
+
+def cadastro_foi_alterado(dados_anteriores: dict, dados_novos: dict) -> bool:
+    """
+    Compara dois demonstrativos para decidir se o cadastro foi retificado.
+
+    Usa `situacao_cadastro` e `dados_imovel_rural.data_ultima_retificacao`.
+    Na dúvida (campo ausente em qualquer um dos lados) considera alterado,
+    para nunca reaproveitar um shapefile potencialmente desatualizado.
+
+    Args:
+        dados_anteriores: `dados_demonstrativo` do registro armazenado
+        dados_novos: `dados_demonstrativo` recém extraído do site do CAR
+
+    Returns:
+        True se o cadastro mudou (ou não é possível afirmar que não mudou)
+    """
+    def campos_comparados(dados: dict) -> tuple:
+        dados = dados or {}
+        imovel = dados.get("dados_imovel_rural") or {}
+        return (
+            dados.get("situacao_cadastro"),
+            imovel.get("data_ultima_retificacao"),
+        )
+
+    anteriores = campos_comparados(dados_anteriores)
+    novos = campos_comparados(dados_novos)
+
+    if None in anteriores or None in novos:
+        logger.info("Comparação de cadastro inconclusiva (campos ausentes), considerando alterado")
+        return True
+
+    alterado = anteriores != novos
+
+    if alterado:
+        logger.info(f"Cadastro alterado: {anteriores} -> {novos}")
+
+    return alterado
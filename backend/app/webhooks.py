@@ -0,0 +1,241 @@
+"""
+Entrega de webhooks das consultas em segundo plano
+Eventos de marco (mudança de etapa, CAPTCHA pendente, conclusão, erro) são
+agrupados em lotes, assinados com HMAC-SHA256 e enviados à URL de callback
+do cliente com retentativas e backoff exponencial
+"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Tipos de evento que encerram a consulta (lote enviado imediatamente)
+TIPOS_FINAIS = ("completed", "error", "cancelled")
+
+# Função de envio: (url, corpo, cabeçalhos) -> status HTTP
+EnviarHttp = Callable[[str, bytes, Dict[str, str]], Awaitable[int]]
+
+
+def assinar(segredo: str, timestamp: str, corpo: bytes) -> str:
+    """
+    Assinatura do webhook: HMAC-SHA256 de "<timestamp>.<corpo>"
+
+    O cliente recalcula com o mesmo segredo e compara com o cabeçalho
+    X-RoboCAR-Assinatura (e rejeita timestamps antigos para evitar replay).
+    """
+    mensagem = timestamp.encode("utf-8") + b"." + corpo
+    return "sha256=" + hmac.new(segredo.encode("utf-8"), mensagem, hashlib.sha256).hexdigest()
+
+
+async def enviar_http_httpx(url: str, corpo: bytes, cabecalhos: Dict[str, str], timeout: float = 10.0) -> int:
+    """Envio padrão via httpx"""
+    import httpx
+
+    async with httpx.AsyncClient(timeout=timeout) as cliente:
+        resposta = await cliente.post(url, content=corpo, headers=cabecalhos)
+        return resposta.status_code
+
+
+async def validar_url_callback(url: str, permitir_rede_interna: bool = False) -> str:
+    """
+    Verifica a URL de callback antes de aceitar a consulta
+
+    O servidor faz POST nela com o resultado assinado; sem esta verificação o
+    endpoint serviria para alcançar serviços internos (loopback, rede privada,
+    metadados da nuvem em 169.254.169.254).
+
+    Args:
+        url: URL informada pelo cliente
+        permitir_rede_interna: Aceita endereços não públicos (desenvolvimento)
+
+    Returns:
+        A própria URL
+
+    Raises:
+        ValueError: Esquema diferente de http(s), host ausente, host que não
+            resolve ou que resolve para algum endereço não público
+    """
+    partes = urlsplit(url)
+    if partes.scheme not in ("http", "https"):
+        raise ValueError("callback_url deve ser http(s)")
+    if not partes.hostname:
+        raise ValueError("callback_url sem host")
+    if permitir_rede_interna:
+        return url
+
+    try:
+        enderecos = await asyncio.get_running_loop().getaddrinfo(
+            partes.hostname, partes.port or (443 if partes.scheme == "https" else 80),
+            type=socket.SOCK_STREAM
+        )
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f"callback_url: host não resolve ({partes.hostname})")
+
+    for *_, endereco in enderecos:
+        ip = ipaddress.ip_address(endereco[0].split("%", 1)[0])
+        if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"callback_url aponta para endereço não público ({ip})")
+    return url
+
+
+def _deve_repetir(status: int) -> bool:
+    return status in (408, 425, 429) or status >= 500
+
+
+class EntregadorWebhook:
+    """
+    Fila de webhooks de uma consulta
+
+    `adicionar` nunca bloqueia quem produz os eventos; um loop próprio junta
+    os eventos a cada `intervalo_lote` segundos (ou imediatamente no evento
+    final) e entrega um lote por vez, em ordem. Falhas de rede, 408/429 e 5xx
+    são repetidas com backoff exponencial até `max_tentativas`.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        segredo: str,
+        job_id: str,
+        enviar: Optional[EnviarHttp] = None,
+        intervalo_lote: float = 2.0,
+        max_tentativas: int = 6,
+        backoff_inicial: float = 1.0,
+        backoff_maximo: float = 60.0
+    ):
+        self.url = url
+        self.segredo = segredo
+        self.job_id = job_id
+        self.enviar = enviar or enviar_http_httpx
+        self.intervalo_lote = intervalo_lote
+        self.max_tentativas = max_tentativas
+        self.backoff_inicial = backoff_inicial
+        self.backoff_maximo = backoff_maximo
+
+        self._pendentes: List[Dict[str, Any]] = []
+        self._novo_evento = asyncio.Event()
+        self._final = False
+        self._tarefa: Optional[asyncio.Task] = None
+
+        self.lotes_entregues = 0
+        self.lotes_descartados = 0
+        self.tentativas = 0
+
+    def iniciar(self) -> asyncio.Task:
+        if self._tarefa is None:
+            self._tarefa = asyncio.create_task(self._loop())
+        return self._tarefa
+
+    def adicionar(self, evento: Dict[str, Any]):
+        self._pendentes.append(evento)
+        if evento.get("type") in TIPOS_FINAIS:
+            self._final = True
+        self._novo_evento.set()
+
+    async def aguardar(self):
+        """Aguarda a entrega do último lote (após o evento final)"""
+        if self._tarefa:
+            await self._tarefa
+
+    async def _loop(self):
+        while True:
+            await self._novo_evento.wait()
+            if not self._final:
+                # Junta os eventos que chegarem dentro da janela do lote
+                try:
+                    await asyncio.wait_for(self._aguardar_final(), timeout=self.intervalo_lote)
+                except asyncio.TimeoutError:
+                    pass
+
+            self._novo_evento.clear()
+            eventos, self._pendentes = self._pendentes, []
+            final = self._final
+
+            if eventos:
+                await self._entregar_lote(eventos, final)
+            if final and not self._pendentes:
+                return
+
+    async def _aguardar_final(self):
+        while not self._final:
+            self._novo_evento.clear()
+            await self._novo_evento.wait()
+
+    async def _entregar_lote(self, eventos: List[Dict[str, Any]], final: bool):
+        lote_id = str(uuid.uuid4())
+        corpo = json.dumps({
+            "lote_id": lote_id,
+            "job_id": self.job_id,
+            "final": final,
+            "eventos": eventos
+        }, default=str).encode("utf-8")
+
+        espera = self.backoff_inicial
+        for tentativa in range(1, self.max_tentativas + 1):
+            timestamp = str(int(time.time()))
+            cabecalhos = {
+                "Content-Type": "application/json",
+                "X-RoboCAR-Lote": lote_id,
+                "X-RoboCAR-Timestamp": timestamp,
+                "X-RoboCAR-Assinatura": assinar(self.segredo, timestamp, corpo)
+            }
+
+            self.tentativas += 1
+            try:
+                status = await self.enviar(self.url, corpo, cabecalhos)
+            except Exception as e:
+                status = None
+                logger.warning(f"[WEBHOOK {self.job_id}] Falha ao enviar lote {lote_id} (tentativa {tentativa}): {e}")
+
+            if status is not None and 200 <= status < 300:
+                self.lotes_entregues += 1
+                logger.info(f"[WEBHOOK {self.job_id}] Lote {lote_id} entregue ({len(eventos)} eventos)")
+                return
+
+            if status is not None and not _deve_repetir(status):
+                self.lotes_descartados += 1
+                logger.error(f"[WEBHOOK {self.job_id}] Lote {lote_id} recusado com HTTP {status}, descartando")
+                return
+
+            if tentativa < self.max_tentativas:
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, self.backoff_maximo)
+
+        self.lotes_descartados += 1
+        logger.error(f"[WEBHOOK {self.job_id}] Lote {lote_id} não entregue após {self.max_tentativas} tentativas")
+
+
+class ObservadorMarcos:
+    """
+    Filtra os eventos da sessão que viram webhook
+
+    Repassa a primeira mensagem de cada etapa de progresso, o CAPTCHA
+    pendente (sem a imagem) e os eventos finais.
+    """
+
+    def __init__(self, entregador: EntregadorWebhook):
+        self.entregador = entregador
+        self._etapas: Set[str] = set()
+
+    def __call__(self, mensagem: Dict[str, Any], seq: int):
+        tipo = mensagem.get("type")
+        if tipo == "progress":
+            etapa = mensagem.get("etapa")
+            if etapa in self._etapas:
+                return
+            self._etapas.add(etapa)
+        elif tipo not in ("captcha_required", "session") + TIPOS_FINAIS:
+            return
+
+        self.entregador.adicionar({**mensagem, "seq": seq})
@@ -0,0 +1,67 @@
+"""
+Compara os codecs das mensagens WebSocket/REST num resultado real
+Serializa as camadas de geojson_result.json (ou outro arquivo com
+geojson_layers) com json da biblioteca padrão, orjson, msgpack e as variantes
+comprimidas, mostrando tamanho e tempo médio de codificação
+
+Uso:
+    python benchmark_codec.py [geojson_result.json] [--repeticoes 50]
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import argparse
+import json
+import time
+import zlib
+
+from app.codec import CodecMensagens
+
+
+def medir(nome, codificar, mensagem, repeticoes):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        dados = codificar(mensagem)
+    decorrido_ms = (time.perf_counter() - inicio) * 1000 / repeticoes
+    tamanho = len(dados.encode("utf-8") if isinstance(dados, str) else dados)
+    return nome, tamanho, decorrido_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos codecs de mensagem")
+    parser.add_argument("arquivo", nargs="?", default="geojson_result.json")
+    parser.add_argument("--repeticoes", type=int, default=50)
+    args = parser.parse_args()
+
+    with open(args.arquivo, encoding="utf-8") as f:
+        geojson_layers = json.load(f)
+    mensagem = {"type": "completed", "consulta_id": "benchmark", "geojson_layers": geojson_layers}
+
+    candidatos = [
+        ("json (stdlib)", lambda m: json.dumps(m)),
+        ("json (stdlib) + zlib", lambda m: zlib.compress(json.dumps(m).encode("utf-8"), 6)),
+        ("json (orjson)", CodecMensagens("json").codificar),
+        ("json (orjson) + zlib", CodecMensagens("json", compressao=True).codificar)
+    ]
+    try:
+        candidatos += [
+            ("msgpack", CodecMensagens("msgpack").codificar),
+            ("msgpack + zlib", CodecMensagens("msgpack", compressao=True).codificar)
+        ]
+    except ValueError as e:
+        print(f"[WARN] {e}: pip install msgpack")
+
+    resultados = [medir(nome, codificar, mensagem, args.repeticoes) for nome, codificar in candidatos]
+    referencia = resultados[0]
+
+    print(f"{len(geojson_layers)} camadas, {args.repeticoes} repetições\n")
+    print(f"{'codec':<24}{'bytes':>12}{'tamanho':>10}{'ms/msg':>10}{'tempo':>9}")
+    for nome, tamanho, ms in resultados:
+        print(
+            f"{nome:<24}{tamanho:>12,}{tamanho / referencia[1]:>9.0%}"
+            f"{ms:>10.3f}{ms / referencia[2]:>8.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
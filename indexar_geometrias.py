@@ -0,0 +1,74 @@
+"""
+Indexa no PostGIS as geometrias das consultas já concluídas
+Percorre as consultas concluídas da mais recente para a mais antiga e, para
+cada CAR ainda não visto, lê as camadas do Storage (gzip) e as grava em
+duploa_feicoes_car. Só a consulta mais recente de cada imóvel é indexada
+
+Uso (depois de migrations/add_postgis_feicoes.sql):
+    python indexar_geometrias.py [--limite 1000]
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+
+from dotenv import load_dotenv
+
+from app.armazenamento import ArmazemCamadas, StorageSupabase
+from app.geoespacial import IndiceEspacial
+from app.leitura import filtro_apos_cursor
+from app.repositorio import RepositorioSupabase
+
+load_dotenv()
+
+
+async def indexar(limite: int):
+    repositorio = RepositorioSupabase(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
+    armazem = ArmazemCamadas(StorageSupabase(repositorio), bucket="car-camadas")
+    indice = IndiceEspacial(repositorio)
+    vistos = set()
+    apos = None
+
+    try:
+        while len(vistos) < limite:
+            consulta = repositorio.table("duploa_consultas_car").select(
+                "id, numero_car, camadas, created_at"
+            ).eq("status", "concluido")
+            if apos:
+                consulta = consulta.or_(filtro_apos_cursor(*apos))
+            pagina = await consulta.order("created_at", desc=True).order("id", desc=True).limit(100).execute()
+            if not pagina.data:
+                break
+
+            for linha in pagina.data:
+                if not linha.get("camadas") or linha["numero_car"] in vistos or len(vistos) >= limite:
+                    continue
+                vistos.add(linha["numero_car"])
+
+                camadas = {}
+                for nome, entrada in linha["camadas"].items():
+                    camadas[nome] = json.loads(gzip.decompress(await armazem.ler(entrada)))
+                gravadas = await indice.gravar(linha["id"], linha["numero_car"], camadas)
+                print(f"[OK] {linha['numero_car']}: {sum(gravadas.values())} feições")
+
+            ultima = pagina.data[-1]
+            apos = (ultima["created_at"], ultima["id"])
+    finally:
+        await repositorio.fechar()
+
+    print(f"\n[INFO] {len(vistos)} imóveis indexados")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexa geometrias das camadas no PostGIS")
+    parser.add_argument("--limite", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(indexar(args.limite))
+
+
+if __name__ == "__main__":
+    main()
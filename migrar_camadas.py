@@ -0,0 +1,61 @@
+"""
+Migra o GeoJSON das consultas antigas para objetos gzip no Storage
+Para cada consulta com geojson_layers e sem manifesto, envia as camadas para
+o bucket car-camadas, grava o manifesto em `camadas` e limpa geojson_layers.
+Processa uma linha por vez (memória limitada ao GeoJSON de uma consulta)
+
+Uso (depois de migrations/add_camadas_manifesto.sql):
+    python migrar_camadas.py [--limite 1000]
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import argparse
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+from app.armazenamento import ArmazemCamadas, StorageSupabase
+from app.repositorio import RepositorioSupabase
+
+load_dotenv()
+
+
+async def migrar(limite: int):
+    repositorio = RepositorioSupabase(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
+    armazem = ArmazemCamadas(StorageSupabase(repositorio), bucket="car-camadas")
+    migradas = 0
+
+    try:
+        while migradas < limite:
+            pendente = await repositorio.table("duploa_consultas_car").select(
+                "id, geojson_layers"
+            ).is_("camadas", None).eq("status", "concluido").limit(1).execute()
+            if not pendente.data:
+                break
+
+            consulta = pendente.data[0]
+            manifesto = await armazem.armazenar(consulta["id"], consulta.get("geojson_layers") or {})
+            await repositorio.table("duploa_consultas_car").update({
+                "camadas": manifesto,
+                "geojson_layers": None
+            }).eq("id", consulta["id"]).execute()
+
+            migradas += 1
+            print(f"[OK] {consulta['id']}: {len(manifesto)} camadas")
+    finally:
+        await repositorio.fechar()
+
+    print(f"\n[INFO] {migradas} consultas migradas")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra geojson_layers para objetos no Storage")
+    parser.add_argument("--limite", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(migrar(args.limite))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+-- Migration: Manifesto das camadas no lugar do GeoJSON na linha da consulta
+-- O GeoJSON de cada camada passa a ser objetos pré-comprimidos no bucket
+-- car-camadas (sha256/<xx>/<hash>.geojson.gz e .geojson.br); a linha guarda
+-- só o manifesto.
+-- Depois de aplicar, rode `python migrar_camadas.py` para converter as
+-- consultas antigas (o backend continua lendo geojson_layers enquanto isso).
+
+ALTER TABLE duploa_consultas_car
+ADD COLUMN IF NOT EXISTS camadas JSONB;
+
+COMMENT ON COLUMN duploa_consultas_car.camadas IS
+'Manifesto das camadas GeoJSON (poucos KB). Estrutura: {
+  "area_do_imovel": {
+    "url": "/api/consultas/<id>/camadas/area_do_imovel",
+    "etag": "\"3f2a...\"", "feicoes": 1, "bytes": 10342,
+    "bbox": [-43.44, -8.51, -43.28, -8.38],
+    "variantes": {
+      "br": {"objeto": "sha256/3f/3f2a....geojson.br", "bytes": 2410},
+      "gzip": {"objeto": "sha256/3f/3f2a....geojson.gz", "bytes": 3120}
+    }
+  },
+  ...
+}';
+
+-- O índice GIN sobre o GeoJSON completo só encarecia as gravações
+DROP INDEX IF EXISTS idx_geojson_layers_gin;
+
+SELECT 'Migration completed: manifesto de camadas adicionado!' as status;
@@ -0,0 +1,46 @@
+-- Migration: Colunas tipadas com os números e datas do popup e do demonstrativo
+-- Os textos "15.647,5361 ha", "dd/mm/aaaa" e graus/minutos/segundos continuam
+-- em area_total e dados_demonstrativo; estas colunas guardam os valores já
+-- convertidos (hectares, DATE, graus decimais) pelo backend
+-- (app/normalizacao.py). Linhas existentes: python normalizar_consultas.py
+
+ALTER TABLE duploa_consultas_car
+ADD COLUMN IF NOT EXISTS area_total_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS area_imovel_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS modulos_fiscais NUMERIC(10, 4),
+ADD COLUMN IF NOT EXISTS uf CHAR(2),
+ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION,
+ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION,
+ADD COLUMN IF NOT EXISTS data_inscricao DATE,
+ADD COLUMN IF NOT EXISTS data_ultima_retificacao DATE,
+ADD COLUMN IF NOT EXISTS area_vegetacao_nativa_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS area_rural_consolidada_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS area_servidao_administrativa_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS area_reserva_legal_averbada_art30_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS area_reserva_legal_averbada_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS area_reserva_legal_aprovada_nao_averbada_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS area_reserva_legal_proposta_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS total_reserva_legal_declarada_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS app_total_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS app_area_rural_consolidada_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS app_area_vegetacao_nativa_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS area_uso_restrito_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS passivo_excedente_reserva_legal_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS area_reserva_legal_recompor_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS area_app_recompor_ha NUMERIC(14, 4),
+ADD COLUMN IF NOT EXISTS area_uso_restrito_recompor_ha NUMERIC(14, 4);
+
+-- Filtros por faixa mais comuns; somas das demais áreas leem as colunas numéricas
+-- direto, sem converter texto do JSONB
+CREATE INDEX IF NOT EXISTS idx_consultas_area_total_ha ON duploa_consultas_car(area_total_ha);
+CREATE INDEX IF NOT EXISTS idx_consultas_modulos_fiscais ON duploa_consultas_car(modulos_fiscais);
+CREATE INDEX IF NOT EXISTS idx_consultas_uf_area ON duploa_consultas_car(uf, area_total_ha);
+CREATE INDEX IF NOT EXISTS idx_consultas_data_retificacao ON duploa_consultas_car(data_ultima_retificacao);
+CREATE INDEX IF NOT EXISTS idx_consultas_cliente_area ON duploa_consultas_car(cliente_id, area_total_ha);
+
+COMMENT ON COLUMN duploa_consultas_car.area_total_ha IS
+'Área do popup (area_total) em hectares; sem ela, a área do imóvel do demonstrativo.';
+COMMENT ON COLUMN duploa_consultas_car.passivo_excedente_reserva_legal_ha IS
+'Com o sinal informado pelo portal em "Passivo / Excedente de Reserva Legal".';
+
+SELECT 'Migration completed: colunas tipadas criadas!' as status;
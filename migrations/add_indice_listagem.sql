@@ -0,0 +1,9 @@
+-- Migration: Índice da listagem de consultas por cliente (GET /api/consultas)
+-- A paginação por cursor filtra por cliente_id e percorre (created_at, id) em
+-- ordem decrescente; com este índice cada página é uma varredura curta,
+-- independente de quantas páginas vieram antes
+
+CREATE INDEX IF NOT EXISTS idx_consultas_cliente_keyset
+ON duploa_consultas_car(cliente_id, created_at DESC, id DESC);
+
+SELECT 'Migration completed: índice de listagem criado!' as status;
@@ -0,0 +1,142 @@
+-- Migration: Geometrias das camadas em PostGIS
+-- Cada feição das camadas do CAR vira uma linha com geometria (EPSG:4326, como
+-- o GeoJSON gerado do shapefile) e índice GiST. O caminho JSON (manifesto +
+-- objetos no Storage) não muda; esta tabela só responde perguntas espaciais.
+-- Gravação ativada com ENABLE_POSTGIS=true. Legado: python indexar_geometrias.py
+
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+-- Uma linha por feição; só a geometria mais recente de cada (numero_car, camada)
+CREATE TABLE IF NOT EXISTS duploa_feicoes_car (
+  id BIGSERIAL PRIMARY KEY,
+  numero_car TEXT NOT NULL,
+  consulta_id UUID REFERENCES duploa_consultas_car(id) ON DELETE SET NULL,
+  camada TEXT NOT NULL,
+  propriedades JSONB NOT NULL DEFAULT '{}'::jsonb,
+  geom geometry(Geometry, 4326) NOT NULL,
+  area_ha DOUBLE PRECISION,  -- Calculada na gravação sobre o elipsoide (NULL para pontos e linhas)
+  created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_feicoes_geom ON duploa_feicoes_car USING GIST (geom);
+CREATE INDEX IF NOT EXISTS idx_feicoes_car_camada ON duploa_feicoes_car (numero_car, camada);
+CREATE INDEX IF NOT EXISTS idx_feicoes_camada ON duploa_feicoes_car (camada);
+CREATE INDEX IF NOT EXISTS idx_feicoes_consulta ON duploa_feicoes_car (consulta_id);
+
+-- Substitui as feições de uma camada do imóvel a partir do FeatureCollection.
+-- O parse (ST_GeomFromGeoJSON) acontece no banco: o backend envia o GeoJSON
+-- uma vez por camada. Geometrias inválidas são corrigidas (ST_MakeValid) e a
+-- coordenada Z, se houver, descartada.
+CREATE OR REPLACE FUNCTION duploa_gravar_camada(
+  p_numero_car TEXT,
+  p_consulta_id UUID,
+  p_camada TEXT,
+  p_geojson JSONB
+)
+RETURNS INTEGER AS $$
+DECLARE
+  v_inseridas INTEGER;
+BEGIN
+  DELETE FROM duploa_feicoes_car WHERE numero_car = p_numero_car AND camada = p_camada;
+
+  INSERT INTO duploa_feicoes_car (numero_car, consulta_id, camada, propriedades, geom, area_ha)
+  SELECT
+    p_numero_car,
+    p_consulta_id,
+    p_camada,
+    COALESCE(f.feicao->'properties', '{}'::jsonb),
+    g.geom,
+    CASE WHEN ST_Dimension(g.geom) = 2
+      THEN ST_Area(ST_CollectionExtract(g.geom, 3)::geography) / 10000
+    END
+  FROM jsonb_array_elements(COALESCE(p_geojson->'features', '[]'::jsonb)) AS f(feicao)
+  CROSS JOIN LATERAL (
+    SELECT ST_MakeValid(ST_Force2D(ST_SetSRID(ST_GeomFromGeoJSON((f.feicao->'geometry')::text), 4326))) AS geom
+  ) g
+  WHERE jsonb_typeof(f.feicao->'geometry') = 'object';
+
+  GET DIAGNOSTICS v_inseridas = ROW_COUNT;
+  RETURN v_inseridas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Área por camada de um imóvel (hectares)
+CREATE OR REPLACE FUNCTION duploa_areas_imovel(p_numero_car TEXT)
+RETURNS TABLE (camada TEXT, feicoes BIGINT, area_ha DOUBLE PRECISION) AS $$
+  SELECT f.camada, COUNT(*), SUM(f.area_ha)
+  FROM duploa_feicoes_car f
+  WHERE f.numero_car = p_numero_car
+  GROUP BY f.camada
+  ORDER BY f.camada;
+$$ LANGUAGE sql STABLE;
+
+-- Imóveis com feições da camada na caixa [xmin, ymin, xmax, ymax] (graus);
+-- o operador && resolve pelo índice GiST, sem varrer a tabela
+CREATE OR REPLACE FUNCTION duploa_imoveis_na_bbox(
+  p_xmin DOUBLE PRECISION,
+  p_ymin DOUBLE PRECISION,
+  p_xmax DOUBLE PRECISION,
+  p_ymax DOUBLE PRECISION,
+  p_camada TEXT DEFAULT 'area_do_imovel',
+  p_limite INTEGER DEFAULT 100
+)
+RETURNS TABLE (numero_car TEXT, consulta_id UUID, area_ha DOUBLE PRECISION, bbox DOUBLE PRECISION[]) AS $$
+  SELECT s.numero_car, s.consulta_id, s.area_ha,
+         ARRAY[ST_XMin(s.caixa), ST_YMin(s.caixa), ST_XMax(s.caixa), ST_YMax(s.caixa)]
+  FROM (
+    SELECT f.numero_car,
+           (ARRAY_AGG(f.consulta_id))[1] AS consulta_id,
+           SUM(f.area_ha) AS area_ha,
+           ST_Extent(f.geom) AS caixa
+    FROM duploa_feicoes_car f
+    WHERE f.camada = p_camada
+      AND f.geom && ST_MakeEnvelope(p_xmin, p_ymin, p_xmax, p_ymax, 4326)
+    GROUP BY f.numero_car
+    ORDER BY f.numero_car
+    LIMIT p_limite
+  ) s;
+$$ LANGUAGE sql STABLE;
+
+-- Área de interseção de cada imóvel/camada com uma geometria GeoJSON
+-- (embargo, unidade de conservação, terra indígena...), maiores primeiro
+CREATE OR REPLACE FUNCTION duploa_intersecao(
+  p_geometria JSONB,
+  p_camada TEXT DEFAULT NULL,
+  p_limite INTEGER DEFAULT 100
+)
+RETURNS TABLE (numero_car TEXT, camada TEXT, area_intersecao_ha DOUBLE PRECISION) AS $$
+  WITH alvo AS (
+    SELECT ST_MakeValid(ST_Force2D(ST_SetSRID(ST_GeomFromGeoJSON(p_geometria::text), 4326))) AS geom
+  )
+  SELECT f.numero_car, f.camada,
+         SUM(ST_Area(ST_CollectionExtract(ST_Intersection(f.geom, alvo.geom), 3)::geography)) / 10000
+  FROM duploa_feicoes_car f, alvo
+  WHERE (p_camada IS NULL OR f.camada = p_camada)
+    AND ST_Intersects(f.geom, alvo.geom)
+  GROUP BY f.numero_car, f.camada
+  ORDER BY 3 DESC, 1, 2
+  LIMIT p_limite;
+$$ LANGUAGE sql STABLE;
+
+-- Outros imóveis cuja área se sobrepõe à do imóvel (divisas que só se tocam ficam de fora)
+CREATE OR REPLACE FUNCTION duploa_sobreposicoes_imovel(p_numero_car TEXT, p_limite INTEGER DEFAULT 100)
+RETURNS TABLE (numero_car TEXT, area_sobreposta_ha DOUBLE PRECISION) AS $$
+  SELECT o.numero_car,
+         SUM(ST_Area(ST_CollectionExtract(ST_Intersection(o.geom, i.geom), 3)::geography)) / 10000 AS sobreposta
+  FROM duploa_feicoes_car i
+  JOIN duploa_feicoes_car o
+    ON o.camada = 'area_do_imovel'
+   AND o.numero_car <> i.numero_car
+   AND ST_Intersects(o.geom, i.geom)
+  WHERE i.numero_car = p_numero_car AND i.camada = 'area_do_imovel'
+  GROUP BY o.numero_car
+  HAVING SUM(ST_Area(ST_CollectionExtract(ST_Intersection(o.geom, i.geom), 3)::geography)) > 0
+  ORDER BY 2 DESC, 1
+  LIMIT p_limite;
+$$ LANGUAGE sql STABLE;
+
+COMMENT ON TABLE duploa_feicoes_car IS
+'Feições das camadas do CAR com geometria (EPSG:4326) e índice GiST, para consultas
+espaciais no banco. O GeoJSON servido pela API continua vindo do Storage (coluna camadas).';
+
+SELECT 'Migration completed: duploa_feicoes_car criada!' as status;
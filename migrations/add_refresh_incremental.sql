@@ -0,0 +1,19 @@
+-- Migration: Suporte ao modo refresh incremental
+-- Consultas em modo "refresh" reaproveitam shapefile e GeoJSON da última consulta
+-- concluída quando situação do cadastro e data da última retificação não mudaram
+
+ALTER TABLE duploa_consultas_car
+ADD COLUMN IF NOT EXISTS shapefile_reaproveitado BOOLEAN DEFAULT FALSE;
+
+COMMENT ON COLUMN duploa_consultas_car.shapefile_reaproveitado IS
+'TRUE quando a consulta (modo refresh) não baixou shapefile novo porque o cadastro não foi retificado
+desde a última consulta concluída; shapefile_url e geojson_layers foram copiados dela.';
+
+-- Index para buscar a última consulta concluída de um CAR pelo mesmo cliente
+CREATE INDEX IF NOT EXISTS idx_duploa_consultas_car_refresh
+ON duploa_consultas_car(numero_car, status, consulta_concluida_em DESC);
+
+CREATE INDEX IF NOT EXISTS idx_duploa_consultas_car_refresh_cliente
+ON duploa_consultas_car(cliente_id, numero_car, status, consulta_concluida_em DESC);
+
+SELECT 'Migration completed: refresh incremental habilitado!' as status;
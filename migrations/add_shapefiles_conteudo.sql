@@ -0,0 +1,21 @@
+-- Migration: Shapefiles endereçados por conteúdo (SHA-256)
+-- Cada ZIP é armazenado uma única vez em car-shapefiles/sha256/<xx>/<hash>.zip;
+-- consultas guardam a referência em shapefile_sha256
+
+CREATE TABLE IF NOT EXISTS duploa_shapefiles (
+  sha256 TEXT PRIMARY KEY,
+  storage_path TEXT NOT NULL,
+  tamanho BIGINT NOT NULL,
+  created_at TIMESTAMP DEFAULT NOW()
+);
+
+ALTER TABLE duploa_consultas_car
+ADD COLUMN IF NOT EXISTS shapefile_sha256 TEXT REFERENCES duploa_shapefiles(sha256);
+
+CREATE INDEX IF NOT EXISTS idx_consultas_shapefile_sha256 ON duploa_consultas_car(shapefile_sha256);
+
+COMMENT ON COLUMN duploa_consultas_car.shapefile_sha256 IS
+'Hash do ZIP em duploa_shapefiles. Consultas com o mesmo conteúdo (outro cliente, refresh)
+compartilham o mesmo objeto no Storage. Linhas antigas mantêm apenas shapefile_url.';
+
+SELECT 'Migration completed: duploa_shapefiles criada!' as status;
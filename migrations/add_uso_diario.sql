@@ -0,0 +1,31 @@
+-- Migration: Contadores diários de consultas por cliente
+-- Usados pela cota MAX_CONSULTAS_POR_DIA (ENABLE_RATE_LIMIT=true)
+
+CREATE TABLE IF NOT EXISTS duploa_uso_diario (
+  cliente_id UUID NOT NULL,
+  dia DATE NOT NULL,
+  consultas INTEGER NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT NOW(),
+  PRIMARY KEY (cliente_id, dia)
+);
+
+-- Incremento atômico (várias réplicas do backend consomem a mesma cota)
+CREATE OR REPLACE FUNCTION incrementar_uso_diario(p_cliente_id UUID, p_dia DATE)
+RETURNS INTEGER AS $$
+  INSERT INTO duploa_uso_diario (cliente_id, dia, consultas)
+  VALUES (p_cliente_id, p_dia, 1)
+  ON CONFLICT (cliente_id, dia)
+  DO UPDATE SET consultas = duploa_uso_diario.consultas + 1, updated_at = NOW()
+  RETURNING consultas;
+$$ LANGUAGE sql;
+
+-- Devolução de consultas que falharam (só consultas concluídas contam)
+CREATE OR REPLACE FUNCTION devolver_uso_diario(p_cliente_id UUID, p_dia DATE)
+RETURNS INTEGER AS $$
+  UPDATE duploa_uso_diario
+  SET consultas = GREATEST(consultas - 1, 0), updated_at = NOW()
+  WHERE cliente_id = p_cliente_id AND dia = p_dia
+  RETURNING consultas;
+$$ LANGUAGE sql;
+
+SELECT 'Migration completed: duploa_uso_diario criada!' as status;
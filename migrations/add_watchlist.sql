@@ -0,0 +1,37 @@
+-- Migration: Watchlist de CARs monitorados
+-- O agendador do backend (ENABLE_SCHEDULER=true) re-verifica os itens vencidos
+-- em modo refresh dentro da janela fora de pico; resultados vão para duploa_consultas_car
+
+CREATE TABLE IF NOT EXISTS duploa_watchlist_car (
+  id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+  cliente_id UUID NOT NULL,
+  numero_car TEXT NOT NULL,
+
+  -- Agendamento
+  ativo BOOLEAN DEFAULT TRUE,
+  intervalo_horas INTEGER DEFAULT 168, -- 1 semana
+  proxima_verificacao TIMESTAMPTZ DEFAULT NOW(),
+
+  -- Resultado da última verificação
+  ultima_verificacao TIMESTAMPTZ,
+  ultimo_status TEXT CHECK (ultimo_status IN ('sem_alteracao', 'atualizado', 'pendente_captcha', 'erro')),
+  ultima_consulta_id UUID REFERENCES duploa_consultas_car(id) ON DELETE SET NULL,
+  falhas_consecutivas INTEGER DEFAULT 0,
+
+  -- Metadados
+  created_at TIMESTAMP DEFAULT NOW(),
+  updated_at TIMESTAMP DEFAULT NOW(),
+
+  UNIQUE (cliente_id, numero_car)
+);
+
+-- Index parcial para o tick do agendador (itens ativos vencidos)
+CREATE INDEX IF NOT EXISTS idx_duploa_watchlist_car_vencidos
+ON duploa_watchlist_car(proxima_verificacao) WHERE ativo;
+
+CREATE INDEX IF NOT EXISTS idx_duploa_watchlist_car_cliente ON duploa_watchlist_car(cliente_id);
+
+CREATE TRIGGER update_duploa_watchlist_car_updated_at BEFORE UPDATE ON duploa_watchlist_car
+FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+SELECT 'Migration completed: duploa_watchlist_car criada!' as status;
@@ -0,0 +1,78 @@
+"""
+Preenche as colunas tipadas (hectares, datas, UF) das consultas existentes
+Lê area_total e dados_demonstrativo em páginas (keyset em created_at + id),
+converte com app/normalizacao.py e grava em lotes (um upsert por página).
+Pode ser executado de novo sem efeito colateral
+
+Uso (depois de migrations/add_colunas_tipadas.sql):
+    python normalizar_consultas.py [--limite 100000] [--lote 200]
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import argparse
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+from app.escrita import EscritorAgrupado
+from app.leitura import filtro_apos_cursor
+from app.normalizacao import normalizar_dados
+from app.repositorio import RepositorioSupabase
+
+load_dotenv()
+
+
+async def normalizar(limite: int, lote: int):
+    repositorio = RepositorioSupabase(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
+    escritor = EscritorAgrupado(repositorio, "duploa_consultas_car", max_lote=lote)
+    processadas = 0
+    com_area = 0
+    apos = None
+
+    try:
+        while processadas < limite:
+            consulta = repositorio.table("duploa_consultas_car").select(
+                "id, cliente_id, numero_car, area_total, dados_demonstrativo, created_at"
+            )
+            if apos:
+                consulta = consulta.or_(filtro_apos_cursor(*apos))
+            pagina = await consulta.order("created_at", desc=True).order("id", desc=True).limit(
+                min(lote, limite - processadas)
+            ).execute()
+            if not pagina.data:
+                break
+
+            for linha in pagina.data:
+                colunas = normalizar_dados(linha.get("area_total"), linha.get("dados_demonstrativo"))
+                # cliente_id e numero_car: o upsert precisa das colunas obrigatórias
+                escritor.alterar(linha["id"], {
+                    "cliente_id": linha["cliente_id"],
+                    "numero_car": linha["numero_car"],
+                    **colunas
+                })
+                com_area += colunas["area_total_ha"] is not None
+            await escritor.descarregar_tudo()
+
+            processadas += len(pagina.data)
+            ultima = pagina.data[-1]
+            apos = (ultima["created_at"], ultima["id"])
+            print(f"[OK] {processadas} consultas normalizadas")
+    finally:
+        await escritor.descarregar_tudo()
+        await repositorio.fechar()
+
+    print(f"\n[INFO] {processadas} consultas, {com_area} com área convertida")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preenche as colunas tipadas das consultas existentes")
+    parser.add_argument("--limite", type=int, default=100000)
+    parser.add_argument("--lote", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(normalizar(args.limite, args.lote))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,11 @@ Baixa o shapefile do Storage e processa localmente
 import sys
 sys.path.insert(0, 'backend')
 
+from app.armazenamento import ArmazemCamadas, StorageSupabase
+from app.repositorio import RepositorioSupabase
 from app.shapefile_processor import processar_shapefile_car
 from supabase import create_client
+import asyncio
 import os
 from dotenv import load_dotenv
 import requests
@@ -25,7 +28,7 @@ CONSULTA_ID = "b2b17225-42ec-45b4-9cba-caf9f181d8b7"
 print(f"[*] Reprocessando consulta: {CONSULTA_ID}")
 
 # Buscar consulta
-consulta = supabase.table("duploa_consultas_car").select("*").eq("id", CONSULTA_ID).single().execute()
+consulta = supabase.table("duploa_consultas_car").select("id, shapefile_url").eq("id", CONSULTA_ID).single().execute()
 
 if not consulta.data:
     print("[ERROR] Consulta não encontrada!")
@@ -38,6 +41,16 @@ if not shapefile_url:
 
 print(f"[*] Shapefile URL: {shapefile_url}")
 
+
+async def armazenar_camadas(geojson_layers):
+    """Envia as camadas para o bucket car-camadas e retorna o manifesto"""
+    repositorio = RepositorioSupabase(SUPABASE_URL, SUPABASE_KEY)
+    try:
+        return await ArmazemCamadas(StorageSupabase(repositorio)).armazenar(CONSULTA_ID, geojson_layers)
+    finally:
+        await repositorio.fechar()
+
+
 # Baixar shapefile
 print("[*] Baixando shapefile...")
 response = requests.get(shapefile_url)
@@ -58,10 +71,14 @@ try:
         features = geojson.get("features", [])
         print(f"  - {layer_name}: {len(features)} features")
 
-    # Atualizar no banco
+    # Camadas no Storage, manifesto no banco
+    print("[*] Enviando camadas para o Storage...")
+    manifesto = asyncio.run(armazenar_camadas(geojson_layers))
+
     print("[*] Atualizando banco de dados...")
     supabase.table("duploa_consultas_car").update({
-        "geojson_layers": geojson_layers
+        "camadas": manifesto,
+        "geojson_layers": None
     }).eq("id", CONSULTA_ID).execute()
 
     print("[OK] Consulta atualizada com sucesso!")
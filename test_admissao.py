@@ -0,0 +1,243 @@
+"""
+Testes do controle de admissão (slots de navegador + fila FIFO)
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+
+from app.admissao import ControleAdmissao, ConsultaPreemptada, parse_pesos_clientes
+
+
+def test_fila_fifo_respeita_limite_de_navegadores():
+    """Nunca passa de max_navegadores e libera na ordem de chegada"""
+
+    async def cenario():
+        controle = ControleAdmissao(max_navegadores=2, ler_memoria=lambda: None)
+        ordem_inicio = []
+        simultaneos = []
+        posicoes = {}
+
+        async def consulta(nome):
+            async def ao_enfileirar(posicao, espera):
+                posicoes.setdefault(nome, []).append(posicao)
+
+            async with controle.slot(ao_enfileirar=ao_enfileirar):
+                ordem_inicio.append(nome)
+                simultaneos.append(controle.ativos)
+                await asyncio.sleep(0.01)
+
+        tarefas = []
+        for nome in ["a", "b", "c", "d", "e"]:
+            tarefas.append(asyncio.create_task(consulta(nome)))
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*tarefas)
+        return controle, ordem_inicio, simultaneos, posicoes
+
+    controle, ordem_inicio, simultaneos, posicoes = asyncio.run(cenario())
+
+    assert ordem_inicio == ["a", "b", "c", "d", "e"]
+    assert max(simultaneos) == 2
+    assert controle.ativos == 0 and controle.tamanho_fila == 0
+    # "e" chegou em 3º na fila e avançou até a 1ª posição
+    assert posicoes["e"] == [3, 2, 1]
+    assert "a" not in posicoes
+
+
+def test_memoria_insuficiente_segura_a_fila():
+    """Sem folga de memória só um navegador roda, mesmo com slots livres"""
+
+    async def cenario():
+        memoria = [300.0]
+        controle = ControleAdmissao(
+            max_navegadores=3,
+            memoria_minima_livre_mb=256,
+            memoria_por_navegador_mb=400,
+            ler_memoria=lambda: memoria[0],
+            intervalo_reavaliacao=0.01
+        )
+        liberar = asyncio.Event()
+        picos = []
+
+        async def consulta():
+            async with controle.slot():
+                picos.append(controle.ativos)
+                await liberar.wait()
+
+        tarefas = [asyncio.create_task(consulta()) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        bloqueado = (controle.ativos, controle.tamanho_fila)
+
+        memoria[0] = 2000.0  # memória liberada
+        await asyncio.sleep(0.05)
+        liberado = controle.ativos
+
+        liberar.set()
+        await asyncio.gather(*tarefas)
+        return bloqueado, liberado
+
+    bloqueado, liberado = asyncio.run(cenario())
+
+    assert bloqueado == (1, 2)
+    assert liberado == 3
+
+
+def test_cancelamento_na_fila_remove_pedido():
+    """Cliente que desiste enquanto aguarda não ocupa posição nem slot"""
+
+    async def cenario():
+        controle = ControleAdmissao(max_navegadores=1, ler_memoria=lambda: None)
+        liberar = asyncio.Event()
+
+        async def consulta():
+            async with controle.slot():
+                await liberar.wait()
+
+        primeira = asyncio.create_task(consulta())
+        await asyncio.sleep(0)
+        segunda = asyncio.create_task(consulta())
+        await asyncio.sleep(0)
+        fila_antes = controle.tamanho_fila
+
+        segunda.cancel()
+        await asyncio.sleep(0)
+        fila_depois = controle.tamanho_fila
+
+        liberar.set()
+        await primeira
+        return fila_antes, fila_depois, controle.ativos
+
+    assert asyncio.run(cenario()) == (1, 0, 0)
+
+
+def test_fila_justa_entre_clientes():
+    """Cliente com poucos pedidos não espera a importação em massa de outro"""
+
+    async def cenario():
+        controle = ControleAdmissao(max_navegadores=1, ler_memoria=lambda: None)
+        ordem_inicio = []
+        liberar = asyncio.Event()
+
+        async def consulta(cliente_id, nome):
+            async with controle.slot(cliente_id=cliente_id):
+                ordem_inicio.append(nome)
+                await liberar.wait()
+
+        tarefas = []
+        for i in range(4):
+            tarefas.append(asyncio.create_task(consulta("bulk", f"bulk{i}")))
+            await asyncio.sleep(0)
+        tarefas.append(asyncio.create_task(consulta("interativo", "int0")))
+        await asyncio.sleep(0)
+
+        liberar.set()
+        await asyncio.gather(*tarefas)
+        return ordem_inicio
+
+    assert asyncio.run(cenario()) == ["bulk0", "int0", "bulk1", "bulk2", "bulk3"]
+
+
+def test_pesos_clientes():
+    """Cliente com peso 2 recebe o dobro de slots do cliente com peso 1"""
+
+    async def cenario():
+        controle = ControleAdmissao(
+            max_navegadores=1,
+            ler_memoria=lambda: None,
+            pesos_clientes=parse_pesos_clientes("premium:2, invalido:x")
+        )
+        ordem_inicio = []
+        bloqueio = asyncio.Event()
+
+        async def consulta(cliente_id):
+            async with controle.slot(cliente_id=cliente_id):
+                ordem_inicio.append(cliente_id)
+                await bloqueio.wait()
+
+        ocupante = asyncio.create_task(consulta("ocupante"))
+        await asyncio.sleep(0)
+        tarefas = []
+        for _ in range(4):
+            tarefas.append(asyncio.create_task(consulta("premium")))
+            tarefas.append(asyncio.create_task(consulta("basico")))
+        await asyncio.sleep(0)
+
+        bloqueio.set()
+        await asyncio.gather(ocupante, *tarefas)
+        return ordem_inicio[1:7]
+
+    ordem = asyncio.run(cenario())
+    assert ordem.count("premium") == 4
+    assert ordem.count("basico") == 2
+
+
+def test_slots_reservados_para_interativas():
+    """Consultas bulk nunca ocupam os slots reservados"""
+
+    async def cenario():
+        controle = ControleAdmissao(max_navegadores=2, ler_memoria=lambda: None, slots_reservados_interativos=1)
+        liberar = asyncio.Event()
+        iniciadas = []
+
+        async def consulta(nome, prioridade):
+            async with controle.slot(prioridade=prioridade):
+                iniciadas.append(nome)
+                await liberar.wait()
+
+        tarefas = [asyncio.create_task(consulta(f"bulk{i}", "bulk")) for i in range(2)]
+        await asyncio.sleep(0)
+        so_bulk = list(iniciadas)
+
+        tarefas.append(asyncio.create_task(consulta("int0", "interativa")))
+        await asyncio.sleep(0)
+        com_interativa = list(iniciadas)
+
+        liberar.set()
+        await asyncio.gather(*tarefas)
+        return so_bulk, com_interativa, controle.metricas()["faixas"]
+
+    so_bulk, com_interativa, faixas = asyncio.run(cenario())
+
+    assert so_bulk == ["bulk0"]
+    assert com_interativa == ["bulk0", "int0"]
+    assert faixas["interativa"]["amostras"] == 1
+    assert faixas["bulk"]["amostras"] == 2
+
+
+def test_bulk_cede_navegador_no_limite_de_etapa():
+    """Só uma consulta bulk é preemptada por consulta interativa aguardando"""
+
+    async def cenario():
+        controle = ControleAdmissao(max_navegadores=2, ler_memoria=lambda: None)
+        etapa = asyncio.Event()
+        eventos = []
+
+        async def bulk(nome):
+            async with controle.slot(prioridade="bulk") as reserva:
+                await etapa.wait()
+                try:
+                    await reserva.checkpoint("extracao")
+                except ConsultaPreemptada:
+                    eventos.append(f"{nome} cedeu")
+                    return
+                eventos.append(f"{nome} continuou")
+
+        async def interativa():
+            async with controle.slot(prioridade="interativa"):
+                eventos.append("interativa iniciou")
+
+        tarefas = [asyncio.create_task(bulk("b0")), asyncio.create_task(bulk("b1"))]
+        await asyncio.sleep(0)
+        tarefas.append(asyncio.create_task(interativa()))
+        await asyncio.sleep(0)
+
+        etapa.set()
+        await asyncio.gather(*tarefas)
+        return eventos, controle.metricas()["preempcoes"]
+
+    eventos, preempcoes = asyncio.run(cenario())
+
+    assert eventos[:2] == ["b0 cedeu", "b1 continuou"]
+    assert "interativa iniciou" in eventos
+    assert preempcoes == 1
@@ -0,0 +1,246 @@
+"""
+Testes do armazenamento de shapefiles endereçado por conteúdo
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+import gzip
+import hashlib
+import json
+
+import brotli
+import pytest
+
+from app.armazenamento import ArmazemCamadas, ArmazemShapefiles, StorageLocal, StorageSupabase, caminho_conteudo
+from app.repositorio import ErroRepositorio
+
+
+class _RepositorioFalso:
+    """Tabela duploa_shapefiles em memória e Storage remoto programável"""
+
+    def __init__(self, erro_upload=None):
+        self.linhas = {}
+        self.uploads = 0
+        self.erro_upload = erro_upload
+        self.backoff_inicial = 0.001
+
+    def url_publica(self, bucket, caminho):
+        return f"https://x.supabase.co/storage/v1/object/public/{bucket}/{caminho}"
+
+    async def enviar_arquivo(self, bucket, caminho, conteudo, content_type="", upsert=True):
+        self.uploads += 1
+        if self.erro_upload:
+            raise self.erro_upload
+
+    def table(self, tabela):
+        repositorio = self
+
+        class _Consulta:
+            def select(self, colunas):
+                self.operacao = "select"
+                return self
+
+            def eq(self, coluna, valor):
+                self.sha256 = valor
+                return self
+
+            def limit(self, quantidade):
+                return self
+
+            def upsert(self, dados, on_conflict=None):
+                self.operacao = "upsert"
+                self.dados = dados
+                return self
+
+            async def execute(self):
+                class _Resposta:
+                    data = []
+                if self.operacao == "upsert":
+                    repositorio.linhas[self.dados["sha256"]] = self.dados
+                elif self.sha256 in repositorio.linhas:
+                    _Resposta.data = [repositorio.linhas[self.sha256]]
+                return _Resposta()
+
+        return _Consulta()
+
+
+class _RespostaHttp:
+    def __init__(self, headers, status_code=201):
+        self.headers = headers
+        self.status_code = status_code
+
+
+class _ServidorTus(_RepositorioFalso):
+    """Upload retomável: a 2ª parte cai no meio (metade dos bytes chega ao servidor)"""
+
+    def __init__(self):
+        super().__init__()
+        self.recebido = b""
+        self.falhas = 1
+        self.chamadas = []
+        self.location = "https://x.supabase.co/storage/v1/upload/resumable/abc"
+
+    async def requisicao(self, metodo, caminho, params=None, json=None, conteudo=None, cabecalhos=None, idempotente=True):
+        self.chamadas.append((metodo, cabecalhos.get("Upload-Offset")))
+        if metodo == "POST":
+            assert caminho == "/storage/v1/upload/resumable"
+            return _RespostaHttp({"location": self.location} if self.location else {})
+        if metodo == "HEAD":
+            return _RespostaHttp({"upload-offset": str(len(self.recebido))})
+
+        assert int(cabecalhos["Upload-Offset"]) == len(self.recebido)
+        if len(self.recebido) and self.falhas:
+            self.falhas -= 1
+            self.recebido += conteudo[:len(conteudo) // 2]
+            raise ErroRepositorio("PATCH: ReadTimeout")
+        self.recebido += conteudo
+        return _RespostaHttp({"upload-offset": str(len(self.recebido))})
+
+
+def _zip(tmp_path, nome, conteudo):
+    caminho = tmp_path / nome
+    caminho.write_bytes(conteudo)
+    return str(caminho)
+
+
+def test_mesmo_conteudo_enviado_uma_vez(tmp_path):
+    repositorio = _RepositorioFalso()
+    storage = StorageLocal(tmp_path / "storage", tamanho_parte=1000)
+    conteudo = b"PK\x03\x04" + b"shapefile" * 1000
+    sha256 = hashlib.sha256(conteudo).hexdigest()
+
+    async def cenario():
+        armazem = ArmazemShapefiles(repositorio, storage)
+        primeiro = await armazem.armazenar(_zip(tmp_path, "cliente_a.zip", conteudo))
+        segundo = await armazem.armazenar(_zip(tmp_path, "cliente_b.zip", conteudo))
+
+        # Outra réplica (sem cache em memória) também encontra pela tabela
+        terceiro = await ArmazemShapefiles(repositorio, storage).armazenar(_zip(tmp_path, "refresh.zip", conteudo))
+        return primeiro, segundo, terceiro, armazem.metricas()
+
+    primeiro, segundo, terceiro, metricas = asyncio.run(cenario())
+    objeto = tmp_path / "storage" / "car-shapefiles" / caminho_conteudo(sha256)
+    assert caminho_conteudo(sha256) == f"sha256/{sha256[:2]}/{sha256}.zip"
+    assert objeto.read_bytes() == conteudo
+    assert primeiro["enviado"] and not segundo["enviado"] and not terceiro["enviado"]
+    assert primeiro["url"] == segundo["url"] == terceiro["url"] == objeto.as_uri()
+    assert primeiro["sha256"] == sha256 and primeiro["tamanho"] == len(conteudo)
+    assert metricas["enviados"] == 1 and metricas["deduplicados"] == 1
+    assert metricas["bytes_economizados"] == len(conteudo)
+    assert metricas["partes_enviadas"] == 10  # 9004 bytes em partes de 1000
+
+
+def test_conteudo_diferente_gera_objetos_diferentes(tmp_path):
+    repositorio = _RepositorioFalso()
+
+    async def cenario():
+        armazem = ArmazemShapefiles(repositorio, StorageLocal(tmp_path / "storage"))
+        a = await armazem.armazenar(_zip(tmp_path, "a.zip", b"versao 1"))
+        b = await armazem.armazenar(_zip(tmp_path, "b.zip", b"versao 2"))
+        return a, b
+
+    a, b = asyncio.run(cenario())
+    assert a["sha256"] != b["sha256"]
+    assert a["enviado"] and b["enviado"] and len(repositorio.linhas) == 2
+
+
+def test_duplicate_do_storage_conta_como_armazenado(tmp_path):
+    repositorio = _RepositorioFalso(erro_upload=ErroRepositorio('HTTP 400 {"error":"Duplicate"}', status=400))
+
+    async def cenario():
+        return await ArmazemShapefiles(repositorio).armazenar(_zip(tmp_path, "a.zip", b"conteudo"))
+
+    referencia = asyncio.run(cenario())
+    assert not referencia["enviado"]
+    assert repositorio.uploads == 1
+    assert referencia["sha256"] in repositorio.linhas
+
+
+def test_upload_retomavel_continua_do_offset_confirmado(tmp_path):
+    servidor = _ServidorTus()
+    conteudo = bytes(range(256)) * 40  # 10240 bytes
+    storage = StorageSupabase(servidor, tamanho_parte=4096)
+
+    enviado = asyncio.run(storage.enviar("car-shapefiles", "sha256/ab/abc.zip", _zip(tmp_path, "a.zip", conteudo), "application/zip"))
+
+    assert enviado and servidor.recebido == conteudo
+    assert servidor.uploads == 0  # Maior que uma parte: nada de upload único
+    # Cria, 1ª parte, 2ª parte cai em 6144, HEAD, retoma de 6144 (não do zero)
+    assert servidor.chamadas == [
+        ("POST", None), ("PATCH", "0"), ("PATCH", "4096"), ("HEAD", None), ("PATCH", "6144")
+    ]
+    assert (storage.partes_enviadas, storage.retomadas) == (2, 1)
+
+
+def test_upload_retomavel_desiste_apos_max_retomadas(tmp_path):
+    servidor = _ServidorTus()
+    servidor.falhas = 10
+    storage = StorageSupabase(servidor, tamanho_parte=4096, max_retomadas=2)
+
+    with pytest.raises(ErroRepositorio):
+        asyncio.run(storage.enviar("b", "c.zip", _zip(tmp_path, "a.zip", b"x" * 10000), "application/zip"))
+
+
+def test_upload_retomavel_sem_location_falha_na_criacao(tmp_path):
+    servidor = _ServidorTus()
+    servidor.location = None  # Ex.: proxy removeu o cabeçalho
+    storage = StorageSupabase(servidor, tamanho_parte=4096)
+
+    with pytest.raises(ErroRepositorio, match="sem Location"):
+        asyncio.run(storage.enviar("b", "c.zip", _zip(tmp_path, "a.zip", b"x" * 10000), "application/zip"))
+    assert servidor.chamadas == [("POST", None)]
+
+
+def test_storage_local_retoma_arquivo_parcial(tmp_path):
+    conteudo = b"0123456789" * 100
+    storage = StorageLocal(tmp_path / "storage", tamanho_parte=100)
+    parcial = tmp_path / "storage" / "b" / "c.zip.parcial"
+    parcial.parent.mkdir(parents=True)
+    parcial.write_bytes(conteudo[:350])  # Envio anterior interrompido
+
+    assert asyncio.run(storage.enviar("b", "c.zip", _zip(tmp_path, "a.zip", conteudo), "application/zip"))
+    assert (tmp_path / "storage" / "b" / "c.zip").read_bytes() == conteudo
+    assert not parcial.exists()
+    assert (storage.partes_enviadas, storage.retomadas) == (7, 1)
+
+
+def test_storage_local_serializa_envios_do_mesmo_destino(tmp_path):
+    conteudo = b"0123456789" * 100
+    storage = StorageLocal(tmp_path / "storage", tamanho_parte=100)
+    parcial = tmp_path / "storage" / "b" / "c.zip.parcial"
+    parcial.parent.mkdir(parents=True)
+    parcial.write_bytes(conteudo[:350])
+    origem = _zip(tmp_path, "a.zip", conteudo)
+
+    async def cenario():
+        return await asyncio.gather(*(
+            storage.enviar("b", "c.zip", origem, "application/zip") for _ in range(4)
+        ))
+
+    # Só um envio retoma do offset e anexa; os outros encontram o objeto pronto
+    assert sorted(asyncio.run(cenario())) == [False, False, False, True]
+    assert (tmp_path / "storage" / "b" / "c.zip").read_bytes() == conteudo
+    assert (storage.partes_enviadas, storage.retomadas) == (7, 1)
+    assert storage._travas == {}
+
+
+def test_camadas_viram_objetos_compartilhados_entre_consultas(tmp_path):
+    with open("geojson_result.json", encoding="utf-8") as f:
+        geojson_layers = json.load(f)
+    storage = StorageLocal(tmp_path / "storage")
+    armazem = ArmazemCamadas(storage, bucket="car-camadas")
+
+    async def cenario():
+        primeira = await armazem.armazenar("consulta-1", geojson_layers)
+        refresh = await armazem.armazenar("consulta-2", geojson_layers)
+        area = refresh["area_do_imovel"]
+        return primeira, refresh, await armazem.ler(area), await armazem.ler(area, "br")
+
+    primeira, refresh, gz, br = asyncio.run(cenario())
+    objetos = list((tmp_path / "storage" / "car-camadas").rglob("*.geojson.*"))
+    # Uma variante gzip e uma brotli por camada; o refresh não grava nada novo
+    assert len(objetos) == 2 * len(geojson_layers) == storage.partes_enviadas
+    assert refresh["area_do_imovel"]["variantes"] == primeira["area_do_imovel"]["variantes"]
+    assert refresh["area_do_imovel"]["url"] == "/api/consultas/consulta-2/camadas/area_do_imovel"
+    assert json.loads(gzip.decompress(gz)) == json.loads(brotli.decompress(br)) == geojson_layers["area_do_imovel"]
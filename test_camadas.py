@@ -0,0 +1,120 @@
+"""
+Testes do manifesto de camadas da mensagem de conclusão
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import gzip
+import json
+
+import brotli
+
+from app.camadas import (
+    calcular_bbox,
+    compactar_camadas,
+    escolher_codificacao,
+    etag_conteudo,
+    etag_variante,
+    manifesto_para_consulta,
+    variantes_camada,
+    resumir_camadas,
+    resumir_resultados,
+    serializar_geojson
+)
+
+
+def _camada(*coordenadas):
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": [list(coordenadas)]}}
+        ]
+    }
+
+
+def test_bbox_percorre_qualquer_aninhamento():
+    camada = _camada([-43.4, -8.5], [-43.2, -8.3], [-43.3, -8.6])
+    assert calcular_bbox(camada) == [-43.4, -8.6, -43.2, -8.3]
+    assert calcular_bbox({"type": "FeatureCollection", "features": []}) is None
+
+
+def test_etag_estavel_independente_da_ordem_das_chaves():
+    a = {"type": "FeatureCollection", "features": [], "name": "x"}
+    b = {"name": "x", "features": [], "type": "FeatureCollection"}
+    assert etag_conteudo(serializar_geojson(a)) == etag_conteudo(serializar_geojson(b))
+    assert etag_conteudo(b"a").startswith('"')
+
+
+def test_manifesto_do_resultado_real_e_compacto():
+    with open("geojson_result.json", encoding="utf-8") as f:
+        geojson_layers = json.load(f)
+
+    camadas = resumir_camadas("uuid-1", geojson_layers)
+    assert set(camadas) == set(geojson_layers)
+    area = camadas["area_do_imovel"]
+    assert area["url"] == "/api/consultas/uuid-1/camadas/area_do_imovel"
+    assert area["feicoes"] == len(geojson_layers["area_do_imovel"]["features"])
+
+    tamanho_manifesto = len(json.dumps(camadas))
+    assert tamanho_manifesto < sum(c["bytes"] for c in camadas.values())
+
+
+def test_camadas_compactadas_sao_deterministicas():
+    with open("geojson_result.json", encoding="utf-8") as f:
+        geojson_layers = json.load(f)
+
+    manifesto, artefatos = compactar_camadas("uuid-1", geojson_layers)
+    _, de_novo = compactar_camadas("uuid-2", geojson_layers)
+    assert artefatos == de_novo  # Mesmo GeoJSON, mesmos objetos (gzip sem mtime)
+
+    area = manifesto["area_do_imovel"]
+    original = serializar_geojson(geojson_layers["area_do_imovel"])
+    gz, br = area["variantes"]["gzip"], area["variantes"]["br"]
+    assert gz["objeto"].startswith("sha256/") and gz["objeto"].endswith(".geojson.gz")
+    assert br["objeto"] == gz["objeto"][:-2] + "br"
+    assert gzip.decompress(artefatos[gz["objeto"]]) == original
+    assert brotli.decompress(artefatos[br["objeto"]]) == original
+    assert br["bytes"] < gz["bytes"] < area["bytes"]
+    # Mesmos campos e ETag do manifesto da mensagem de conclusão
+    assert {k: v for k, v in area.items() if k != "variantes"} == \
+        resumir_camadas("uuid-1", geojson_layers)["area_do_imovel"]
+
+
+def test_negociacao_de_codificacao():
+    ambas = ("br", "gzip")
+    assert escolher_codificacao("gzip, deflate, br", ambas) == "br"
+    assert escolher_codificacao("gzip", ambas) == "gzip"
+    assert escolher_codificacao("br;q=0.5, gzip;q=0.8", ambas) == "gzip"
+    assert escolher_codificacao("br;q=0, *", ambas) == "gzip"
+    assert escolher_codificacao("br", ("gzip",)) is None
+    assert escolher_codificacao(None, ambas) is None
+    assert escolher_codificacao("identity", ambas) is None
+
+    # Cada representação tem seu ETag forte
+    assert etag_variante('"abc"', "br") == '"abc-br"'
+    assert etag_variante('"abc"', None) == '"abc"'
+
+    # Manifestos gravados só com gzip
+    assert variantes_camada({"objeto": "x.gz", "bytes_gzip": 10}) == {"gzip": {"objeto": "x.gz", "bytes": 10}}
+
+
+def test_manifesto_reaproveitado_aponta_para_a_nova_consulta():
+    manifesto, _ = compactar_camadas("anterior", {"app": _camada([0, 0], [1, 1])})
+    novo = manifesto_para_consulta(manifesto, "nova")
+    assert novo["app"]["url"] == "/api/consultas/nova/camadas/app"
+    assert novo["app"]["variantes"] == manifesto["app"]["variantes"]
+    assert manifesto["app"]["url"] == "/api/consultas/anterior/camadas/app"
+
+
+def test_resumo_usa_campos_do_demonstrativo():
+    resumo = resumir_resultados({
+        "dados_demonstrativo": {
+            "situacao_cadastro": "AT",
+            "dados_imovel_rural": {"area_imovel_rural": "15.647,5361 ha", "municipio_uf": "Canto do Buriti / PI"}
+        },
+        "geojson_layers": {"area_do_imovel": {}},
+        "shapefile_size": 1234
+    })
+    assert resumo["situacao_cadastro"] == "AT"
+    assert resumo["area_imovel_rural"] == "15.647,5361 ha"
+    assert (resumo["camadas"], resumo["shapefile_size"]) == (1, 1234)
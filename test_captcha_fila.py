@@ -0,0 +1,104 @@
+"""
+Testes da fila compartilhada de CAPTCHAs
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+
+import pytest
+
+from app.captcha_fila import FilaCaptcha, CaptchaExpirado, parse_tokens_operadores
+
+
+def test_parse_tokens_operadores():
+    assert parse_tokens_operadores("ana:tok1, bruno:tok2,invalido") == {"tok1": "ana", "tok2": "bruno"}
+    assert parse_tokens_operadores("") == {}
+
+
+def test_operador_resolve_captcha_publicado():
+    async def cenario():
+        fila = FilaCaptcha()
+        fila.conectar_operador("ana")
+
+        tarefa = asyncio.create_task(fila.resolver(b"png", "MS-1", "cliente-a", timeout=5))
+        await asyncio.sleep(0)
+
+        itens = await fila.puxar("ana", limite=5, espera=1)
+        assert [i.numero_car for i in itens] == ["MS-1"]
+        assert fila.responder(itens[0].id, "ana", "ABC123")
+
+        assert await tarefa == "ABC123"
+        # Segunda resposta para o mesmo item é descartada
+        assert not fila.responder(itens[0].id, "bruno", "XYZ")
+        assert fila.pendentes == 0
+
+        fila.registrar_resultado(itens[0].id, True)
+        stats = fila.estatisticas()["operadores"]["ana"]
+        assert stats["respondidos"] == 1
+        assert stats["precisao"] == 1.0
+
+    asyncio.run(cenario())
+
+
+def test_item_nao_respondido_volta_para_fila():
+    async def cenario():
+        fila = FilaCaptcha(prazo_operador=0.05)
+        item = fila.publicar(b"png", "MS-1")
+
+        lote_ana = await fila.puxar("ana", espera=0)
+        assert [i.id for i in lote_ana] == [item.id]
+        # Enquanto está com a ana, não é entregue a outro operador
+        assert await fila.puxar("bruno", espera=0) == []
+
+        await asyncio.sleep(0.1)
+        lote_bruno = await fila.puxar("bruno", espera=0)
+        assert [i.id for i in lote_bruno] == [item.id]
+        assert item.emissoes == 2
+
+        assert fila.responder(item.id, "bruno", "ABC123")
+        assert await fila.aguardar(item) == "ABC123"
+        assert fila.estatisticas()["operadores"]["ana"]["reemitidos"] == 1
+
+    asyncio.run(cenario())
+
+
+def test_desconexao_devolve_itens_do_operador():
+    async def cenario():
+        fila = FilaCaptcha()
+        fila.conectar_operador("ana")
+        item = fila.publicar(b"png", "MS-1")
+
+        assert await fila.puxar("ana", espera=0)
+        fila.desconectar_operador("ana")
+        assert fila.operadores_online == 0
+        assert [i.id for i in await fila.puxar("bruno", espera=0)] == [item.id]
+
+    asyncio.run(cenario())
+
+
+def test_captcha_expira_sem_resposta():
+    async def cenario():
+        fila = FilaCaptcha(validade=0.05)
+        with pytest.raises(CaptchaExpirado):
+            await fila.resolver(b"png", "MS-1")
+        assert fila.pendentes == 0
+        assert fila.estatisticas()["expirados"] == 1
+
+    asyncio.run(cenario())
+
+
+def test_resposta_errada_reduz_precisao():
+    async def cenario():
+        fila = FilaCaptcha()
+        for aceito in (True, False, False, True):
+            item = fila.publicar(b"png", "MS-1")
+            await fila.puxar("ana", espera=0)
+            fila.responder(item.id, "ana", "ABC")
+            await fila.aguardar(item)
+            fila.registrar_resultado(item.id, aceito)
+
+        stats = fila.estatisticas()["operadores"]["ana"]
+        assert (stats["acertos"], stats["erros"], stats["precisao"]) == (2, 2, 0.5)
+
+    asyncio.run(cenario())
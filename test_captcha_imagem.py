@@ -0,0 +1,49 @@
+"""
+Testes do frame binário e das métricas de retentativa do CAPTCHA
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import base64
+import random
+
+from app.captcha_imagem import (
+    MetricasCaptcha,
+    VARIANTE_ORIGINAL,
+    VARIANTE_PREPROCESSADA,
+    desempacotar_frame,
+    empacotar_frame
+)
+
+
+def test_frame_binario_ida_e_volta():
+    imagem = bytes(range(256)) * 20
+    cabecalho = {"type": "captcha_required", "captcha_id": "abc", "mime": "image/png", "tamanho": len(imagem)}
+
+    frame = empacotar_frame(cabecalho, imagem)
+    assert desempacotar_frame(frame) == (cabecalho, imagem)
+
+    # Menor que a mesma imagem em base64 dentro de JSON
+    assert len(frame) < len(base64.b64encode(imagem))
+
+
+def test_taxa_de_retentativa_por_variante():
+    metricas = MetricasCaptcha(fracao_preprocessada=1.0)
+    for aceito in (True, True, True, False):
+        metricas.registrar_envio(VARIANTE_PREPROCESSADA, 1000)
+        metricas.registrar_resultado(VARIANTE_PREPROCESSADA, aceito)
+    metricas.registrar_envio(VARIANTE_ORIGINAL, 3000)
+    metricas.registrar_resultado(VARIANTE_ORIGINAL, False)
+
+    variantes = metricas.estatisticas()["variantes"]
+    assert variantes[VARIANTE_PREPROCESSADA]["taxa_retentativa"] == 0.25
+    assert variantes[VARIANTE_PREPROCESSADA]["bytes_medio"] == 1000
+    assert variantes[VARIANTE_ORIGINAL]["taxa_retentativa"] == 1.0
+
+
+def test_sorteio_respeita_fracao():
+    metricas = MetricasCaptcha(fracao_preprocessada=0.5, aleatorio=random.Random(1))
+    sorteios = [metricas.sortear_variante() for _ in range(1000)]
+    assert 400 < sorteios.count(VARIANTE_PREPROCESSADA) < 600
+
+    assert MetricasCaptcha(fracao_preprocessada=0.0).sortear_variante() == VARIANTE_ORIGINAL
@@ -0,0 +1,134 @@
+"""
+Testes do solucionador automático de CAPTCHA
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+import random
+
+from app import captcha_solver
+from app.captcha_solver import ModeloCaptcha, SolucionadorCaptcha, binarizar, segmentar
+
+
+FONTE = {
+    "A": ["01110", "10001", "10001", "11111", "10001", "10001", "10001"],
+    "B": ["11110", "10001", "11110", "10001", "10001", "10001", "11110"],
+    "C": ["01111", "10000", "10000", "10000", "10000", "10000", "01111"],
+    "7": ["11111", "00001", "00010", "00100", "01000", "01000", "01000"],
+    "3": ["11110", "00001", "00001", "01110", "00001", "00001", "11110"],
+}
+
+
+def gerar_captcha(texto, escala=3, ruido=0.0, semente=0):
+    """Imagem em tons de cinza: texto escuro (30) sobre fundo claro (220)"""
+    rng = random.Random(semente)
+    altura = 7 * escala + 8
+    largura = len(texto) * (5 * escala + 4) + 8
+    pixels = [[220] * largura for _ in range(altura)]
+    for i, caractere in enumerate(texto):
+        x0 = 4 + i * (5 * escala + 4)
+        y0 = 4 + rng.randint(-2, 2)
+        for y, linha in enumerate(FONTE[caractere]):
+            for x, bit in enumerate(linha):
+                if bit == "1":
+                    for dy in range(escala):
+                        for dx in range(escala):
+                            pixels[y0 + y * escala + dy][x0 + x * escala + dx] = 30
+    for linha in pixels:
+        for x in range(largura):
+            if rng.random() < ruido:
+                linha[x] = 30 if linha[x] > 128 else 220
+    return pixels
+
+
+def textos(n, semente=1):
+    rng = random.Random(semente)
+    return ["".join(rng.choice(list(FONTE)) for _ in range(4)) for _ in range(n)]
+
+
+def test_segmentacao_separa_caracteres_e_remove_ruido():
+    glifos = segmentar(binarizar(gerar_captcha("AB73", ruido=0.01, semente=3)), 4)
+    assert len(glifos) == 4
+
+
+def test_modelo_reconhece_captchas_novos():
+    treino = [(gerar_captcha(t, semente=i), t) for i, t in enumerate(textos(30))]
+    modelo = ModeloCaptcha.treinar(treino)
+    assert modelo.tamanho_texto == 4
+
+    validacao = textos(10, semente=99)
+    acertos = 0
+    for i, texto in enumerate(validacao):
+        previsto, confianca = modelo.prever(gerar_captcha(texto, ruido=0.005, semente=100 + i))
+        acertos += previsto == texto
+        assert 0.0 <= confianca <= 1.0
+    assert acertos >= 9
+
+
+def test_salvar_e_carregar_modelo(tmp_path):
+    modelo = ModeloCaptcha.treinar([(gerar_captcha(t, semente=i), t) for i, t in enumerate(textos(10))])
+    caminho = tmp_path / "modelo.json"
+    modelo.salvar(str(caminho))
+
+    carregado = ModeloCaptcha.carregar(str(caminho))
+    imagem = gerar_captcha("CAB7", semente=7)
+    assert carregado.prever(imagem) == modelo.prever(imagem)
+
+
+class _ModeloFixo:
+    def __init__(self, texto, confianca):
+        self.texto = texto
+        self.confianca = confianca
+
+    def prever(self, pixels):
+        return self.texto, self.confianca
+
+
+def _sem_decodificar(monkeypatch):
+    monkeypatch.setattr(captcha_solver, "carregar_pixels", lambda image_bytes: [[0]])
+
+
+def test_etapa_responde_acima_do_limiar_e_registra_precisao(monkeypatch, tmp_path):
+    _sem_decodificar(monkeypatch)
+    solucionador = SolucionadorCaptcha(_ModeloFixo("AB73", 0.9), limiar_confianca=0.5, pasta_amostras=str(tmp_path))
+
+    etapa = solucionador.etapa()
+    assert asyncio.run(etapa.tentar(b"png")) == "AB73"
+    etapa.confirmar("AB73", True)
+
+    stats = solucionador.estatisticas()
+    assert stats["automaticos"] == 1
+    assert stats["precisao_automatica"] == 1.0
+    assert [p.name.split("_")[0] for p in tmp_path.iterdir()] == ["AB73"]
+
+
+def test_etapa_encaminha_ao_humano_abaixo_do_limiar(monkeypatch):
+    _sem_decodificar(monkeypatch)
+    solucionador = SolucionadorCaptcha(_ModeloFixo("AB73", 0.2), limiar_confianca=0.5)
+
+    etapa = solucionador.etapa()
+    assert asyncio.run(etapa.tentar(b"png")) is None
+    # Humano digitou o mesmo texto que o modelo previu: conta na precisão sombra
+    etapa.confirmar("ab73", True)
+
+    stats = solucionador.estatisticas()
+    assert stats["encaminhados_humano"] == 1
+    assert stats["precisao_sombra"] == 1.0
+
+
+def test_etapa_desiste_apos_erro_automatico(monkeypatch):
+    _sem_decodificar(monkeypatch)
+    solucionador = SolucionadorCaptcha(_ModeloFixo("AB73", 0.9), limiar_confianca=0.5)
+
+    etapa = solucionador.etapa()
+    assert asyncio.run(etapa.tentar(b"png")) == "AB73"
+    etapa.confirmar("AB73", False)
+    assert asyncio.run(etapa.tentar(b"png")) is None
+    assert solucionador.estatisticas()["precisao_automatica"] == 0.0
+
+
+def test_sem_modelo_tudo_vai_para_humano(tmp_path):
+    solucionador = SolucionadorCaptcha.a_partir_de_arquivo(str(tmp_path / "inexistente.json"))
+    assert asyncio.run(solucionador.etapa().tentar(b"png")) is None
+    assert solucionador.estatisticas()["modelo_carregado"] is False
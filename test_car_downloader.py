@@ -0,0 +1,111 @@
+"""
+Testes do fluxo de CAPTCHA do download (navegador simulado, sem acessar o portal)
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("playwright")
+
+from app import car_downloader
+from app.captcha_fila import CaptchaExpirado
+
+
+class _Elemento:
+    """Locator que sempre encontra um elemento e aceita qualquer ação"""
+
+    @property
+    def first(self):
+        return self
+
+    async def count(self):
+        return 1
+
+    async def screenshot(self, **kwargs):
+        return b"png"
+
+    async def all(self):
+        return [self]
+
+    def __getattr__(self, nome):
+        async def acao(*args, **kwargs):
+            return None
+        return acao
+
+
+class _Pagina(_Elemento):
+    def locator(self, seletor):
+        return _Elemento()
+
+    def on(self, evento, callback):
+        pass
+
+
+class _Navegador:
+    async def new_context(self, **kwargs):
+        return self
+
+    async def new_page(self):
+        return _Pagina()
+
+    async def close(self):
+        pass
+
+
+class _Playwright:
+    class chromium:
+        @staticmethod
+        async def launch(**kwargs):
+            return _Navegador()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def navegador_simulado(monkeypatch):
+    async def popup(**kwargs):
+        return {"numero_car": "PI-1"}
+
+    async def demonstrativo(**kwargs):
+        return {}
+
+    dormir = asyncio.sleep
+    monkeypatch.setattr(car_downloader, "async_playwright", _Playwright)
+    monkeypatch.setattr(car_downloader, "tentar_abrir_popup_com_retry", popup)
+    monkeypatch.setattr(car_downloader, "tentar_extrair_demonstrativo_com_retry", demonstrativo)
+    monkeypatch.setattr(car_downloader.asyncio, "sleep", lambda *args: dormir(0))
+
+
+def test_captcha_expirado_interrompe_na_primeira_tentativa(navegador_simulado, tmp_path):
+    chamadas = []
+
+    async def resolver(image_bytes):
+        chamadas.append(image_bytes)
+        raise CaptchaExpirado("Timeout aguardando solução do CAPTCHA")
+
+    with pytest.raises(CaptchaExpirado):
+        asyncio.run(car_downloader.download_car_websocket("PI-1", str(tmp_path), resolver))
+
+    # Nem o próximo seletor nem as outras tentativas chamam o resolvedor de novo
+    assert chamadas == [b"png"]
+
+
+def test_falha_comum_do_resolvedor_ainda_tenta_de_novo(navegador_simulado, tmp_path):
+    chamadas = []
+
+    async def resolver(image_bytes):
+        chamadas.append(image_bytes)
+        raise RuntimeError("falha transitória")
+
+    with pytest.raises(Exception, match="CAPTCHA não resolvido"):
+        asyncio.run(car_downloader.download_car_websocket("PI-1", str(tmp_path), resolver))
+
+    # 3 seletores x 3 tentativas
+    assert len(chamadas) == 9
@@ -0,0 +1,60 @@
+"""
+Testes do codec negociado das mensagens WebSocket
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+from app.codec import CodecMensagens
+from app.sessoes import ConexaoWebSocket, Evento
+
+
+def test_json_padrao_envia_texto():
+    codec = CodecMensagens.negociar({})
+    dados = codec.codificar({"type": "queued", "inicio_estimado": datetime(2024, 1, 2, 3, 4, 5)})
+    assert isinstance(dados, str)
+    assert json.loads(dados)["inicio_estimado"].startswith("2024-01-02T03:04:05")
+
+
+def test_compressao_ida_e_volta_e_frames_pequenos_sem_zlib():
+    codec = CodecMensagens("json", compressao=True, minimo_compressao=100)
+    pequeno = codec.codificar({"type": "progress"})
+    grande_msg = {"type": "completed", "texto": "x" * 5000}
+    grande = codec.codificar(grande_msg)
+
+    assert pequeno[:1] == b"\x00" and grande[:1] == b"\x01"
+    assert len(grande) < 200
+    assert codec.decodificar(grande) == grande_msg
+    assert codec.decodificar('{"acao": "cancelar"}') == {"acao": "cancelar"}
+
+
+def test_codec_invalido_e_recusado():
+    with pytest.raises(ValueError):
+        CodecMensagens.negociar({"codec": "xml"})
+
+
+def test_msgpack_leva_imagem_como_bytes():
+    pytest.importorskip("msgpack")
+
+    class _WebSocketBinario:
+        def __init__(self):
+            self.frames = []
+
+        async def send_bytes(self, dados):
+            self.frames.append(dados)
+
+    async def cenario():
+        ws = _WebSocketBinario()
+        codec = CodecMensagens("msgpack")
+        conexao = ConexaoWebSocket(ws, captcha_binario=True, codec=codec)
+        conexao.enfileirar(Evento(1, {"type": "captcha_required", "captcha_id": "c1"}, imagem=b"\x89PNG"))
+        await conexao.esvaziar()
+        return codec.decodificar(ws.frames[0])
+
+    mensagem = asyncio.run(cenario())
+    assert (mensagem["image"], mensagem["seq"]) == (b"\x89PNG", 1)
@@ -0,0 +1,139 @@
+"""
+Testes da cota diária de consultas por cliente
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+
+import pytest
+
+from app.cota import CotaDiaria, CotaExcedida
+
+
+class _Resposta:
+    def __init__(self, data):
+        self.data = data
+
+
+class _SupabaseFalso:
+    """Simula duploa_uso_diario + rpcs incrementar_uso_diario/devolver_uso_diario"""
+
+    def __init__(self, uso_inicial=0):
+        self.uso = uso_inicial
+        self.rpcs = 0
+
+    def table(self, nome):
+        return self
+
+    def select(self, *args, **kwargs):
+        return self
+
+    def eq(self, *args):
+        return self
+
+    def limit(self, n):
+        return self
+
+    async def execute(self):
+        uso = self.uso
+        await asyncio.sleep(0)  # Cede o loop, como uma requisição real
+        return _Resposta([{"consultas": uso}] if uso else [])
+
+    def rpc(self, nome, params):
+        self.rpcs += 1
+        self.uso += 1 if nome == "incrementar_uso_diario" else -1
+        uso = self.uso
+
+        class _Chamada:
+            async def execute(_self):
+                return _Resposta(uso)
+
+        return _Chamada()
+
+
+def test_rejeita_acima_do_limite_diario():
+    """Depois de max_consultas_por_dia reservas, a próxima é rejeitada"""
+    supabase = _SupabaseFalso()
+    cota = CotaDiaria(supabase, limite_diario=3)
+
+    async def cenario():
+        assert [await cota.reservar("cliente-a") for _ in range(3)] == [2, 1, 0]
+
+        with pytest.raises(CotaExcedida):
+            await cota.reservar("cliente-a")
+
+    asyncio.run(cenario())
+
+    # Rejeição é decidida em memória, sem incrementar no Supabase
+    assert supabase.rpcs == 3
+
+
+def test_uso_persistido_e_carregado_do_supabase():
+    """Uso do dia já registrado (ex.: outra réplica) conta para a cota"""
+    cota = CotaDiaria(_SupabaseFalso(uso_inicial=9), limite_diario=10)
+
+    async def cenario():
+        assert await cota.restantes("cliente-a") == 1
+        assert await cota.reservar("cliente-a") == 0
+
+        with pytest.raises(CotaExcedida):
+            await cota.reservar("cliente-a")
+
+    asyncio.run(cenario())
+
+
+def test_reservas_simultaneas_nao_perdem_contagem():
+    """Reservas concorrentes do mesmo cliente na primeira carga do dia"""
+    cota = CotaDiaria(_SupabaseFalso(), limite_diario=2)
+
+    async def cenario():
+        return await asyncio.gather(
+            *(cota.reservar("cliente-a") for _ in range(3)),
+            return_exceptions=True
+        )
+
+    resultados = asyncio.run(cenario())
+    assert sum(isinstance(r, CotaExcedida) for r in resultados) == 1
+
+
+def test_consulta_que_falha_nao_conta_na_cota():
+    """Reserva devolvida deixa o uso do dia como estava"""
+    supabase = _SupabaseFalso(uso_inicial=1)
+    cota = CotaDiaria(supabase, limite_diario=2)
+
+    async def cenario():
+        dia = cota.dia
+        assert await cota.reservar("cliente-a") == 0
+        await cota.devolver("cliente-a", dia)
+        return await cota.restantes("cliente-a")
+
+    assert asyncio.run(cenario()) == 1
+    assert supabase.uso == 1
+
+
+def test_sessao_com_erro_devolve_a_cota(monkeypatch):
+    for modulo in ("fastapi", "playwright", "supabase"):
+        pytest.importorskip(modulo)
+    monkeypatch.setenv("SUPABASE_URL", "http://127.0.0.1:1")
+    monkeypatch.setenv("SUPABASE_SERVICE_KEY", "teste")
+    from app import main
+    from app.sessoes import SessaoConsulta
+
+    supabase = _SupabaseFalso(uso_inicial=1)
+    cota = CotaDiaria(supabase, limite_diario=5)
+    monkeypatch.setattr(main, "cota_diaria", cota)
+
+    async def executar_consulta(**kwargs):
+        raise RuntimeError("Portal do CAR indisponível")
+
+    monkeypatch.setattr(main, "executar_consulta", executar_consulta)
+
+    async def cenario():
+        dia = cota.dia
+        await cota.reservar("cliente-a")
+        await main._executar_sessao(SessaoConsulta("PI-1", "cliente-a"), "completo", "interativa", dia)
+        return await cota.restantes("cliente-a")
+
+    assert asyncio.run(cenario()) == 4
+    assert supabase.uso == 1
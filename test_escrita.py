@@ -0,0 +1,191 @@
+"""
+Testes das gravações agrupadas (buffer por linha + upsert em lote)
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+
+import pytest
+
+from app.escrita import EscritorAgrupado
+
+
+class _RepositorioFalso:
+    """Registra cada upsert e update; `falhar` recusa as próximas N requisições"""
+
+    def __init__(self, falhar=0):
+        self.upserts = []
+        self.atualizacoes = []
+        self.falhar = falhar
+        self.portao = None  # asyncio.Event que segura as requisições até ser liberado
+
+    def table(self, tabela):
+        repositorio = self
+
+        class _Consulta:
+            filtro = None
+
+            def upsert(self, dados, on_conflict=None):
+                self.dados = dados
+                self.on_conflict = on_conflict
+                return self
+
+            def update(self, dados):
+                self.dados = dados
+                return self
+
+            def eq(self, coluna, valor):
+                self.filtro = (coluna, "eq", valor)
+                return self
+
+            def in_(self, coluna, valores):
+                self.filtro = (coluna, "in", valores)
+                return self
+
+            async def execute(self):
+                await asyncio.sleep(0)
+                if repositorio.portao:
+                    await repositorio.portao.wait()
+                if repositorio.falhar:
+                    repositorio.falhar -= 1
+                    raise RuntimeError("HTTP 503")
+                if self.filtro:
+                    repositorio.atualizacoes.append((tabela, self.dados, self.filtro))
+                else:
+                    repositorio.upserts.append((tabela, self.dados, self.on_conflict))
+
+        return _Consulta()
+
+
+IDENTIDADE = {"cliente_id": "c1", "numero_car": "MS-1"}
+
+
+def test_alteracoes_da_mesma_linha_viram_um_upsert():
+    repositorio = _RepositorioFalso()
+
+    async def cenario():
+        escritor = EscritorAgrupado(repositorio, "duploa_consultas_car", intervalo=10)
+        escritor.alterar("a", {**IDENTIDADE, "status": "processando"})
+        escritor.alterar("a", {**IDENTIDADE, "municipio": "Campo Grande"})
+        escritor.alterar("a", {**IDENTIDADE, "status": "concluido"})
+        await escritor.descarregar("a")
+        await escritor.descarregar("a")  # Nada pendente: não grava de novo
+        return escritor.metricas()
+
+    metricas = asyncio.run(cenario())
+    assert repositorio.upserts == [(
+        "duploa_consultas_car",
+        {"id": "a", **IDENTIDADE, "status": "concluido", "municipio": "Campo Grande"},
+        "id"
+    )]
+    assert metricas == {"pendentes": 0, "alteracoes": 3, "requisicoes": 1, "linhas_gravadas": 1}
+
+
+def test_consultas_bulk_gravam_num_unico_lote():
+    repositorio = _RepositorioFalso()
+
+    async def consulta(escritor, i):
+        escritor.alterar(f"c{i}", {**IDENTIDADE, "status": "processando"})
+        await asyncio.sleep(0)
+        escritor.alterar(f"c{i}", {**IDENTIDADE, "status": "concluido", "shapefile_size": i})
+        await escritor.confirmar(f"c{i}")
+
+    async def cenario():
+        escritor = EscritorAgrupado(repositorio, "duploa_consultas_car", intervalo=0.01, max_lote=30)
+        await asyncio.gather(*(consulta(escritor, i) for i in range(50)))
+        return escritor.metricas()
+
+    metricas = asyncio.run(cenario())
+    # 100 alterações de 50 linhas: 2 requisições (lote limitado a 30 linhas) em vez de 100
+    assert metricas["alteracoes"] == 100
+    assert metricas["requisicoes"] == 2
+    assert [len(dados) for _, dados, _ in repositorio.upserts] == [30, 20]
+    gravadas = {linha["id"]: linha for _, dados, _ in repositorio.upserts for linha in dados}
+    assert gravadas["c7"]["shapefile_size"] == 7
+    assert all(linha["status"] == "concluido" for linha in gravadas.values())
+
+
+def test_lote_separa_linhas_por_conjunto_de_colunas():
+    repositorio = _RepositorioFalso()
+
+    async def cenario():
+        escritor = EscritorAgrupado(repositorio, "duploa_watchlist_car", intervalo=10)
+        escritor.alterar("w1", {**IDENTIDADE, "ultimo_status": "atualizado", "falhas_consecutivas": 0})
+        escritor.alterar("w2", {**IDENTIDADE, "ultimo_status": "erro", "falhas_consecutivas": 2})
+        escritor.alterar("w3", {**IDENTIDADE, "ultimo_status": "atualizado", "ultima_consulta_id": "x"})
+        await escritor.descarregar_tudo()
+
+    asyncio.run(cenario())
+    # Upsert em lote exige as mesmas colunas em todas as linhas da requisição
+    assert sorted(len(dados) if isinstance(dados, list) else 1 for _, dados, _ in repositorio.upserts) == [1, 2]
+
+
+def test_falha_devolve_ao_buffer_e_avisa_quem_aguarda():
+    repositorio = _RepositorioFalso(falhar=1)
+
+    async def cenario():
+        escritor = EscritorAgrupado(repositorio, "duploa_consultas_car", intervalo=0.01)
+        escritor.alterar("a", {**IDENTIDADE, "status": "concluido"})
+        with pytest.raises(RuntimeError):
+            await escritor.confirmar("a")
+
+        # A alteração não se perde: o próximo lote grava
+        escritor.alterar("a", {**IDENTIDADE, "municipio": "Dourados"})
+        await escritor.confirmar("a")
+
+    asyncio.run(cenario())
+    assert repositorio.upserts == [(
+        "duploa_consultas_car",
+        {"id": "a", **IDENTIDADE, "status": "concluido", "municipio": "Dourados"},
+        "id"
+    )]
+
+
+def test_somente_atualizar_nunca_insere():
+    repositorio = _RepositorioFalso()
+
+    async def cenario():
+        escritor = EscritorAgrupado(repositorio, "duploa_watchlist_car", intervalo=10, somente_atualizar=True)
+        escritor.alterar("w1", {"ultimo_status": "erro", "falhas_consecutivas": 1})
+        escritor.alterar("w2", {"ultimo_status": "erro", "falhas_consecutivas": 1})
+        escritor.alterar("w3", {"ultimo_status": "atualizado", "falhas_consecutivas": 0})
+        await escritor.descarregar_tudo()
+        return escritor.metricas()
+
+    metricas = asyncio.run(cenario())
+    assert repositorio.upserts == []
+    assert sorted(repositorio.atualizacoes, key=str) == sorted([
+        ("duploa_watchlist_car", {"ultimo_status": "erro", "falhas_consecutivas": 1}, ("id", "in", ["w1", "w2"])),
+        ("duploa_watchlist_car", {"ultimo_status": "atualizado", "falhas_consecutivas": 0}, ("id", "eq", "w3"))
+    ], key=str)
+    assert (metricas["requisicoes"], metricas["linhas_gravadas"]) == (2, 3)
+
+
+def test_confirmar_aguarda_o_lote_em_andamento():
+    repositorio = _RepositorioFalso(falhar=1)
+
+    async def gravando(escritor):
+        repositorio.portao = asyncio.Event()
+        lote = asyncio.create_task(escritor.descarregar_tudo())
+        await asyncio.sleep(0.01)  # Linha já saiu do buffer e está na requisição
+        confirmacao = asyncio.create_task(escritor.confirmar("a"))
+        await asyncio.sleep(0.01)
+        assert not confirmacao.done()
+        repositorio.portao.set()
+        await lote
+        return confirmacao
+
+    async def cenario():
+        escritor = EscritorAgrupado(repositorio, "duploa_consultas_car", intervalo=10)
+        escritor.alterar("a", {**IDENTIDADE, "status": "concluido"})
+
+        # A falha do lote em andamento chega a quem confirma
+        with pytest.raises(RuntimeError):
+            await (await gravando(escritor))
+
+        # Linha devolvida ao buffer: o próximo lote grava e libera quem confirma
+        await (await gravando(escritor))
+
+    asyncio.run(cenario())
+    assert len(repositorio.upserts) == 1
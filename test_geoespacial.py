@@ -0,0 +1,157 @@
+"""
+Testes das geometrias em PostGIS
+As funções SQL rodam contra um PostGIS local (docker-compose.postgis.yml) se
+POSTGIS_DSN estiver definido e psycopg instalado; senão, só os testes do cliente
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+import json
+import os
+import uuid
+
+import pytest
+
+from app.geoespacial import IndiceEspacial, extrair_geometria, feicoes_para_gravacao, interpretar_bbox
+from app.repositorio import ErroRepositorio
+
+
+def _quadrado(x, y, lado=0.01, propriedades=None):
+    anel = [[x, y], [x + lado, y], [x + lado, y + lado], [x, y + lado], [x, y]]
+    return {"type": "Feature", "properties": propriedades or {}, "geometry": {"type": "Polygon", "coordinates": [anel]}}
+
+
+def _colecao(*feicoes):
+    return {"type": "FeatureCollection", "name": "x", "crs": {}, "features": list(feicoes)}
+
+
+class _RepositorioRpc:
+    def __init__(self, falhar_em=None):
+        self.chamadas = []
+        self.falhar_em = falhar_em
+
+    def rpc(self, funcao, parametros):
+        repositorio = self
+
+        class _Chamada:
+            async def execute(self):
+                repositorio.chamadas.append((funcao, parametros))
+                if parametros.get("p_camada") == repositorio.falhar_em:
+                    raise ErroRepositorio("HTTP 400 parse error", status=400)
+
+                class _Resposta:
+                    data = len(parametros["p_geojson"]["features"])
+                return _Resposta()
+
+        return _Chamada()
+
+
+def test_gravacao_envia_cada_camada_so_com_geometria_e_propriedades():
+    repositorio = _RepositorioRpc()
+    camadas = {
+        "area_do_imovel": _colecao(_quadrado(0, 0, propriedades={"cod": 1})),
+        "app": _colecao(_quadrado(0, 0), {"type": "Feature", "properties": {}, "geometry": None})
+    }
+
+    indice = IndiceEspacial(repositorio)
+    gravadas = asyncio.run(indice.gravar("c-1", "PI-1", camadas))
+
+    assert gravadas == {"area_do_imovel": 1, "app": 1}
+    funcao, parametros = repositorio.chamadas[0]
+    assert funcao == "duploa_gravar_camada"
+    assert parametros["p_geojson"] == {
+        "type": "FeatureCollection",
+        "features": [{"geometry": camadas["area_do_imovel"]["features"][0]["geometry"], "properties": {"cod": 1}}]
+    }
+    assert indice.metricas() == {"camadas_gravadas": 2, "feicoes_gravadas": 2, "falhas": 0}
+
+    indice = IndiceEspacial(_RepositorioRpc(falhar_em="app"))
+    with pytest.raises(ErroRepositorio):
+        asyncio.run(indice.gravar("c-1", "PI-1", camadas))
+    assert indice.metricas()["falhas"] == 1
+
+
+def test_validacao_de_bbox_e_geometria():
+    assert interpretar_bbox("-43.5,-8.7,-43.1, -8.2") == (-43.5, -8.7, -43.1, -8.2)
+    for invalida in ("1,2,3", "a,b,c,d", "10,0,5,1", "0,0,200,1"):
+        with pytest.raises(ValueError):
+            interpretar_bbox(invalida)
+
+    feicao = _quadrado(0, 0)
+    assert extrair_geometria(feicao) is feicao["geometry"]
+    assert extrair_geometria(feicao["geometry"]) is feicao["geometry"]
+    for invalida in (_colecao(feicao), {"type": "Polygon", "coordinates": []}, "POLYGON((0 0))"):
+        with pytest.raises(ValueError):
+            extrair_geometria(invalida)
+    assert feicoes_para_gravacao(None)["features"] == []
+
+
+@pytest.fixture
+def postgis():
+    dsn = os.getenv("POSTGIS_DSN")
+    if not dsn:
+        pytest.skip("POSTGIS_DSN não definido (docker compose -f docker-compose.postgis.yml up -d)")
+    psycopg = pytest.importorskip("psycopg")
+
+    conexao = psycopg.connect(dsn, autocommit=True)
+    conexao.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+    conexao.execute("DROP SCHEMA IF EXISTS teste_geoespacial CASCADE")
+    conexao.execute("CREATE SCHEMA teste_geoespacial")
+    conexao.execute("SET search_path TO teste_geoespacial, public")
+    conexao.execute("CREATE TABLE duploa_consultas_car (id UUID PRIMARY KEY)")
+    with open("migrations/add_postgis_feicoes.sql", encoding="utf-8") as f:
+        conexao.execute(f.read())
+    try:
+        yield conexao
+    finally:
+        conexao.execute("DROP SCHEMA teste_geoespacial CASCADE")
+        conexao.close()
+
+
+def _gravar(conexao, numero_car, camada, colecao):
+    consulta_id = str(uuid.uuid4())
+    conexao.execute("INSERT INTO duploa_consultas_car (id) VALUES (%s)", (consulta_id,))
+    return conexao.execute(
+        "SELECT duploa_gravar_camada(%s, %s, %s, %s::jsonb)",
+        (numero_car, consulta_id, camada, json.dumps(feicoes_para_gravacao(colecao)))
+    ).fetchone()[0]
+
+
+def test_funcoes_sql_no_postgis(postgis):
+    # Quadrados de 0,01° no equador (~123 ha); B cobre metade de A, C fica longe
+    assert _gravar(postgis, "A", "area_do_imovel", _colecao(_quadrado(0, 0))) == 1
+    assert _gravar(postgis, "B", "area_do_imovel", _colecao(_quadrado(0.005, 0))) == 1
+    assert _gravar(postgis, "C", "area_do_imovel", _colecao(_quadrado(1, 1))) == 1
+    # Regravar substitui (só a geometria mais recente do imóvel)
+    assert _gravar(postgis, "A", "app", _colecao(_quadrado(0, 0, 0.002), _quadrado(0.004, 0, 0.002))) == 2
+    assert _gravar(postgis, "A", "app", _colecao(_quadrado(0, 0, 0.002))) == 1
+
+    areas = postgis.execute("SELECT camada, feicoes, area_ha FROM duploa_areas_imovel('A')").fetchall()
+    assert [(camada, feicoes) for camada, feicoes, _ in areas] == [("app", 1), ("area_do_imovel", 1)]
+    assert areas[1][2] == pytest.approx(123.1, rel=0.01)
+
+    na_caixa = postgis.execute(
+        "SELECT numero_car, bbox FROM duploa_imoveis_na_bbox(-0.1, -0.1, 0.1, 0.1)"
+    ).fetchall()
+    assert [linha[0] for linha in na_caixa] == ["A", "B"]
+    assert na_caixa[0][1] == pytest.approx([0, 0, 0.01, 0.01])
+
+    embargo = json.dumps(_quadrado(0, 0, 0.005)["geometry"])
+    intersecao = postgis.execute(
+        "SELECT numero_car, camada, area_intersecao_ha FROM duploa_intersecao(%s::jsonb, 'area_do_imovel')", (embargo,)
+    ).fetchall()
+    # B só toca a borda do embargo: intersecta, mas com área zero
+    assert [linha[0] for linha in intersecao] == ["A", "B"]
+    assert intersecao[0][2] == pytest.approx(123.1 / 4, rel=0.01)
+    assert intersecao[1][2] == 0
+
+    sobreposicoes = postgis.execute("SELECT * FROM duploa_sobreposicoes_imovel('A')").fetchall()
+    assert [linha[0] for linha in sobreposicoes] == ["B"]
+    assert sobreposicoes[0][1] == pytest.approx(123.1 / 2, rel=0.01)
+
+    postgis.execute("SET enable_seqscan = off")  # Tabela pequena: forçar para ver o índice disponível
+    plano = "\n".join(linha[0] for linha in postgis.execute(
+        "EXPLAIN SELECT * FROM duploa_feicoes_car WHERE geom && ST_MakeEnvelope(0, 0, 1, 1, 4326)"
+    ).fetchall())
+    assert "idx_feicoes_geom" in plano
@@ -0,0 +1,91 @@
+"""
+Testes da leitura de consultas (projeção, cursor e ETags)
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import pytest
+
+from app.leitura import (
+    CAMPOS_LISTAGEM,
+    codificar_cursor,
+    corresponde_etag,
+    decodificar_cursor,
+    etag_versoes,
+    filtro_apos_cursor,
+    projetar_campos
+)
+from app.repositorio import RepositorioSupabase
+
+
+def test_projecao_aceita_so_colunas_conhecidas():
+    assert projetar_campos(None, CAMPOS_LISTAGEM) == list(CAMPOS_LISTAGEM)
+    assert projetar_campos("status, camadas,status", (), obrigatorios=("id", "updated_at")) == [
+        "status", "camadas", "id", "updated_at"
+    ]
+    with pytest.raises(ValueError, match="geojson_layers"):
+        projetar_campos("id,geojson_layers", ())
+    with pytest.raises(ValueError):
+        projetar_campos("id,cliente_id->senha", ())
+
+
+def test_cursor_ida_e_volta():
+    linha = {"id": "7f8c0a4e-0000-4000-8000-000000000001", "created_at": "2024-05-01T12:00:00.123456"}
+    cursor = codificar_cursor(linha)
+    assert "=" not in cursor
+    assert decodificar_cursor(cursor) == (linha["created_at"], linha["id"])
+    for invalido in ("", "abc", codificar_cursor({"id": 1, "created_at": "x"})):
+        with pytest.raises(ValueError):
+            decodificar_cursor(invalido)
+
+
+def test_cursor_adulterado_nao_chega_ao_filtro():
+    """Valores do cursor viram filtro do PostgREST: só UUID e data ISO 8601"""
+    valido = {"id": "7f8c0a4e-0000-4000-8000-000000000001", "created_at": "2024-05-01T12:00:00+00:00"}
+    adulterados = [
+        {**valido, "id": "0),cliente_id.neq.(x"},
+        {**valido, "id": "1"},
+        {**valido, "created_at": '2024-05-01",cliente_id.neq."x'},
+        {**valido, "created_at": "ontem"},
+    ]
+    for linha in adulterados:
+        with pytest.raises(ValueError):
+            decodificar_cursor(codificar_cursor(linha))
+
+
+def test_pagina_seguinte_vai_num_unico_parametro_order():
+    consulta = RepositorioSupabase("https://x.supabase.co", "k").table("duploa_consultas_car").select(
+        "id"
+    ).eq("cliente_id", "c").or_(filtro_apos_cursor("2024-05-01T12:00:00", "abc")).order(
+        "created_at", desc=True
+    ).order("id", desc=True).limit(50)
+
+    assert consulta._params == [
+        ("select", "id"),
+        ("cliente_id", "eq.c"),
+        ("or", '(created_at.lt."2024-05-01T12:00:00",and(created_at.eq."2024-05-01T12:00:00",id.lt.abc))'),
+        ("order", "created_at.desc,id.desc"),
+        ("limit", "50")
+    ]
+
+
+def test_etag_muda_com_updated_at_projecao_e_pagina():
+    linhas = [{"id": "a", "updated_at": "t1", "status": "processando"}, {"id": "b", "updated_at": "t1"}]
+    etag = etag_versoes(["id", "status"], linhas)
+
+    # Só id + updated_at bastam para reproduzir o ETag (pré-checagem barata)
+    assert etag == etag_versoes(["id", "status"], [{"id": "a", "updated_at": "t1"}, {"id": "b", "updated_at": "t1"}])
+    assert etag.startswith('W/"')
+    assert etag != etag_versoes(["id", "status"], [{"id": "a", "updated_at": "t2"}, linhas[1]])
+    assert etag != etag_versoes(["id"], linhas)
+    assert etag != etag_versoes(["id", "status"], linhas[:1])
+
+
+def test_if_none_match():
+    etag = 'W/"abc"'
+    assert corresponde_etag('W/"abc"', etag)
+    assert corresponde_etag('"abc"', etag)  # Comparação fraca
+    assert corresponde_etag('"x", W/"abc"', etag)
+    assert corresponde_etag("*", etag)
+    assert not corresponde_etag('"abcd"', etag)
+    assert not corresponde_etag(None, etag)
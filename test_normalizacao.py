@@ -0,0 +1,84 @@
+"""
+Testes da normalização de números, datas e coordenadas do demonstrativo
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import pytest
+
+from app.normalizacao import (
+    COLUNAS_TIPADAS,
+    converter_area_ha,
+    converter_coordenada,
+    converter_data_br,
+    converter_numero_br,
+    extrair_uf,
+    normalizar_dados
+)
+
+
+def test_numeros_no_formato_brasileiro():
+    assert converter_numero_br("15.647,5361 ha") == 15647.5361
+    assert converter_numero_br("14,4012") == 14.4012
+    assert converter_numero_br("-1.234,50 ha") == -1234.5
+    assert converter_numero_br("1.234.567") == 1234567
+    assert converter_numero_br("8.5") == 8.5
+    assert converter_numero_br("0,0000 ha") == 0.0
+    assert converter_numero_br(12) == 12.0
+    for vazio in (None, "", "Não informado", True):
+        assert converter_numero_br(vazio) is None
+
+
+def test_areas_em_hectares():
+    assert converter_area_ha("15.647,5361 ha") == 15647.5361
+    assert converter_area_ha("2.500,00 m²") == 0.25
+    assert converter_area_ha("1,5 km²") == 150.0
+    assert converter_area_ha("12,5") == 12.5
+    assert converter_area_ha(None) is None
+
+
+def test_datas_e_coordenadas():
+    assert converter_data_br("03/11/2016") == "2016-11-03"
+    assert converter_data_br("3/1/2016 14:22:01") == "2016-01-03"
+    assert converter_data_br("31/02/2016") is None
+    assert converter_data_br(None) is None
+
+    assert converter_coordenada("-8.4512") == -8.4512
+    assert converter_coordenada("-43,3012") == -43.3012
+    assert converter_coordenada("08°27'04,32\" S") == pytest.approx(-8.4512)
+    assert converter_coordenada("43°18'04\" O") == pytest.approx(-43.3011111)
+    assert converter_coordenada("-8°27'04.32\"") == pytest.approx(-8.4512)
+
+    assert extrair_uf("Canto do Buriti / PI") == "PI"
+    assert extrair_uf("Canto do Buriti") is None
+
+
+def test_demonstrativo_vira_colunas_tipadas():
+    demonstrativo = {
+        "situacao_cadastro": "AT",
+        "dados_imovel_rural": {
+            "area_imovel_rural": "15.647,5361 ha",
+            "modulos_fiscais": "208,6338",
+            "municipio_uf": "Canto do Buriti / PI",
+            "coordenadas_geograficas": {"latitude": "-8.4512", "longitude": "-43.3012"},
+            "data_inscricao": "03/11/2016",
+            "data_ultima_retificacao": None
+        },
+        "cobertura_solo": {"area_remanescente_vegetacao_nativa": "12.000,1 ha"},
+        "regularidade_ambiental": {"passivo_excedente_reserva_legal": "-312,4400 ha"}
+    }
+
+    colunas = normalizar_dados("15.647,5361 ha", demonstrativo)
+    assert set(colunas) == set(COLUNAS_TIPADAS)
+    assert colunas["area_total_ha"] == colunas["area_imovel_ha"] == 15647.5361
+    assert colunas["modulos_fiscais"] == 208.6338
+    assert colunas["uf"] == "PI"
+    assert (colunas["latitude"], colunas["longitude"]) == (-8.4512, -43.3012)
+    assert colunas["data_inscricao"] == "2016-11-03"
+    assert colunas["area_vegetacao_nativa_ha"] == 12000.1
+    assert colunas["passivo_excedente_reserva_legal_ha"] == -312.44
+    assert colunas["data_ultima_retificacao"] is None and colunas["app_total_ha"] is None
+
+    # Sem área no popup: usa a do demonstrativo; sem demonstrativo: tudo None
+    assert normalizar_dados(None, demonstrativo)["area_total_ha"] == 15647.5361
+    assert set(normalizar_dados(None, None).values()) == {None}
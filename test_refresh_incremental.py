@@ -0,0 +1,39 @@
+"""
+Testes da comparação de cadastro usada pelo modo refresh
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+from app.utils import cadastro_foi_alterado
+
+
+def _demonstrativo(situacao, retificacao):
+    return {
+        "situacao_cadastro": situacao,
+        "dados_imovel_rural": {"data_ultima_retificacao": retificacao},
+    }
+
+
+def test_cadastro_sem_alteracao():
+    """Mesma situação e mesma data de retificação: reaproveitar shapefile"""
+    anterior = _demonstrativo("AT", "10/03/2023")
+    novo = _demonstrativo("AT", "10/03/2023")
+
+    assert not cadastro_foi_alterado(anterior, novo)
+
+
+def test_cadastro_retificado():
+    """Nova data de retificação ou mudança de situação exigem novo shapefile"""
+    anterior = _demonstrativo("AT", "10/03/2023")
+
+    assert cadastro_foi_alterado(anterior, _demonstrativo("AT", "02/07/2024"))
+    assert cadastro_foi_alterado(anterior, _demonstrativo("PE", "10/03/2023"))
+
+
+def test_comparacao_inconclusiva_considera_alterado():
+    """Demonstrativo ausente ou incompleto nunca reaproveita shapefile"""
+    anterior = _demonstrativo("AT", "10/03/2023")
+
+    assert cadastro_foi_alterado(anterior, {})
+    assert cadastro_foi_alterado(None, anterior)
+    assert cadastro_foi_alterado(anterior, _demonstrativo("AT", None))
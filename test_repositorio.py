@@ -0,0 +1,168 @@
+"""
+Testes do repositório assíncrono do Supabase
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.repositorio import ErroRepositorio, RepositorioSupabase
+
+
+class _RespostaHttp:
+    def __init__(self, status_code=200, corpo=None, headers=None):
+        self.status_code = status_code
+        self.content = json.dumps(corpo).encode() if corpo is not None else b""
+        self.text = self.content.decode()
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ConnectError(Exception):
+    """Mesmo nome da exceção do httpx para falha antes do envio"""
+
+
+class _ClienteFalso:
+    """Cliente HTTP assíncrono com latência e respostas programadas"""
+
+    def __init__(self, respostas=None, latencia=0.0):
+        self.respostas = list(respostas or [])
+        self.latencia = latencia
+        self.chamadas = []
+
+    async def request(self, metodo, caminho, params=None, json=None, content=None, headers=None):
+        self.chamadas.append({"metodo": metodo, "caminho": caminho, "params": params, "json": json, "headers": headers})
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+        resposta = self.respostas.pop(0) if self.respostas else _RespostaHttp(corpo=[])
+        if isinstance(resposta, Exception):
+            raise resposta
+        return resposta
+
+    async def aclose(self):
+        pass
+
+
+def _repositorio(cliente, **kwargs):
+    return RepositorioSupabase("https://x.supabase.co", "chave", backoff_inicial=0.001, cliente=cliente, **kwargs)
+
+
+def test_consulta_monta_parametros_do_postgrest():
+    cliente = _ClienteFalso([_RespostaHttp(corpo=[{"id": 1}], headers={"content-range": "0-0/42"})])
+
+    async def cenario():
+        return await _repositorio(cliente).table("duploa_watchlist_car").select(
+            "id, numero_car", count="exact"
+        ).eq("ativo", True).lte("proxima_verificacao", "2024-01-01").order("proxima_verificacao").limit(100).execute()
+
+    resposta = asyncio.run(cenario())
+    chamada = cliente.chamadas[0]
+    assert (resposta.data, resposta.count) == ([{"id": 1}], 42)
+    assert chamada["caminho"] == "/rest/v1/duploa_watchlist_car"
+    assert chamada["params"] == [
+        ("select", "id,numero_car"), ("ativo", "eq.true"), ("proxima_verificacao", "lte.2024-01-01"),
+        ("order", "proxima_verificacao.asc"), ("limit", "100")
+    ]
+    assert chamada["headers"] == {"Prefer": "count=exact"}
+
+
+def test_leitura_repete_5xx_mas_insert_nao():
+    async def cenario():
+        cliente = _ClienteFalso([_RespostaHttp(503), _RespostaHttp(502), _RespostaHttp(corpo=[{"id": 1}])])
+        repositorio = _repositorio(cliente)
+        resposta = await repositorio.table("t").select("id").execute()
+        assert resposta.data == [{"id": 1}]
+        assert repositorio.metricas()["retentativas"] == 2
+
+        cliente = _ClienteFalso([_RespostaHttp(503)])
+        with pytest.raises(ErroRepositorio) as erro:
+            await _repositorio(cliente).table("t").insert({"a": 1}).execute()
+        assert erro.value.status == 503
+        assert len(cliente.chamadas) == 1
+
+        # Falha de conexão: a requisição nem saiu, então o insert pode ser repetido
+        cliente = _ClienteFalso([ConnectError("recusada"), _RespostaHttp(201, [{"id": 2}])])
+        resposta = await _repositorio(cliente).table("t").insert({"a": 1}).execute()
+        assert resposta.data == [{"id": 2}]
+
+    asyncio.run(cenario())
+
+
+def test_timeout_por_tentativa():
+    async def cenario():
+        cliente = _ClienteFalso(latencia=0.2)
+        repositorio = _repositorio(cliente, timeout=0.02, max_tentativas=2)
+        with pytest.raises(ErroRepositorio):
+            await repositorio.table("t").select("id").execute()
+        assert len(cliente.chamadas) == 2
+
+    asyncio.run(cenario())
+
+
+def _lag_maximo(sessoes, trabalho):
+    """Maior atraso do event loop (ms) enquanto `sessoes` executam `trabalho` 5 vezes cada"""
+
+    async def cenario():
+        atrasos = []
+        parar = asyncio.Event()
+
+        async def medidor():
+            loop = asyncio.get_running_loop()
+            while not parar.is_set():
+                inicio = loop.time()
+                await asyncio.sleep(0.005)
+                atrasos.append((loop.time() - inicio - 0.005) * 1000)
+
+        async def sessao():
+            for _ in range(5):
+                await trabalho()
+                await asyncio.sleep(0)
+
+        tarefa_medidor = asyncio.create_task(medidor())
+        await asyncio.sleep(0.01)
+        await asyncio.gather(*(sessao() for _ in range(sessoes)))
+        parar.set()
+        await tarefa_medidor
+        return max(atrasos)
+
+    return asyncio.run(cenario())
+
+
+def test_lag_do_event_loop_estavel_com_sessoes_concorrentes():
+    """Requisições reais do httpx (transporte simulado com latência) não travam o loop"""
+    httpx = pytest.importorskip("httpx")
+
+    def _repositorio_httpx(atender):
+        cliente = httpx.AsyncClient(base_url="https://x.supabase.co", transport=httpx.MockTransport(atender))
+        return _repositorio(cliente)
+
+    async def latencia_assincrona(requisicao):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json=[{"id": "x"}])
+
+    def latencia_bloqueante(requisicao):
+        time.sleep(0.05)  # Como o cliente síncrono: a espera da rede trava o loop
+        return httpx.Response(200, json=[{"id": "x"}])
+
+    def atualizar(repositorio):
+        async def trabalho():
+            resposta = await repositorio.table("duploa_consultas_car").update(
+                {"status": "processando"}
+            ).eq("id", "x").execute()
+            assert resposta.data == [{"id": "x"}]
+        return trabalho
+
+    assincrono = _repositorio_httpx(latencia_assincrona)
+    inicio = time.monotonic()
+    assert _lag_maximo(20, atualizar(assincrono)) < 50
+    # 20 sessões x 5 requisições de 50 ms em paralelo, não 5 s em série
+    assert time.monotonic() - inicio < 2
+    assert assincrono.metricas()["requisicoes"] == 100
+
+    assert _lag_maximo(2, atualizar(_repositorio_httpx(latencia_bloqueante))) > 40
@@ -0,0 +1,111 @@
+"""
+Testes dos resultados parciais da conversão de shapefile
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+import json
+import zipfile
+
+from app import shapefile_processor
+from app.camadas import resumir_camadas, resumo_parcial_camada
+from app.sessoes import SessaoConsulta
+
+
+def test_cada_camada_e_entregue_assim_que_converte(tmp_path, monkeypatch):
+    caminho_zip = tmp_path / "SHAPE.zip"
+    with zipfile.ZipFile(caminho_zip, "w") as zip_ref:
+        for pasta in ("AREA_IMOVEL", "APP", "RESERVA_LEGAL"):
+            zip_ref.writestr(f"{pasta}/{pasta}.shp", b"")
+
+    convertidas = []
+    entregues = []
+
+    def converter_falso(shp_path):
+        nome = shapefile_processor._extrair_nome_camada(shp_path)
+        # A camada anterior já foi entregue antes desta começar a converter
+        assert [n for n, _ in entregues] == convertidas
+        convertidas.append(nome)
+        return {"type": "FeatureCollection", "features": [], "nome": nome}
+
+    monkeypatch.setattr(shapefile_processor, "_converter_shp_para_geojson", converter_falso)
+
+    camadas = shapefile_processor.processar_shapefile_car(
+        str(caminho_zip),
+        lambda nome, geojson: entregues.append((nome, geojson))
+    )
+
+    assert sorted(camadas) == ["app", "area_imovel", "reserva_legal"]
+    assert [nome for nome, _ in entregues] == convertidas
+    assert all(camadas[nome] is geojson for nome, geojson in entregues)
+
+
+def test_falha_no_callback_nao_interrompe_conversao(tmp_path, monkeypatch):
+    caminho_zip = tmp_path / "SHAPE.zip"
+    with zipfile.ZipFile(caminho_zip, "w") as zip_ref:
+        zip_ref.writestr("APP/APP.shp", b"")
+
+    monkeypatch.setattr(
+        shapefile_processor, "_converter_shp_para_geojson",
+        lambda shp_path: {"type": "FeatureCollection", "features": []}
+    )
+
+    def callback_quebrado(nome, geojson):
+        raise RuntimeError("conexão caiu")
+
+    camadas = shapefile_processor.processar_shapefile_car(str(caminho_zip), callback_quebrado)
+    assert list(camadas) == ["app"]
+
+
+def test_buffer_de_retomada_nao_guarda_geometria(tmp_path, monkeypatch):
+    caminho_zip = tmp_path / "SHAPE.zip"
+    pastas = ("AREA_IMOVEL", "APP", "RESERVA_LEGAL", "VEGETACAO_NATIVA")
+    with zipfile.ZipFile(caminho_zip, "w") as zip_ref:
+        for pasta in pastas:
+            zip_ref.writestr(f"{pasta}/{pasta}.shp", b"")
+
+    def poligono(i):
+        anel = [[-43.0 + j * 1e-5, -8.0 + i * 1e-5] for j in range(200)] + [[-43.0, -8.0 + i * 1e-5]]
+        return {"type": "Feature", "properties": {"id": i}, "geometry": {"type": "Polygon", "coordinates": [anel]}}
+
+    # ~1 MB de GeoJSON por camada
+    monkeypatch.setattr(
+        shapefile_processor, "_converter_shp_para_geojson",
+        lambda shp_path: {"type": "FeatureCollection", "features": [poligono(i) for i in range(250)]}
+    )
+
+    async def cenario():
+        sessao = SessaoConsulta("PI-1", "cliente-1")
+        loop = asyncio.get_running_loop()
+        envios = []
+
+        def parcial(parte, dados, camada):
+            return sessao.emitir({"type": "partial_result", "parte": parte, "camada": camada, "data": dados})
+
+        # Como no download: resumo de cada camada assim que converte, numa thread
+        def camada_convertida(nome, geojson):
+            envios.append(asyncio.run_coroutine_threadsafe(
+                parcial("camada", resumo_parcial_camada(geojson), nome), loop
+            ))
+
+        camadas = await asyncio.to_thread(shapefile_processor.processar_shapefile_car, str(caminho_zip), camada_convertida)
+        await asyncio.gather(*(asyncio.wrap_future(envio) for envio in envios))
+
+        # Como no executor: URL/ETag de cada camada armazenada
+        for nome, entrada in resumir_camadas("consulta-1", camadas).items():
+            await parcial("camada", entrada, nome)
+        return sessao, camadas
+
+    sessao, camadas = asyncio.run(cenario())
+
+    eventos = list(sessao._eventos)
+    assert len(eventos) == 2 * len(pastas)
+    tamanho_geojson = sum(len(json.dumps(geojson)) for geojson in camadas.values())
+    tamanho_buffer = sum(len(json.dumps(evento.mensagem)) for evento in eventos)
+    assert tamanho_geojson > 4_000_000
+    assert tamanho_buffer < 4_000
+    assert all("features" not in evento.mensagem["data"] for evento in eventos)
+    armazenadas = {evento.mensagem["camada"]: evento.mensagem["data"] for evento in eventos[len(pastas):]}
+    assert armazenadas["app"]["url"] == "/api/consultas/consulta-1/camadas/app"
+    assert armazenadas["app"]["feicoes"] == 250
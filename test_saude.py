@@ -0,0 +1,113 @@
+"""
+Testes do monitor de saúde (sondas em segundo plano e readiness)
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+
+from app.armazenamento import StorageLocal
+from app.saude import MonitorSaude, SondaIndisponivel
+
+
+def test_snapshot_le_o_cache_sem_chamar_as_sondas():
+    chamadas = []
+
+    async def supabase():
+        chamadas.append("supabase")
+
+    async def cenario():
+        monitor = MonitorSaude(intervalo=60, timeout=1)
+        monitor.registrar("supabase", supabase)
+        pendente = monitor.motivos_nao_pronto()
+        await monitor.verificar_todas()
+        snapshots = [monitor.snapshot() for _ in range(50)]
+        return monitor, pendente, snapshots
+
+    monitor, pendente, snapshots = asyncio.run(cenario())
+    assert pendente == ["supabase: ainda não verificado"]
+    assert chamadas == ["supabase"]  # 50 leituras, uma verificação
+    assert snapshots[-1]["status"] == "healthy"
+    assert snapshots[-1]["checks"]["supabase"]["status"] == "ok"
+    assert monitor.motivos_nao_pronto() == []
+
+
+def test_falha_critica_tira_prontidao_e_nao_critica_nao():
+    async def falha():
+        raise ConnectionError("recusado")
+
+    async def lenta():
+        await asyncio.sleep(1)
+
+    async def cheia():
+        raise SondaIndisponivel("25 consultas aguardando navegador", {"fila": 25})
+
+    async def cenario(criticas):
+        monitor = MonitorSaude(intervalo=60, timeout=0.05)
+        monitor.registrar("storage", falha, critica=criticas)
+        monitor.registrar("portal", lenta, critica=criticas)
+        monitor.registrar("navegadores", cheia, critica=criticas)
+        await monitor.verificar_todas()
+        return monitor
+
+    monitor = asyncio.run(cenario(True))
+    checks = monitor.snapshot()["checks"]
+    assert monitor.snapshot()["status"] == "degraded"
+    assert checks["storage"]["erro"] == "ConnectionError: recusado"
+    assert checks["portal"]["erro"] == "timeout após 0.05s"
+    assert checks["navegadores"]["status"] == "indisponivel"
+    assert checks["navegadores"]["detalhes"] == {"fila": 25}
+    assert len(monitor.motivos_nao_pronto()) == 3
+
+    monitor = asyncio.run(cenario(False))
+    assert monitor.snapshot()["status"] == "healthy"
+    assert monitor.motivos_nao_pronto() == []
+
+
+def test_resultado_antigo_e_encerramento_tiram_prontidao():
+    async def ok():
+        return None
+
+    async def cenario():
+        monitor = MonitorSaude(intervalo=10, timeout=1, max_atrasos=3)
+        monitor.registrar("supabase", ok)
+        await monitor.verificar_todas()
+        monitor.sondas["supabase"].verificado_em -= 31  # Laço travado há 31 s
+        atrasada = monitor.motivos_nao_pronto()
+        await monitor.verificar_todas()
+        recuperada = monitor.motivos_nao_pronto()
+        monitor.drenar()
+        return atrasada, recuperada, monitor.motivos_nao_pronto()
+
+    atrasada, recuperada, drenando = asyncio.run(cenario())
+    assert atrasada == ["supabase: última verificação há 31s"]
+    assert recuperada == []
+    assert drenando == ["encerrando"]
+
+
+def test_laco_em_segundo_plano_atualiza_e_para():
+    verificacoes = []
+
+    async def sonda():
+        verificacoes.append(1)
+        return {"n": len(verificacoes)}
+
+    async def cenario():
+        monitor = MonitorSaude(intervalo=0.01, timeout=1)
+        monitor.registrar("fila_captcha", sonda, critica=False)
+        await monitor.iniciar()
+        await asyncio.sleep(0.1)
+        await monitor.parar()
+        parado_em = len(verificacoes)
+        await asyncio.sleep(0.05)
+        return monitor, parado_em
+
+    monitor, parado_em = asyncio.run(cenario())
+    assert parado_em > 2 and len(verificacoes) == parado_em
+    assert monitor.snapshot()["checks"]["fila_captcha"]["detalhes"] == {"n": parado_em}
+
+
+def test_sonda_do_storage_local(tmp_path):
+    detalhes = asyncio.run(StorageLocal(tmp_path / "storage").verificar("car-shapefiles"))
+    assert detalhes["bucket"] == "car-shapefiles" and detalhes["livre_mb"] >= 0
+    assert (tmp_path / "storage").is_dir()
@@ -0,0 +1,159 @@
+"""
+Testes do agendamento fora de pico da watchlist
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+import json
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from app.repositorio import RepositorioSupabase
+from app.scheduler import (
+    AgendadorWatchlist,
+    OrcamentoPortal,
+    calcular_proxima_verificacao,
+    esta_na_janela
+)
+
+FUSO = ZoneInfo("America/Sao_Paulo")
+
+
+def test_janela_atravessando_meia_noite():
+    """Janela 22h-6h inclui 23h e 5h, mas não 6h nem 12h"""
+    dia = datetime(2024, 5, 10, tzinfo=FUSO)
+
+    assert esta_na_janela(dia.replace(hour=23), 22, 6)
+    assert esta_na_janela(dia.replace(hour=5), 22, 6)
+    assert not esta_na_janela(dia.replace(hour=6), 22, 6)
+    assert not esta_na_janela(dia.replace(hour=12), 22, 6)
+
+
+def test_proxima_verificacao_sempre_na_janela_e_apos_intervalo():
+    """Próxima verificação respeita o intervalo e cai dentro da janela"""
+    agora = datetime(2024, 5, 10, 14, 30, tzinfo=FUSO)
+
+    for i in range(200):
+        numero_car = f"SC-4215075-{i:032X}"
+        proxima = calcular_proxima_verificacao(agora, 24, numero_car, 0, 6)
+
+        assert proxima >= agora + timedelta(hours=24)
+        assert proxima < agora + timedelta(hours=48)
+        assert esta_na_janela(proxima, 0, 6)
+
+
+def test_proxima_verificacao_espalha_pela_janela():
+    """CARs diferentes ocupam posições diferentes da janela"""
+    agora = datetime(2024, 5, 10, 14, 30, tzinfo=FUSO)
+
+    horas = {
+        calcular_proxima_verificacao(agora, 0, f"MT-5107925-{i:032X}", 0, 6).hour
+        for i in range(200)
+    }
+
+    assert horas == {0, 1, 2, 3, 4, 5}
+
+
+def test_orcamento_portal():
+    """Orçamento esgota e é reposto proporcionalmente ao tempo"""
+    relogio = [0.0]
+    orcamento = OrcamentoPortal(por_hora=2, relogio=lambda: relogio[0])
+
+    assert orcamento.tentar_consumir()
+    assert orcamento.tentar_consumir()
+    assert not orcamento.tentar_consumir()
+
+    relogio[0] += 1800  # meia hora = 1 token
+    assert orcamento.tentar_consumir()
+    assert not orcamento.tentar_consumir()
+
+
+class _Resposta:
+    def __init__(self, corpo):
+        self.status_code = 200
+        self.content = json.dumps(corpo).encode()
+        self.text = self.content.decode()
+        self.headers = {"content-range": f"0-0/{len(corpo)}"}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class _ClienteWatchlist:
+    """PostgREST falso: devolve os itens vencidos e registra consultas e PATCHes"""
+
+    def __init__(self, itens):
+        self.itens = itens
+        self.consultas = []
+        self.atualizacoes = []
+
+    async def request(self, metodo, caminho, params=None, json=None, content=None, headers=None):
+        if metodo == "GET":
+            self.consultas.append(dict(params))
+            return _Resposta(self.itens)
+        self.atualizacoes.append((dict(params), json))
+        return _Resposta([])
+
+    async def aclose(self):
+        pass
+
+
+class _FilaCaptcha:
+    def __init__(self, operadores_online):
+        self.operadores_online = operadores_online
+
+
+ITEM = {
+    "id": "w1", "cliente_id": "c1", "numero_car": "PI-1", "intervalo_horas": 168,
+    "proxima_verificacao": "2024-01-01T00:00:00+00:00", "falhas_consecutivas": 2
+}
+
+
+def _agendador(cliente, executar_consulta, operadores_online=False):
+    return AgendadorWatchlist(
+        supabase=RepositorioSupabase("https://x.supabase.co", "chave", cliente=cliente),
+        executar_consulta=executar_consulta,
+        janela_inicio=0,
+        janela_fim=24,
+        fila_captcha=_FilaCaptcha(operadores_online)
+    )
+
+
+def test_cadastro_alterado_sem_operador_fica_parado_sem_contar_falha():
+    cliente = _ClienteWatchlist([ITEM])
+
+    async def executar_consulta(resolver_captcha, **kwargs):
+        await resolver_captcha(b"png")
+
+    async def cenario():
+        agendador = _agendador(cliente, executar_consulta)
+        await agendador._executar_item(ITEM)
+        return agendador.metricas()
+
+    metricas = asyncio.run(cenario())
+    filtro, atualizacao = cliente.atualizacoes[0]
+    assert filtro == {"id": "eq.w1"}
+    # Sem backoff nem falha: o item continua vencido, só esperando um operador
+    assert atualizacao["ultimo_status"] == "pendente_captcha"
+    assert "falhas_consecutivas" not in atualizacao and "proxima_verificacao" not in atualizacao
+    assert (metricas["falhas"], metricas["aguardando_operador"]) == (0, 1)
+
+
+def test_itens_pendentes_de_captcha_nao_gastam_orcamento_sem_operador():
+    for operadores_online in (False, True):
+        cliente = _ClienteWatchlist([])
+
+        async def cenario():
+            agendador = _agendador(cliente, None, operadores_online)
+            await agendador._tick()
+            return agendador.orcamento.disponivel
+
+        disponivel = asyncio.run(cenario())
+        filtro = cliente.consultas[0].get("or")
+        if operadores_online:
+            assert filtro is None
+        else:
+            assert filtro == "(ultimo_status.is.null,ultimo_status.neq.pendente_captcha)"
+        assert disponivel == 30
+
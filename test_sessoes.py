@@ -0,0 +1,196 @@
+"""
+Testes das sessões retomáveis de consulta
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+import json
+
+from app.captcha_imagem import desempacotar_frame
+from app.sessoes import ConexaoWebSocket, GerenciadorSessoes
+
+
+class _WebSocketFalso:
+    def __init__(self, atraso: float = 0.0):
+        self.enviados = []
+        self.caiu = False
+        self.atraso = atraso
+
+    async def send_json(self, mensagem):
+        if self.atraso:
+            await asyncio.sleep(self.atraso)
+        if self.caiu:
+            raise RuntimeError("conexão fechada")
+        self.enviados.append(mensagem)
+
+    async def send_text(self, texto):
+        await self.send_json(json.loads(texto))
+
+    async def send_bytes(self, dados):
+        if self.caiu:
+            raise RuntimeError("conexão fechada")
+        self.enviados.append(desempacotar_frame(dados))
+
+
+def test_retomada_reenvia_eventos_perdidos_e_captcha_pendente():
+    async def cenario():
+        gerenciador = GerenciadorSessoes(carencia=5)
+        sessao = gerenciador.criar("MS-1", "cliente-a")
+
+        ws1 = _WebSocketFalso()
+        conexao1 = ConexaoWebSocket(ws1)
+        await sessao.anexar(conexao1)
+        await sessao.emitir({"type": "progress", "etapa": "inicio"})
+        await sessao.emitir({"type": "captcha_required", "captcha_id": "c1"}, imagem=b"png")
+        await conexao1.esvaziar()
+        assert [m["seq"] for m in ws1.enviados] == [1, 2]
+        assert ws1.enviados[1]["image"] == "cG5n"
+
+        # Conexão cai: o envio falha mas o scraper não vê erro
+        ws1.caiu = True
+        await sessao.emitir({"type": "progress", "etapa": "captcha"})
+        await asyncio.sleep(0.01)
+        assert not sessao.conectada
+
+        ws2 = _WebSocketFalso()
+        retomada = gerenciador.obter(sessao.token, "cliente-a")
+        assert retomada is sessao
+        conexao2 = ConexaoWebSocket(ws2, captcha_binario=True)
+        await sessao.anexar(conexao2, ultimo_seq=2)
+        await conexao2.esvaziar()
+
+        # Evento 3 (perdido) e o CAPTCHA ainda pendente, como frame binário
+        assert ws2.enviados[0]["seq"] == 3
+        cabecalho, imagem = ws2.enviados[1]
+        assert (cabecalho["captcha_id"], cabecalho["seq"], imagem) == ("c1", 2, b"png")
+        assert sessao.retomadas == 1
+        assert sessao.captcha_pendente_id == "c1"
+
+    asyncio.run(cenario())
+
+
+def test_carencia_expirada_sinaliza_abandono():
+    async def cenario():
+        gerenciador = GerenciadorSessoes(carencia=0.05)
+        sessao = gerenciador.criar("MS-1", "cliente-a")
+        conexao = ConexaoWebSocket(_WebSocketFalso())
+        await sessao.anexar(conexao)
+
+        sessao.desanexar(conexao)
+        await asyncio.wait_for(sessao.abandonada.wait(), timeout=1)
+        assert gerenciador.metricas()["expiradas"] == 1
+
+        # Em andamento continua retomável; após concluir e expirar some
+        assert gerenciador.obter(sessao.token) is sessao
+        sessao.finalizar()
+        await asyncio.sleep(0.1)
+        assert gerenciador.obter(sessao.token) is None
+
+    asyncio.run(cenario())
+
+
+def test_retomada_dentro_da_carencia_cancela_abandono():
+    async def cenario():
+        sessao = GerenciadorSessoes(carencia=0.05).criar("MS-1", "cliente-a")
+        conexao = ConexaoWebSocket(_WebSocketFalso())
+        await sessao.anexar(conexao)
+        sessao.desanexar(conexao)
+
+        await sessao.anexar(ConexaoWebSocket(_WebSocketFalso()), ultimo_seq=0)
+        await asyncio.sleep(0.1)
+        assert not sessao.abandonada.is_set()
+
+    asyncio.run(cenario())
+
+
+def test_token_de_outro_cliente_nao_retoma():
+    async def cenario():
+        gerenciador = GerenciadorSessoes()
+        sessao = gerenciador.criar("MS-1", "cliente-a")
+        assert gerenciador.obter(sessao.token, "cliente-b") is None
+        assert gerenciador.obter("token-invalido") is None
+
+    asyncio.run(cenario())
+
+
+def test_canais_multiplexados_marcam_job_id():
+    async def cenario():
+        gerenciador = GerenciadorSessoes()
+        ws = _WebSocketFalso()
+        trava = asyncio.Lock()
+
+        sessoes = [gerenciador.criar(f"MS-{i}", "cliente-a") for i in range(3)]
+        conexoes = [ConexaoWebSocket(ws, job_id=sessao.id, trava=trava) for sessao in sessoes]
+        for sessao, conexao in zip(sessoes, conexoes):
+            await sessao.anexar(conexao)
+
+        await asyncio.gather(*(
+            sessao.emitir({"type": "progress", "etapa": "busca"}) for sessao in sessoes
+        ))
+        await asyncio.gather(*(conexao.esvaziar() for conexao in conexoes))
+        assert sorted(m["job_id"] for m in ws.enviados) == sorted(s.id for s in sessoes)
+
+        assert gerenciador.obter_por_id(sessoes[0].id, "cliente-a") is sessoes[0]
+        assert gerenciador.obter_por_id(sessoes[0].id, "cliente-b") is None
+
+    asyncio.run(cenario())
+
+
+def test_cancelar_interrompe_tarefa_da_sessao():
+    async def cenario():
+        sessao = GerenciadorSessoes().criar("MS-1", "cliente-a")
+        sessao.tarefa = asyncio.create_task(asyncio.sleep(10))
+        await asyncio.sleep(0)
+
+        assert sessao.cancelar()
+        await asyncio.gather(sessao.tarefa, return_exceptions=True)
+        assert sessao.tarefa.cancelled()
+        assert not sessao.cancelar()
+
+    asyncio.run(cenario())
+
+
+def test_fila_de_saida_agrupa_progresso_e_preserva_criticos():
+    async def cenario():
+        sessao = GerenciadorSessoes().criar("MS-1", "cliente-a")
+        ws = _WebSocketFalso()
+        conexao = ConexaoWebSocket(ws, max_fila=3)
+        await sessao.anexar(conexao)
+
+        # Sem ceder o loop, nada foi enviado ainda: progresso se substitui
+        for i in range(10):
+            await sessao.emitir({"type": "progress", "etapa": "busca", "i": i})
+        await sessao.emitir({"type": "captcha_required", "captcha_id": "c1"})
+        await sessao.emitir({"type": "warning", "message": "a"})
+        await sessao.emitir({"type": "progress", "etapa": "download", "i": 10})
+        await sessao.emitir({"type": "completed", "data": {}})
+        await conexao.esvaziar()
+
+        tipos = [m["type"] for m in ws.enviados]
+        assert tipos[-1] == "completed"
+        assert {"captcha_required", "warning", "completed"} <= set(tipos)
+        assert [m["i"] for m in ws.enviados if m["type"] == "progress"] in ([], [10])
+        assert conexao.coalescidos >= 9
+
+    asyncio.run(cenario())
+
+
+def test_cliente_lento_nao_bloqueia_emissao_e_recebe_lotes():
+    async def cenario():
+        sessao = GerenciadorSessoes().criar("MS-1", "cliente-a")
+        ws = _WebSocketFalso(atraso=0.05)
+        conexao = ConexaoWebSocket(ws, lotes=True)
+        await sessao.anexar(conexao)
+
+        inicio = asyncio.get_running_loop().time()
+        for i in range(20):
+            await sessao.emitir({"type": "warning", "message": str(i)})
+        assert asyncio.get_running_loop().time() - inicio < 0.05
+
+        await conexao.esvaziar()
+        assert ws.enviados[0]["type"] == "lote"
+        recebidos = [m for lote in ws.enviados for m in lote.get("eventos", [lote])]
+        assert [m["seq"] for m in recebidos] == list(range(1, 21))
+
+    asyncio.run(cenario())
@@ -0,0 +1,229 @@
+"""
+Testes da entrega de webhooks contra um servidor HTTP local
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import asyncio
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from app.webhooks import EntregadorWebhook, ObservadorMarcos, assinar, validar_url_callback
+
+SEGREDO = "segredo-teste"
+
+
+class _Stub:
+    """Servidor HTTP local que registra os webhooks e responde com status programados"""
+
+    def __init__(self, respostas=None):
+        self.recebidos = []
+        self.respostas = list(respostas or [])
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                corpo = self.rfile.read(int(self.headers["Content-Length"]))
+                stub.recebidos.append((self.headers, corpo))
+                status = stub.respostas.pop(0) if stub.respostas else 200
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.servidor = HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.servidor.server_port}/webhook"
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    def fechar(self):
+        self.servidor.shutdown()
+
+
+async def _enviar_urllib(url, corpo, cabecalhos):
+    def enviar():
+        requisicao = urllib.request.Request(url, data=corpo, headers=cabecalhos, method="POST")
+        try:
+            with urllib.request.urlopen(requisicao, timeout=5) as resposta:
+                return resposta.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return await asyncio.to_thread(enviar)
+
+
+@pytest.fixture
+def stub():
+    servidor = _Stub()
+    yield servidor
+    servidor.fechar()
+
+
+def _entregador(url, enviar=_enviar_urllib, **kwargs):
+    return EntregadorWebhook(url, SEGREDO, "job-1", enviar=enviar, backoff_inicial=0.01, **kwargs)
+
+
+def test_eventos_agrupados_em_lote_e_assinados(stub):
+    async def cenario():
+        entregador = _entregador(stub.url, intervalo_lote=0.2)
+        entregador.iniciar()
+        for etapa in ("busca", "extracao", "demonstrativo"):
+            entregador.adicionar({"type": "progress", "etapa": etapa})
+        await asyncio.sleep(0.4)
+        entregador.adicionar({"type": "completed", "consulta_id": "c1"})
+        await asyncio.wait_for(entregador.aguardar(), timeout=5)
+
+    asyncio.run(cenario())
+
+    assert len(stub.recebidos) == 2
+    lotes = [json.loads(corpo) for _, corpo in stub.recebidos]
+    assert [len(lote["eventos"]) for lote in lotes] == [3, 1]
+    assert [lote["final"] for lote in lotes] == [False, True]
+
+    cabecalhos, corpo = stub.recebidos[1]
+    assert cabecalhos["X-RoboCAR-Assinatura"] == assinar(SEGREDO, cabecalhos["X-RoboCAR-Timestamp"], corpo)
+
+
+def test_evento_final_sai_sem_esperar_janela(stub):
+    async def cenario():
+        entregador = _entregador(stub.url, intervalo_lote=30)
+        entregador.iniciar()
+        entregador.adicionar({"type": "progress", "etapa": "busca"})
+        entregador.adicionar({"type": "error", "message": "falhou"})
+        await asyncio.wait_for(entregador.aguardar(), timeout=5)
+
+    asyncio.run(cenario())
+    assert len(stub.recebidos) == 1
+
+
+def test_retentativa_com_backoff_em_erro_5xx():
+    stub = _Stub(respostas=[503, 500, 200])
+    try:
+        async def cenario():
+            entregador = _entregador(stub.url)
+            entregador.iniciar()
+            entregador.adicionar({"type": "completed"})
+            await asyncio.wait_for(entregador.aguardar(), timeout=5)
+            return entregador
+
+        entregador = asyncio.run(cenario())
+    finally:
+        stub.fechar()
+
+    assert entregador.tentativas == 3
+    assert entregador.lotes_entregues == 1
+    # Mesmo lote (idempotência do lado do cliente)
+    assert len({cabecalhos["X-RoboCAR-Lote"] for cabecalhos, _ in stub.recebidos}) == 1
+
+
+def test_erro_4xx_nao_repete():
+    stub = _Stub(respostas=[400])
+    try:
+        async def cenario():
+            entregador = _entregador(stub.url)
+            entregador.iniciar()
+            entregador.adicionar({"type": "completed"})
+            await asyncio.wait_for(entregador.aguardar(), timeout=5)
+            return entregador
+
+        entregador = asyncio.run(cenario())
+    finally:
+        stub.fechar()
+
+    assert (entregador.tentativas, entregador.lotes_descartados) == (1, 1)
+
+
+def test_observador_repassa_so_marcos():
+    class _Coletor:
+        eventos = []
+
+        def adicionar(self, evento):
+            self.eventos.append(evento)
+
+    coletor = _Coletor()
+    observador = ObservadorMarcos(coletor)
+    observador({"type": "progress", "etapa": "busca", "mensagem": "a"}, 1)
+    observador({"type": "progress", "etapa": "busca", "mensagem": "b"}, 2)
+    observador({"type": "queued", "posicao": 2}, 3)
+    observador({"type": "captcha_required", "captcha_id": "c1"}, 4)
+    observador({"type": "completed"}, 5)
+
+    assert [e["seq"] for e in coletor.eventos] == [1, 4, 5]
+
+
+def test_envio_padrao_httpx(stub):
+    pytest.importorskip("httpx")
+
+    async def cenario():
+        entregador = EntregadorWebhook(stub.url, SEGREDO, "job-1")
+        entregador.iniciar()
+        entregador.adicionar({"type": "completed"})
+        await asyncio.wait_for(entregador.aguardar(), timeout=5)
+
+    asyncio.run(cenario())
+    assert len(stub.recebidos) == 1
+
+
+def test_consulta_interrompida_encerra_entrega_do_webhook(stub, monkeypatch):
+    for modulo in ("fastapi", "playwright", "supabase"):
+        pytest.importorskip(modulo)
+    monkeypatch.setenv("SUPABASE_URL", "http://127.0.0.1:1")
+    monkeypatch.setenv("SUPABASE_SERVICE_KEY", "teste")
+    from app import main
+    from app.sessoes import SessaoConsulta
+
+    async def executar_consulta(**kwargs):
+        raise main.ConsultaInterrompida("Cliente desconectado e nenhum operador disponível para o CAPTCHA")
+
+    monkeypatch.setattr(main, "executar_consulta", executar_consulta)
+
+    async def cenario():
+        sessao = SessaoConsulta("PI-1", "cliente-1")
+        entregador = _entregador(stub.url, intervalo_lote=30)
+        sessao.observar(ObservadorMarcos(entregador))
+        main.entregas_webhook[sessao.id] = entregador
+        entregador.iniciar().add_done_callback(lambda _: main.entregas_webhook.pop(sessao.id, None))
+
+        await main._executar_sessao(sessao, "completo", "interativa")
+        await asyncio.wait_for(entregador.aguardar(), timeout=5)
+        await asyncio.sleep(0)
+        return sessao
+
+    sessao = asyncio.run(cenario())
+
+    assert sessao.id not in main.entregas_webhook
+    lote = json.loads(stub.recebidos[-1][1])
+    assert lote["final"] is True
+    assert lote["eventos"][-1]["type"] == "error"
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://93.184.216.34/hook",
+    "file:///etc/passwd",
+    "http://127.0.0.1:8000/hook",
+    "http://localhost/hook",
+    "http://10.0.0.5/hook",
+    "http://192.168.1.10/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://0.0.0.0/hook",
+])
+def test_callback_para_rede_interna_e_recusado(url):
+    with pytest.raises(ValueError):
+        asyncio.run(validar_url_callback(url))
+
+
+def test_callback_publico_e_aceito():
+    url = "https://93.184.216.34/hooks/car"
+    assert asyncio.run(validar_url_callback(url)) == url
+
+
+def test_rede_interna_liberada_so_por_configuracao(stub):
+    assert asyncio.run(validar_url_callback(stub.url, permitir_rede_interna=True)) == stub.url
+    with pytest.raises(ValueError):
+        asyncio.run(validar_url_callback("ftp://localhost/", permitir_rede_interna=True))
@@ -80,25 +80,23 @@ async def testar_websocket_car():
                         print(f"{'=' * 80}")
 
                         consulta_id = data.get("consulta_id")
-                        info_popup = data.get("info_popup", {})
-                        geojson_layers = data.get("geojson_layers", {})
+                        resumo = data.get("resumo", {})
+                        camadas = data.get("camadas", {})
 
                         print(f"\n[ID] Consulta ID: {consulta_id}")
 
-                        print(f"\n[INFO] Dados do Popup:")
-                        for key, value in info_popup.items():
+                        print(f"\n[INFO] Resumo:")
+                        for key, value in resumo.items():
                             print(f"   - {key}: {value}")
 
-                        print(f"\n[GEOJSON] Camadas GeoJSON:")
-                        if geojson_layers:
-                            for layer_name, geojson in geojson_layers.items():
-                                features = geojson.get("features", [])
-                                metadata = geojson.get("metadata", {})
+                        print(f"\n[GEOJSON] Camadas GeoJSON (buscar em cada url):")
+                        if camadas:
+                            for layer_name, camada in camadas.items():
                                 print(f"   - {layer_name}:")
-                                print(f"      * Features: {len(features)}")
-                                print(f"      * Total features: {metadata.get('total_features')}")
-                                print(f"      * Bounds: {metadata.get('bounds')}")
-                                print(f"      * CRS: {metadata.get('crs')}")
+                                print(f"      * Features: {camada.get('feicoes')}")
+                                print(f"      * Bytes: {camada.get('bytes')}")
+                                print(f"      * Bounds: {camada.get('bbox')}")
+                                print(f"      * URL: {camada.get('url')}")
                         else:
                             print("   [!] Nenhuma camada GeoJSON encontrada")
 
@@ -0,0 +1,71 @@
+"""
+Treina o modelo do solucionador automático de CAPTCHA
+Lê CAPTCHAs rotulados (arquivos "<texto>_<id>.png", gravados pelo backend em
+CAPTCHA_AMOSTRAS_DIR quando o portal aceita a resposta), separa uma parte para
+validação e mostra a precisão por limiar de confiança antes de salvar
+
+Uso:
+    python treinar_captcha.py <pasta_amostras> [modelo_saida.json] [--validacao 0.2]
+"""
+import sys
+sys.path.insert(0, 'backend')
+
+import argparse
+import random
+from pathlib import Path
+
+from app.captcha_solver import ModeloCaptcha, carregar_pixels
+
+
+def carregar_amostras(pasta: str):
+    amostras = []
+    for arquivo in sorted(Path(pasta).glob("*.png")):
+        texto = arquivo.stem.split("_", 1)[0]
+        if not texto:
+            continue
+        try:
+            amostras.append((carregar_pixels(arquivo.read_bytes()), texto))
+        except Exception as e:
+            print(f"[WARN] Ignorando {arquivo.name}: {e}")
+    return amostras
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Treina o modelo de CAPTCHA")
+    parser.add_argument("pasta_amostras")
+    parser.add_argument("saida", nargs="?", default="modelos/captcha_modelo.json")
+    parser.add_argument("--validacao", type=float, default=0.2, help="Fração das amostras para validação")
+    args = parser.parse_args()
+
+    amostras = carregar_amostras(args.pasta_amostras)
+    if not amostras:
+        print("[ERROR] Nenhuma amostra encontrada")
+        sys.exit(1)
+
+    random.Random(42).shuffle(amostras)
+    corte = int(len(amostras) * (1 - args.validacao))
+    treino, validacao = amostras[:corte], amostras[corte:]
+    print(f"[*] {len(amostras)} amostras ({len(treino)} treino, {len(validacao)} validação)")
+
+    modelo = ModeloCaptcha.treinar(treino)
+    print(f"[*] {len(modelo.exemplos)} caracteres, texto com {modelo.tamanho_texto} caracteres")
+
+    if validacao:
+        previsoes = [(modelo.prever(pixels), texto) for pixels, texto in validacao]
+        print("\n  limiar  cobertura  precisão")
+        for limiar in (0.0, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7):
+            respondidas = [(previsto, texto) for (previsto, confianca), texto in previsoes if previsto and confianca >= limiar]
+            acertos = sum(1 for previsto, texto in respondidas if previsto.lower() == texto.lower())
+            cobertura = len(respondidas) / len(previsoes)
+            precisao = acertos / len(respondidas) if respondidas else 0.0
+            print(f"  {limiar:>6.1f}  {cobertura:>9.1%}  {precisao:>8.1%}")
+
+        # Modelo final usa todas as amostras
+        modelo = ModeloCaptcha.treinar(amostras)
+
+    modelo.salvar(args.saida)
+    print(f"\n[OK] Modelo salvo em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()